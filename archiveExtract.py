@@ -0,0 +1,112 @@
+import argparse
+import contextlib
+import csv
+import gzip
+import json
+import sys
+
+from helper import SongInfoExtractor, required_song_info
+
+SECTION_FIELDS = ('Album', 'Label', 'Released')
+
+
+def open_archive(path):
+  """
+  Open a JSONL archive of Shazam responses for reading, gunzipping `.gz`
+  files on the fly. '-' reads from stdin, which is left open.
+  """
+  if path == '-':
+    return contextlib.nullcontext(sys.stdin)
+  if path.endswith('.gz'):
+    return gzip.open(path, 'rt', encoding='utf-8')
+  return open(path, encoding='utf-8')
+
+
+def iter_archive(path, extractor=None):
+  """
+  Stream song information out of a JSONL archive of Shazam responses.
+
+  Only one line (one response) is held in memory at a time, so the archive
+  can be arbitrarily large.
+
+  Args:
+  - path: The JSONL archive, optionally gzipped
+  - extractor: The SongInfoExtractor to apply to each response
+
+  Returns:
+  - A generator of (line number, song info) tuples. Lines that are blank or
+    not valid JSON are reported on stderr and skipped.
+  """
+  extractor = extractor or SongInfoExtractor(required_song_info)
+  with open_archive(path) as archive:
+    for number, line in enumerate(archive, 1):
+      if not line.strip():
+        continue
+      try:
+        response = json.loads(line)
+      except ValueError as error:
+        print(f"{path}:{number}: skipping invalid record ({error})",
+              file=sys.stderr)
+        continue
+      yield number, extractor(response)
+
+
+def extract_archive(path, output, output_format='csv', fields=None,
+                    extractor=None):
+  """
+  Write the song information of every archived response as a compact table.
+
+  Args:
+  - path: The JSONL archive, optionally gzipped
+  - output: A text file object to write to
+  - output_format: 'csv' or 'jsonl'
+  - fields: The CSV columns, defaults to the mapping keys followed by the
+    SONG section fields
+  - extractor: The SongInfoExtractor to apply to each response
+
+  Returns:
+  - The number of records written
+  """
+  extractor = extractor or SongInfoExtractor(required_song_info)
+  if output_format == 'csv':
+    if fields is None:
+      fields = [key for key in extractor.song_metadata if key != 'sections']
+      fields += [field for field in SECTION_FIELDS if field not in fields]
+    writer = csv.DictWriter(output, ['line'] + list(fields),
+                            extrasaction='ignore')
+    writer.writeheader()
+
+    def write(number, song_info):
+      writer.writerow(dict(song_info, line=number))
+  elif output_format == 'jsonl':
+
+    def write(number, song_info):
+      output.write(json.dumps(dict(song_info, line=number),
+                              ensure_ascii=False, separators=(',', ':')))
+      output.write('\n')
+  else:
+    raise ValueError(f"Unsupported output format: {output_format}")
+
+  written = 0
+  for number, song_info in iter_archive(path, extractor):
+    write(number, song_info)
+    written += 1
+  return written
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+      description='Extract song information from a JSONL archive of Shazam '
+      'responses.')
+  parser.add_argument('archive', help="JSONL file (.gz allowed, '-' for stdin)")
+  parser.add_argument('-o', '--output', help='output file, defaults to stdout')
+  parser.add_argument('-f', '--format', choices=('csv', 'jsonl'),
+                      default='csv')
+  parser.add_argument('--fields', help='comma separated CSV columns')
+  args = parser.parse_args()
+
+  fields = args.fields.split(',') if args.fields else None
+  with (open(args.output, 'w', newline='', encoding='utf-8')
+        if args.output else contextlib.nullcontext(sys.stdout)) as output:
+    count = extract_archive(args.archive, output, args.format, fields)
+  print(f"{count} records extracted", file=sys.stderr)
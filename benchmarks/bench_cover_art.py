@@ -0,0 +1,73 @@
+"""
+Fetch the cover art of a library against a local stand-in HTTP server, one
+request per track versus the CoverArtFetcher (pooled session, per-album
+dedupe, disk cache).
+
+Usage:
+  python benchmarks/bench_cover_art.py [tracks] [tracks per album] [workers]
+"""
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aiohttp  # noqa: E402
+
+from coverArt import CoverArtFetcher  # noqa: E402
+from fakeShazam import CoverArtServer, make_shazam_response  # noqa: E402
+from helper import get_required_song_info  # noqa: E402
+
+
+async def run(fetch, songs, workers):
+  queue = asyncio.Queue()
+  for song_info in songs:
+    queue.put_nowait(song_info)
+
+  async def worker():
+    while not queue.empty():
+      await fetch(queue.get_nowait())
+
+  started = time.perf_counter()
+  await asyncio.gather(*(worker() for _ in range(workers)))
+  return time.perf_counter() - started
+
+
+async def per_track(song_info):
+  # A new session, and connection, for every track's art
+  async with aiohttp.ClientSession() as session, \
+      session.get(song_info['coverArt']) as response:
+    return await response.read()
+
+
+async def bench(tracks, album_size, workers):
+  with CoverArtServer(latency=0.02) as server:
+    songs = [get_required_song_info(make_shazam_response(
+        index, album=index // album_size, image_base=server.url))
+             for index in range(tracks)]
+    print(f"{tracks} tracks, {album_size} per album, {workers} workers")
+
+    elapsed = await run(per_track, songs, workers)
+    print(f"per-track download     {server.requests:>6} requests "
+          f"in {elapsed:.2f}s")
+
+    folder = tempfile.mkdtemp(prefix='bench_cover_art_')
+    try:
+      for run_name in ('fetcher (cold cache)', 'fetcher (warm cache)'):
+        server.requests = 0
+        async with CoverArtFetcher(folder) as fetcher:
+          elapsed = await run(fetcher.fetch, songs, workers)
+        print(f"{run_name:<22} {server.requests:>6} requests "
+              f"in {elapsed:.2f}s  {fetcher.stats()}")
+    finally:
+      shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+  tracks = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+  album_size = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+  workers = int(sys.argv[3]) if len(sys.argv) > 3 else 16
+  asyncio.run(bench(tracks, album_size, workers))
@@ -0,0 +1,67 @@
+"""
+Micro-benchmark for `helper.get_required_song_info`.
+
+Compares `SongInfoExtractor`, whose paths are compiled once with
+`compile_path`, with the previous per-call interpretation of the
+`required_song_info` mapping, and `get_required_song_info` with a mapping
+other than the default one (compiled on the first call, then reused).
+
+Usage:
+  python benchmarks/bench_extract.py [records]
+"""
+import os
+import sys
+import time
+import urllib.parse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fakeShazam import make_shazam_response  # noqa: E402
+from helper import SongInfoExtractor, get_required_song_info, required_song_info  # noqa: E402
+
+
+def interpret_song_info(shazamData, song_metadata=required_song_info):
+  """The mapping interpretation `get_required_song_info` used to do."""
+  song_info = {}
+  for key, keys in song_metadata.items():
+    info = shazamData
+    for nested_key in keys:
+      if isinstance(info, dict):
+        info = info.get(nested_key)
+      elif not isinstance(info, list):
+        info = None
+        break
+    if info is not None:
+      if isinstance(info, str):
+        song_info[key] = urllib.parse.unquote_plus(info)
+      elif key == 'sections':
+        for item in info[0]['metadata']:
+          song_info[item['title']] = item['text']
+  return song_info
+
+
+def measure(name, extract, records, repeat=7):
+  elapsed = float('inf')
+  for _ in range(repeat):
+    started = time.perf_counter()
+    for record in records:
+      extract(record)
+    elapsed = min(elapsed, time.perf_counter() - started)
+  print(f"{name:<12} {len(records) / elapsed:>12,.0f} records/s")
+  return elapsed
+
+
+if __name__ == '__main__':
+  count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+  records = [make_shazam_response(index, lyrics_lines=0)
+             for index in range(count)]
+  extractor = SongInfoExtractor(required_song_info)
+  assert extractor(records[0]) == interpret_song_info(records[0])
+
+  print(f"{count} synthetic responses")
+  legacy = measure('interpreted', interpret_song_info, records)
+  compiled = measure('compiled', extractor, records)
+  mapping = dict(required_song_info)
+  measure('custom map', lambda record: get_required_song_info(record, mapping),
+          records)
+  print(f"speed-up     {legacy / compiled:>12.2f}x")
@@ -0,0 +1,73 @@
+"""
+Benchmark the header-only ID3 reader against `get_music_metadata` (eyed3).
+
+Usage:
+  python benchmarks/bench_id3.py [files] [workers]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import eyed3  # noqa: E402
+import eyed3.id3  # noqa: E402
+
+from fastId3 import read_music_metadata, read_music_metadata_bulk  # noqa: E402
+from songMetadata import get_music_metadata  # noqa: E402
+
+# One silent MPEG-1 layer III frame, 128 kbps, 44.1 kHz
+SILENT_FRAME = b'\xff\xfb\x90\x64' + b'\x00' * 413
+
+
+def make_fixtures(folder, count, seconds=180):
+  """Write `count` tagged MP3 files of `seconds` of silence."""
+  template = os.path.join(folder, 'template.mp3')
+  with open(template, 'wb') as music_file:
+    music_file.write(SILENT_FRAME * int(seconds * 44100 / 1152))
+  paths = []
+  for index in range(count):
+    path = os.path.join(folder, f'track-{index:06d}.mp3')
+    shutil.copyfile(template, path)
+    tag = eyed3.id3.Tag()
+    tag.title = f'Track {index}'
+    tag.artist = f'Artist {index % 97}'
+    tag.album = f'Album {index % 499}'
+    tag.publisher = 'Label'
+    tag.genre = 'Dance'
+    tag.recording_date = eyed3.core.Date(1990 + index % 35)
+    tag.save(path)
+    paths.append(path)
+  os.remove(template)
+  return paths
+
+
+def measure(name, read, paths):
+  started = time.perf_counter()
+  read(paths)
+  elapsed = time.perf_counter() - started
+  print(f"{name:<24} {len(paths) / elapsed:>10,.0f} files/s")
+  return elapsed
+
+
+if __name__ == '__main__':
+  count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+  workers = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+  folder = tempfile.mkdtemp(prefix='bench_id3_')
+  try:
+    paths = make_fixtures(folder, count)
+    print(f"{count} tagged MP3 files of 3 minutes")
+    slow = measure('eyed3 get_music_metadata',
+                   lambda paths: [get_music_metadata(path) for path in paths],
+                   paths)
+    fast = measure('fastId3 sequential',
+                   lambda paths: [read_music_metadata(path) for path in paths],
+                   paths)
+    measure(f'fastId3 bulk ({workers} threads)',
+            lambda paths: list(read_music_metadata_bulk(paths, workers)),
+            paths)
+    print(f"speed-up (sequential)    {slow / fast:>10.1f}x")
+  finally:
+    shutil.rmtree(folder)
@@ -0,0 +1,97 @@
+"""
+Build a tracklist of a simulated hour-long mix with windows every
+`resolution` seconds versus the coarse-to-fine MixRecognizer, and report the
+recognition requests, missed tracks and the error of the track starts.
+
+The mix is simulated: windows are not decoded, `fakeShazam.FakeShazam`
+answers with the track playing in the middle of each window and the offset
+into it, give or take two seconds.
+
+Usage:
+  python benchmarks/bench_mix.py [mix seconds] [seed]
+"""
+import asyncio
+import bisect
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fakeShazam import FakeShazam, make_shazam_response  # noqa: E402
+from mixTracklist import MIX_RESOLUTION, MixRecognizer  # noqa: E402
+
+
+def make_mix(seconds, rng):
+  """
+  Returns:
+  - The start, end and track index of each play; index None is a stretch
+    without music (talk, applause)
+  """
+  plays = []
+  start = 0.0
+  while start < seconds:
+    length = rng.uniform(150, 420)
+    index = None if rng.random() < 0.05 else len(plays)
+    plays.append((start, min(seconds, start + length), index))
+    start += length
+  return plays
+
+
+class SimulatedMix(MixRecognizer):
+
+  def __init__(self, shazam, plays, **kwargs):
+    super().__init__(shazam, **kwargs)
+    self.plays = plays
+
+  def duration(self, musicFile):  # noqa: ARG002
+    return self.plays[-1][1]
+
+  def load_window(self, musicFile, start):  # noqa: ARG002
+    return start
+
+
+def responder(plays, window_seconds, rng):
+  starts = [play[0] for play in plays]
+
+  def respond(window_start):
+    middle = window_start + window_seconds / 2
+    start, _, index = plays[bisect.bisect_right(starts, middle) - 1]
+    if index is None:
+      return {'matches': []}
+    out = make_shazam_response(index, lyrics_lines=0)
+    # Matches are off by a second or two, like real ones
+    out['matches'][0]['offset'] = window_start - start + rng.uniform(-2, 2)
+    return out
+  return respond
+
+
+async def bench(name, plays, **kwargs):
+  shazam = FakeShazam(latency=0.001, jitter=0.0)
+  recognizer = SimulatedMix(shazam, plays, **kwargs)
+  shazam.responses = responder(plays, recognizer.window_seconds,
+                               random.Random(0))
+  started = time.perf_counter()
+  tracks = await recognizer.tracklist('mix')
+  elapsed = time.perf_counter() - started
+
+  expected = {str(400000000 + index): start
+              for start, _, index in plays if index is not None}
+  found = {track['song_info']['trackKey']: track['start'] for track in tracks}
+  errors = [abs(found[key] - start) for key, start in expected.items()
+            if key in found]
+  print(f"{name:<16} {recognizer.windows_sent:>5} requests, "
+        f"{len(found)}/{len(expected)} tracks, start error mean "
+        f"{sum(errors) / max(1, len(errors)):.1f}s max "
+        f"{max(errors, default=0):.1f}s in {elapsed:.2f}s")
+
+
+if __name__ == '__main__':
+  seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 3600
+  seed = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+  plays = make_mix(seconds, random.Random(seed))
+  print(f"{seconds:.0f}s mix, {len(plays)} plays")
+  asyncio.run(bench(f'every {MIX_RESOLUTION}s', plays,
+                    stride=MIX_RESOLUTION))
+  asyncio.run(bench('coarse to fine', plays))
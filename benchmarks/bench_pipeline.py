@@ -0,0 +1,107 @@
+"""
+Benchmark each stage of the recognize -> extract -> tag -> rename pipeline,
+and whole-folder runs of `catalog_library`, on synthetic tagged MP3 files.
+
+Shazam is replaced by a FakeShazam that answers instantly with a synthetic
+response per file, so only the local stages are measured. Every stage runs
+once per library size and reports its throughput and per-file latency.
+
+Usage:
+  python benchmarks/bench_pipeline.py [files ...]
+
+  e.g. `python benchmarks/bench_pipeline.py 100 10000 100000`; the default is
+  100 and 10000 files. The fixtures need about 17 KB of disk per file.
+"""
+import asyncio
+import contextlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_id3 import make_fixtures  # noqa: E402
+
+from fakeShazam import FakeShazam, make_shazam_response  # noqa: E402
+from helper import get_required_song_info  # noqa: E402
+from main import catalog_library  # noqa: E402
+from songMetadata import MUSIC_FOLDER, editMusicTag, renameSongTrack  # noqa: E402
+
+FIXTURE_SECONDS = 1
+
+
+def percentile(latencies, fraction):
+  return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))]
+
+
+def report(stage, count, elapsed, latencies=None):
+  line = f"{stage:<24} {count / elapsed:>10,.0f} files/s"
+  if latencies:
+    latencies = sorted(latencies)
+    line += ''.join(f"  p{int(fraction * 100)} "
+                    f"{percentile(latencies, fraction) * 1e3:>8.3f} ms"
+                    for fraction in (0.5, 0.95, 0.99))
+  print(line)
+
+
+def measure(stage, call, arguments):
+  """Call `call(*args)` for each tuple of arguments, timing every call."""
+  latencies = []
+  results = []
+  started = time.perf_counter()
+  for args in arguments:
+    call_started = time.perf_counter()
+    results.append(call(*args))
+    latencies.append(time.perf_counter() - call_started)
+  report(stage, len(latencies), time.perf_counter() - started, latencies)
+  return results
+
+
+def bench(count, workspace):
+  # editMusicTag moves the tagged files to MUSIC_FOLDER, which is relative
+  # to the working directory
+  os.chdir(workspace)
+  source = os.path.join(workspace, 'source')
+  renamed = os.path.join(workspace, 'renamed')
+  for folder in (source, renamed, MUSIC_FOLDER):
+    os.makedirs(folder)
+
+  started = time.perf_counter()
+  paths = make_fixtures(source, count, FIXTURE_SECONDS)
+  print(f"{count} tagged MP3 files of {FIXTURE_SECONDS}s "
+        f"(written in {time.perf_counter() - started:.1f}s)")
+
+  responses = [make_shazam_response(index) for index in range(count)]
+  songs = measure('get_required_song_info', get_required_song_info,
+                  ((response, ) for response in responses))
+
+  filenames = measure('editMusicTag', editMusicTag,
+                      zip(songs, paths, strict=True))
+  measure('renameSongTrack', renameSongTrack,
+          ((os.path.join(MUSIC_FOLDER, filename), renamed)
+           for filename in filenames))
+
+  # The files are tagged again and moved back to MUSIC_FOLDER
+  with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+    stats = asyncio.run(catalog_library(renamed, report_interval=None,
+                                        shazam=FakeShazam(latency=0.0,
+                                                          jitter=0.0),
+                                        newFolder=MUSIC_FOLDER))
+  report('catalog_library', stats['catalogued'], stats['elapsed'])
+  if stats['failed']:
+    print(f"{stats['failed']} files failed")
+
+
+if __name__ == '__main__':
+  counts = [int(count) for count in sys.argv[1:]] or [100, 10000]
+  cwd = os.getcwd()
+  for count in counts:
+    workspace = tempfile.mkdtemp(prefix='bench_pipeline_')
+    try:
+      bench(count, workspace)
+    finally:
+      os.chdir(cwd)
+      shutil.rmtree(workspace)
+    print()
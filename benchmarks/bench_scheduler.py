@@ -0,0 +1,72 @@
+"""
+Run recognitions against a throttling FakeShazam with and without the
+RecognitionScheduler.
+
+The fake backend serves `capacity` requests at a time; beyond that every
+request slows down and the extra ones fail with a 429, and a few requests
+fail or hang at random.
+
+Usage:
+  python benchmarks/bench_scheduler.py [requests] [workers] [capacity]
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fakeShazam import FakeShazam  # noqa: E402
+from recognitionScheduler import AdaptiveLimiter, CircuitBreaker, RecognitionScheduler  # noqa: E402
+
+
+async def run(recognizer, requests, workers):
+  queue = asyncio.Queue()
+  for index in range(requests):
+    queue.put_nowait(f'track-{index}.mp3')
+  results = {'ok': 0, 'failed': 0}
+
+  async def worker():
+    while not queue.empty():
+      musicFile = queue.get_nowait()
+      try:
+        await asyncio.wait_for(recognizer.recognize_song(musicFile), 10)
+        results['ok'] += 1
+      except Exception:
+        results['failed'] += 1
+
+  started = time.perf_counter()
+  await asyncio.gather(*(worker() for _ in range(workers)))
+  results['seconds'] = time.perf_counter() - started
+  return results
+
+
+def backend(capacity):
+  return FakeShazam(latency=0.05, jitter=0.02, error_rate=0.02,
+                    capacity=capacity, hang_rate=0.005, seed=1)
+
+
+async def bench(requests, workers, capacity):
+  fake = backend(capacity)
+  naive = await run(fake, requests, workers)
+  print(f"fixed concurrency {workers:>3}: {naive['ok']} ok, "
+        f"{naive['failed']} failed in {naive['seconds']:.1f}s, "
+        f"{fake.failures} backend errors")
+
+  fake = backend(capacity)
+  scheduler = RecognitionScheduler(
+      fake, AdaptiveLimiter(initial=4, maximum=workers, latency_target=0.2),
+      CircuitBreaker(failure_threshold=10, reset_timeout=0.5), timeout=1.0,
+      backoff=0.05, max_backoff=1.0)
+  scheduled = await run(scheduler, requests, workers)
+  print(f"adaptive (max {workers:>3})   : {scheduled['ok']} ok, "
+        f"{scheduled['failed']} failed in {scheduled['seconds']:.1f}s, "
+        f"{fake.failures} backend errors")
+  print(f"scheduler {scheduler.stats()}")
+
+
+if __name__ == '__main__':
+  requests = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+  workers = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+  capacity = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+  asyncio.run(bench(requests, workers, capacity))
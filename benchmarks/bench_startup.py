@@ -0,0 +1,85 @@
+"""
+Measure the wall time of starting the command line tools, the way cron jobs
+and shell scripts pay for it: a fresh interpreter per invocation.
+
+Each command runs in a temporary folder holding a small catalog, so queries
+have something to read. The modules loaded by the heaviest imports are
+listed with `python -X importtime`.
+
+Usage:
+  python benchmarks/bench_startup.py [runs]
+"""
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fakeShazam import make_shazam_response  # noqa: E402
+from helper import get_required_song_info  # noqa: E402
+from musicCatalog import MusicCatalog  # noqa: E402
+
+CLI = os.path.join(ROOT, 'cli.py')
+COMMANDS = (
+    ('interpreter', ['-c', 'pass']),
+    ('import main', ['-c', 'import main']),
+    ('cli --help', [CLI, '--help']),
+    ('cli stats', [CLI, 'stats']),
+    ('cli query', [CLI, 'query', '--artist', 'Artist 7']),
+    ('cli query --count', [CLI, 'query', '--count', 'genre']),
+    ('musicCatalog.py query', [os.path.join(ROOT, 'musicCatalog.py'),
+                               'query', '--artist', 'Artist 7']),
+    ('import shazamio, eyed3', ['-c', 'import shazamio, eyed3']),
+)
+
+
+def timed_run(arguments, folder, env):
+  started = time.perf_counter()
+  subprocess.run([sys.executable, '-W', 'ignore'] + arguments, cwd=folder,
+                 env=env, check=True, stdout=subprocess.DEVNULL)
+  return time.perf_counter() - started
+
+
+def slowest_imports(arguments, folder, env, count=5):
+  result = subprocess.run(
+      [sys.executable, '-W', 'ignore', '-X', 'importtime'] + arguments,
+      cwd=folder, env=env, check=True, stdout=subprocess.DEVNULL,
+      stderr=subprocess.PIPE, text=True)
+  imports = []
+  for line in result.stderr.splitlines():
+    parts = line.split('|')
+    # Top-level imports only, their time includes what they import
+    if (len(parts) == 3 and parts[1].strip().isdigit()
+        and not parts[2].startswith('  ')):
+      imports.append((int(parts[1]), parts[2].strip()))
+  return sorted(imports, reverse=True)[:count]
+
+
+if __name__ == '__main__':
+  runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+  env = dict(os.environ, PYTHONPATH=ROOT)
+  folder = tempfile.mkdtemp(prefix='bench_startup_')
+  try:
+    with MusicCatalog(os.path.join(folder, 'catalog.sqlite')) as catalog:
+      for index in range(1000):
+        catalog.add_track(get_required_song_info(
+            make_shazam_response(index, lyrics_lines=0)), f'{index}.mp3')
+
+    print(f"median of {runs} runs")
+    for name, arguments in COMMANDS:
+      times = [timed_run(arguments, folder, env) for _ in range(runs)]
+      print(f"{name:<24} {statistics.median(times) * 1000:>7.1f} ms  "
+            f"(min {min(times) * 1000:.1f} ms)")
+
+    for name, arguments in COMMANDS[1:4]:
+      slowest = ', '.join(f"{module} {micros / 1000:.0f} ms"
+                          for micros, module in
+                          slowest_imports(arguments, folder, env))
+      print(f"{name}: {slowest}")
+  finally:
+    shutil.rmtree(folder)
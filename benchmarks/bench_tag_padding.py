@@ -0,0 +1,63 @@
+"""
+Re-tag a library three times, each time with longer values, and count the
+tags written in place versus the files rewritten, with eyed3's stock 256
+bytes of padding and with `songMetadata.TAG_PADDING` (set as eyed3's
+`DEFAULT_PADDING` when songMetadata is imported).
+
+Usage:
+  python benchmarks/bench_tag_padding.py [files] [seconds per file]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import eyed3.id3.tag  # noqa: E402
+from bench_id3 import make_fixtures  # noqa: E402
+
+import songMetadata  # noqa: E402
+from songMetadata import tag_write_stats, writeSongInfo  # noqa: E402
+
+EDITS = 3
+STOCK_PADDING = 256
+
+
+def song_info(index, edit):
+  # Every edit adds about 600 bytes to the tag, more than eyed3's padding
+  suffix = ' (Extended Mix)' * (20 * (edit + 1))
+  return {'trackTitle': f'Track {index}{suffix}',
+          'trackArtist': f'Artist {index % 97}',
+          'Album': f'Album {index % 499}{suffix}',
+          'Label': f'Label {index % 211}'}
+
+
+def bench(paths, padding):
+  eyed3.id3.tag.DEFAULT_PADDING = padding
+  print(f"padding {padding} bytes")
+  for edit in range(EDITS):
+    before = tag_write_stats()
+    started = time.perf_counter()
+    for index, path in enumerate(paths):
+      writeSongInfo(song_info(index, edit), path)
+    elapsed = time.perf_counter() - started
+    after = tag_write_stats()
+    print(f"  edit {edit + 1}: {after['in_place'] - before['in_place']:>5} "
+          f"in place, {after['rewritten'] - before['rewritten']:>5} "
+          f"rewritten in {elapsed:.2f}s")
+
+
+if __name__ == '__main__':
+  count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+  seconds = int(sys.argv[2]) if len(sys.argv) > 2 else 180
+  print(f"{count} MP3 files of {seconds}s")
+  for padding in (STOCK_PADDING, songMetadata.TAG_PADDING):
+    folder = tempfile.mkdtemp(prefix='bench_tag_padding_')
+    try:
+      # The fixtures are tagged like a rip, with eyed3's stock padding
+      eyed3.id3.tag.DEFAULT_PADDING = STOCK_PADDING
+      bench(make_fixtures(folder, count, seconds), padding)
+    finally:
+      shutil.rmtree(folder)
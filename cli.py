@@ -0,0 +1,232 @@
+import argparse
+import json
+import os
+import sys
+
+CATALOG_FILE = 'catalog.sqlite'
+MANIFEST_FILE = 'scan_manifest.sqlite'
+CACHE_FILE = 'recognition_cache.sqlite'
+JOBS_FILE = 'catalog_jobs.sqlite'
+
+# Every import is deferred to the command that needs it: shazamio and eyed3
+# alone take most of a second, a catalog query needs neither.
+
+
+def _scan(args):
+  import asyncio
+
+  from coverArt import CoverArtFetcher
+  from main import catalog_library
+  from musicCatalog import MusicCatalog
+  from recognitionCache import RecognitionCache
+  from runJournal import RunJournal
+  from scanManifest import ScanManifest
+
+  async def scan():
+    coverArt = CoverArtFetcher() if args.cover_art else None
+    try:
+      with RecognitionCache(args.cache) as cache, \
+          ScanManifest(args.manifest) as manifest, \
+          MusicCatalog(args.catalog) as catalog, RunJournal() as journal:
+        await catalog_library(args.folder, args.concurrency, cache=cache,
+                              manifest=manifest, watch=args.watch,
+                              catalog=catalog, stats_file=args.stats_file,
+                              dedupe=args.dedupe, journal=journal,
+                              cover_art=coverArt, newFolder=args.dest)
+    finally:
+      if coverArt is not None:
+        await coverArt.close()
+
+  asyncio.run(scan())
+
+
+def _recognize(args):
+  import asyncio
+
+  from shazamio import Shazam
+
+  from helper import get_required_song_info
+  from main import build_recognizer
+  from recognitionCache import RecognitionCache, recognize_cached
+
+  async def recognize():
+    shazam = build_recognizer(Shazam(), window_seconds=args.window)
+    if args.no_cache:
+      return await shazam.recognize_song(args.file)
+    with RecognitionCache(args.cache) as cache:
+      return await recognize_cached(shazam, args.file, cache)
+
+  out = asyncio.run(recognize())
+  if not out.get('matches'):
+    print(f"{args.file}: no match", file=sys.stderr)
+    return 1
+  print(json.dumps(get_required_song_info(out), ensure_ascii=False, indent=2))
+  return 0
+
+
+def _tag(args):
+  import asyncio
+
+  from coverArt import CoverArtFetcher
+  from main import main
+  from musicCatalog import MusicCatalog
+  from recognitionCache import RecognitionCache
+  from scanManifest import ScanManifest
+
+  async def tag():
+    coverArt = CoverArtFetcher() if args.cover_art else None
+    try:
+      with RecognitionCache(args.cache) as cache, \
+          ScanManifest(args.manifest) as manifest, \
+          MusicCatalog(args.catalog) as catalog:
+        return await main(args.file, cache=cache, window_seconds=args.window,
+                          manifest=manifest, catalog=catalog,
+                          coverArt=coverArt, newFolder=args.dest)
+    finally:
+      if coverArt is not None:
+        await coverArt.close()
+
+  return 0 if asyncio.run(tag()) is not None else 1
+
+
+def _query(args):
+  import csv
+
+  from musicCatalog import CATALOG_FIELDS, MusicCatalog
+
+  with MusicCatalog(args.catalog) as catalog:
+    try:
+      if args.count:
+        for value, tracks in catalog.count_by(args.count):
+          print(f"{tracks}\t{value}")
+        return 0
+      tracks = catalog.query(args.title, args.artist, args.album, args.genre,
+                             args.year, args.missing, args.limit)
+    except ValueError as error:
+      print(error, file=sys.stderr)
+      return 2
+    writer = csv.DictWriter(sys.stdout, CATALOG_FIELDS)
+    writer.writeheader()
+    writer.writerows(tracks)
+
+
+def _import(args):
+  from musicCatalog import MusicCatalog, import_folder
+
+  with MusicCatalog(args.catalog) as catalog:
+    print(f"{import_folder(catalog, args.folder)} files imported")
+
+
+def _read_only(path):
+  import sqlite3
+
+  if not os.path.exists(path):
+    return None
+  return sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+
+
+def _count(path, table):
+  connection = _read_only(path)
+  if connection is None:
+    return None
+  try:
+    return connection.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+  finally:
+    connection.close()
+
+
+def _stats(args):
+  # Read-only, so a status check never blocks or alters a running scan
+  stats = {
+      'catalog_tracks': _count(args.catalog, 'tracks'),
+      'manifest_files': _count(args.manifest, 'files'),
+      'cached_recognitions': _count(args.cache, 'recognitions'),
+      'jobs': None,
+  }
+  connection = _read_only(args.jobs)
+  if connection is not None:
+    try:
+      stats['jobs'] = dict(connection.execute(
+          'SELECT state, COUNT(*) FROM jobs GROUP BY state'))
+    finally:
+      connection.close()
+
+  if args.json:
+    print(json.dumps(stats))
+    return
+  for name, value in stats.items():
+    print(f"{name}: {'-' if value is None else value}")
+
+
+def build_parser():
+  parser = argparse.ArgumentParser(
+      description='Recognise, tag and catalog music files.')
+  parser.add_argument('--catalog', default=CATALOG_FILE, help='catalog file')
+  parser.add_argument('--manifest', default=MANIFEST_FILE,
+                      help='scan manifest file')
+  parser.add_argument('--cache', default=CACHE_FILE,
+                      help='recognition cache file')
+  commands = parser.add_subparsers(dest='command', required=True)
+
+  scan = commands.add_parser('scan', help='catalog a music folder')
+  scan.add_argument('folder')
+  scan.add_argument('--concurrency', type=int, default=8)
+  scan.add_argument('--watch', action='store_true',
+                    help='keep cataloging files added to the folder')
+  scan.add_argument('--dedupe', action='store_true',
+                    help='recognise one file per group of duplicates')
+  scan.add_argument('--cover-art', action='store_true',
+                    help='embed the cover art')
+  scan.add_argument('--stats-file', help='export the pipeline metrics here')
+  scan.add_argument('--dest', help='move the renamed files to this folder '
+                    'instead of renaming them in place')
+  scan.set_defaults(run=_scan)
+
+  recognize = commands.add_parser(
+      'recognize', help='print the song information of a file, untouched')
+  recognize.add_argument('file')
+  recognize.add_argument('--window', type=int,
+                         help='send a window of this many seconds')
+  recognize.add_argument('--no-cache', action='store_true')
+  recognize.set_defaults(run=_recognize)
+
+  tag = commands.add_parser('tag', help='recognise, tag and rename a file')
+  tag.add_argument('file')
+  tag.add_argument('--window', type=int,
+                   help='send a window of this many seconds')
+  tag.add_argument('--cover-art', action='store_true',
+                   help='embed the cover art')
+  tag.add_argument('--dest', help='move the renamed file to this folder '
+                   'instead of renaming it in place')
+  tag.set_defaults(run=_tag)
+
+  # Field names are checked by MusicCatalog, so parsing doesn't import it
+  query = commands.add_parser('query', help='list catalog tracks')
+  for field in ('title', 'artist', 'album', 'genre'):
+    query.add_argument(f'--{field}', help="exact value, or a LIKE pattern")
+  query.add_argument('--year', type=int)
+  query.add_argument('--missing', help='only tracks where this field is empty')
+  query.add_argument('--count', metavar='FIELD',
+                     help='number of tracks per value of this field instead')
+  query.add_argument('--limit', type=int)
+  query.set_defaults(run=_query)
+
+  importer = commands.add_parser(
+      'import', help='add the tagged files of a folder to the catalog')
+  importer.add_argument('folder')
+  importer.set_defaults(run=_import)
+
+  stats = commands.add_parser('stats', help='catalog, cache and job counts')
+  stats.add_argument('--jobs', default=JOBS_FILE, help='job queue file')
+  stats.add_argument('--json', action='store_true')
+  stats.set_defaults(run=_stats)
+  return parser
+
+
+def run(argv=None):
+  args = build_parser().parse_args(argv)
+  return args.run(args) or 0
+
+
+if __name__ == '__main__':
+  sys.exit(run())
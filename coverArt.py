@@ -0,0 +1,138 @@
+import asyncio
+import hashlib
+import os
+
+import aiohttp
+
+COVER_ART_FOLDER = 'cover_art'
+
+
+class CoverArtFetcher:
+  """
+  Downloads the cover art of recognised songs, once per album.
+
+  Images are fetched over one pooled aiohttp session and kept on disk,
+  named after the Shazam album id (or a hash of the URL when the response
+  has none), so the tracks of an album share one download. Concurrent
+  requests for the same album wait for the download already in flight
+  instead of starting their own.
+
+  Args:
+  - folder: The folder the images are cached in, created if needed
+  - session: An aiohttp.ClientSession to share, or None to open one on
+    first use
+  - connections: The size of the connection pool of the session opened
+  - timeout: Seconds before a download is abandoned
+  """
+
+  def __init__(self, folder=COVER_ART_FOLDER, session=None, connections=8,
+               timeout=30.0):
+    self.folder = folder
+    os.makedirs(folder, exist_ok=True)
+    self.connections = connections
+    self.timeout = timeout
+    self._session = session
+    self._owns_session = session is None
+    self._in_flight = {}
+    self._failed = set()
+    self.downloads = 0
+    self.cache_hits = 0
+    self.shared = 0
+    self.failures = 0
+
+  def _get_session(self):
+    if self._session is None:
+      self._session = aiohttp.ClientSession(
+          connector=aiohttp.TCPConnector(limit=self.connections),
+          timeout=aiohttp.ClientTimeout(total=self.timeout))
+    return self._session
+
+  def cache_path(self, song_info):
+    """
+    Returns:
+    - The file the cover art of a song is cached in, or None when the song
+      has no cover art URL
+    """
+    url = song_info.get('coverArt')
+    if not url:
+      return None
+    album = song_info.get('albumId')
+    if album and album.isdigit():
+      name = f'album-{album}'
+    else:
+      name = 'url-' + hashlib.blake2b(url.encode(), digest_size=16).hexdigest()
+    return os.path.join(self.folder, name)
+
+  async def fetch(self, song_info):
+    """
+    Get the cover art of a song, from the disk cache when possible.
+
+    A failed download is not retried for the rest of the run; the tracks of
+    that album are tagged without art.
+
+    Args:
+    - song_info: The dictionary returned by `get_required_song_info`
+
+    Returns:
+    - The image data, or None when there is no cover art
+    """
+    path = self.cache_path(song_info)
+    if path is None or path in self._failed:
+      return None
+
+    task = self._in_flight.get(path)
+    if task is not None:
+      self.shared += 1
+      return await asyncio.shield(task)
+    if os.path.exists(path):
+      self.cache_hits += 1
+      with open(path, 'rb') as image_file:
+        return image_file.read()
+
+    task = asyncio.ensure_future(self._download(song_info['coverArt'], path))
+    self._in_flight[path] = task
+    task.add_done_callback(lambda _: self._in_flight.pop(path, None))
+    # Shielded, so a cancelled track doesn't cancel the album's download
+    return await asyncio.shield(task)
+
+  async def _download(self, url, path):
+    try:
+      async with self._get_session().get(url) as response:
+        response.raise_for_status()
+        data = await response.read()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+      self.failures += 1
+      self._failed.add(path)
+      print(f"Cover art {url} not downloaded: {error!r}")
+      return None
+
+    self.downloads += 1
+    temporary = f'{path}.tmp'
+    with open(temporary, 'wb') as image_file:
+      image_file.write(data)
+    os.replace(temporary, path)
+    return data
+
+  def stats(self):
+    """
+    Returns:
+    - A Dictionary with the downloads, disk cache hits, requests that shared
+      a download in flight and failed downloads
+    """
+    return {
+        'downloads': self.downloads,
+        'cache_hits': self.cache_hits,
+        'shared': self.shared,
+        'failures': self.failures,
+    }
+
+  async def close(self):
+    if self._owns_session and self._session is not None:
+      await self._session.close()
+    self._session = None
+
+  async def __aenter__(self):
+    return self
+
+  async def __aexit__(self, *exc_info):
+    await self.close()
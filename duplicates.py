@@ -0,0 +1,178 @@
+import argparse
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from recognitionCache import audio_payload_hash, audio_payload_span
+
+
+def _payload_size(musicFile):
+  try:
+    start, end = audio_payload_span(musicFile)
+  except OSError:
+    return None
+  return end - start
+
+
+def _payload_hash(musicFile):
+  try:
+    return audio_payload_hash(musicFile)
+  except OSError:
+    return None
+
+
+def _file_size(musicFile):
+  try:
+    return os.path.getsize(musicFile)
+  except OSError:
+    return 0
+
+
+def group_identical(musicFiles, workers=8):
+  """
+  Group the files whose audio frames are byte-identical, whatever their ID3
+  tags and filenames.
+
+  Files are first bucketed by the size of their audio payload, which only
+  needs the tag headers; only files sharing a size are hashed.
+
+  Args:
+  - musicFiles: An iterable of paths
+  - workers: The number of files read at once
+
+  Returns:
+  - A list of groups (lists of paths) in input order; every file is in
+    exactly one group, unreadable files on their own
+  """
+  musicFiles = list(musicFiles)
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    by_size = {}
+    for musicFile, size in zip(musicFiles,
+                               executor.map(_payload_size, musicFiles),
+                               strict=True):
+      if size is not None:
+        by_size.setdefault(size, []).append(musicFile)
+    candidates = [musicFile for files in by_size.values() if len(files) > 1
+                  for musicFile in files]
+    hashes = dict(zip(candidates, executor.map(_payload_hash, candidates),
+                      strict=True))
+
+  groups = {}
+  for musicFile in musicFiles:
+    audio_hash = hashes.get(musicFile)
+    key = ('hash', audio_hash) if audio_hash else ('file', musicFile)
+    groups.setdefault(key, []).append(musicFile)
+  return list(groups.values())
+
+
+def group_similar(groups, min_matches=None):
+  """
+  Merge groups whose audio sounds the same, e.g. the same rip encoded at
+  different bitrates, using the spectral-peak fingerprints of
+  `fingerprintIndex`.
+
+  Only the first file of each group is decoded; it is looked up in a
+  temporary FingerprintIndex of the groups seen so far and added to it when
+  nothing matches.
+
+  Args:
+  - groups: The groups returned by `group_identical`
+  - min_matches: The time-aligned hashes needed for a match, the
+    FingerprintIndex default if None
+
+  Returns:
+  - The merged list of groups
+  """
+  from fingerprintIndex import (
+    INDEX_SECONDS,
+    MIN_MATCHES,
+    QUERY_SECONDS,
+    SAMPLE_RATE,
+    FingerprintIndex,
+    fingerprint,
+    load_samples,
+  )
+
+  merged = []
+  with tempfile.TemporaryDirectory(prefix='duplicates_') as folder, \
+      FingerprintIndex(folder, min_matches or MIN_MATCHES) as index:
+    for group in groups:
+      try:
+        samples = load_samples(group[0], INDEX_SECONDS)
+      except Exception as error:
+        print(f"{group[0]} not fingerprinted: {error!r}", file=sys.stderr)
+        merged.append(list(group))
+        continue
+
+      middle = len(samples) // 2
+      half_query = QUERY_SECONDS * SAMPLE_RATE // 2
+      match = index.lookup(
+          fingerprint(samples[max(0, middle - half_query):middle + half_query]))
+      if match is not None:
+        merged[match['group']].extend(group)
+      else:
+        index.add(fingerprint(samples), {'group': len(merged)})
+        merged.append(list(group))
+  return merged
+
+
+def group_duplicates(musicFiles, perceptual=False, workers=8):
+  """
+  Group music files by audio content.
+
+  Args:
+  - musicFiles: An iterable of paths
+  - perceptual: Also merge groups that sound the same but are encoded
+    differently (decodes one file per group, needs numpy and pydub)
+  - workers: The number of files hashed at once
+
+  Returns:
+  - A list of groups (lists of paths). The largest file of each group,
+    usually the best encoding, comes first and is its representative.
+  """
+  groups = group_identical(musicFiles, workers)
+  if perceptual:
+    groups = group_similar(groups)
+  for group in groups:
+    group.sort(key=_file_size, reverse=True)
+  return groups
+
+
+def duplicate_report(groups):
+  """
+  Returns:
+  - A list of (group, reclaimable bytes) tuples for the groups holding more
+    than one file, the most reclaimable first; deleting every file but the
+    representative reclaims that many bytes
+  """
+  report = [(group, sum(_file_size(musicFile) for musicFile in group[1:]))
+            for group in groups if len(group) > 1]
+  report.sort(key=lambda entry: entry[1], reverse=True)
+  return report
+
+
+def print_duplicate_report(groups):
+  report = duplicate_report(groups)
+  for group, reclaimable in report:
+    print(f"{len(group)} copies, {reclaimable / 1e6:.1f} MB reclaimable")
+    print(f"  keep   {group[0]}")
+    for musicFile in group[1:]:
+      print(f"  delete {musicFile}")
+  total = sum(reclaimable for _, reclaimable in report)
+  print(f"{len(report)} duplicate groups, "
+        f"{sum(len(group) - 1 for group, _ in report)} redundant files, "
+        f"{total / 1e6:.1f} MB reclaimable")
+
+
+if __name__ == '__main__':
+  from main import iter_music_files
+
+  parser = argparse.ArgumentParser(
+      description='Report music files with the same audio.')
+  parser.add_argument('folder')
+  parser.add_argument('--perceptual', action='store_true',
+                      help='also group differently encoded copies')
+  args = parser.parse_args()
+  print_duplicate_report(
+      group_duplicates(iter_music_files(args.folder), args.perceptual))
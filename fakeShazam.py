@@ -0,0 +1,243 @@
+import asyncio
+import os
+import random
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+IMAGE_BASE_URL = 'https://is1-ssl.mzstatic.com/image/thumb/Music'
+
+
+def make_shazam_response(index, lyrics_lines=60, album=None,
+                         image_base=IMAGE_BASE_URL):
+  """
+  Build a Shazam `recognize_song` response for a made-up track.
+
+  Args:
+  - index: A number that makes the track unique
+  - lyrics_lines: The number of lyric lines in the LYRICS section
+  - album: The number of the track's album, `index % 4999` if None; tracks
+    of an album share their cover art URL
+  - image_base: The URL the cover art URLs start with
+
+  Returns:
+  - A Dictionary with the same layout as a real Shazam response
+  """
+  if album is None:
+    album = index % 4999
+  key = str(400000000 + index)
+  album_id = str(1445000000 + album)
+  title = f'Synthetic Track {index} (feat. Someone)'
+  artist = f'Artist {index % 997}'
+  image = f'{image_base}/{album_id}/400x400cc.jpg'
+  album = f'Album {album}'
+  return {
+      'matches': [{
+          'id': key,
+          'offset': 60.0 + index % 120,
+          'timeskew': 0.0001,
+          'frequencyskew': 0.0
+      }],
+      'location': {'accuracy': 0.01},
+      'timestamp': 1707128597475 + index,
+      'timezone': 'Europe/Moscow',
+      'track': {
+          'layout': '5',
+          'type': 'MUSIC',
+          'key': key,
+          'title': title,
+          'subtitle': artist,
+          'images': {
+              'background': image,
+              'coverart': image,
+              'coverarthq': image,
+              'joecolor': 'b:010101p:e9dac5s:caa7a7t:baaf9eq:a28686'
+          },
+          'share': {
+              'subject': f'{title} - {artist}',
+              'text': f'{title} by {artist}',
+              'href': f'https://www.shazam.com/track/{key}',
+              'image': image,
+              'twitter': f'I used @Shazam to discover {title} by {artist}.',
+              'html': f'https://www.shazam.com/snippets/email-share/{key}',
+              'snapchat': f'https://www.shazam.com/partner/sc/track/{key}'
+          },
+          'hub': {
+              'type': 'APPLEMUSIC',
+              'image': 'https://images.shazam.com/static/icons/hub/ios/v5/applemusic_{scalefactor}.png',
+              'actions': [{
+                  'name': 'apple',
+                  'type': 'uri',
+                  'uri': f'https://audio-ssl.itunes.apple.com/preview/{key}.m4a'
+              }],
+              'options': [{
+                  'caption': 'OPEN IN',
+                  'actions': [{
+                      'name': 'hub:applemusic:deeplink',
+                      'type': 'applemusicopen',
+                      'uri': f'https://music.apple.com/gb/album/{key}'
+                  }],
+                  'beacondata': {'type': 'open', 'providername': 'applemusic'},
+                  'type': 'open',
+              }],
+              'explicit': False,
+              'displayname': 'APPLE MUSIC'
+          },
+          'sections': [{
+              'type': 'SONG',
+              'metapages': [{'image': image, 'caption': artist},
+                            {'image': image, 'caption': title}],
+              'tabname': 'Song',
+              'metadata': [{'title': 'Album', 'text': album},
+                           {'title': 'Label', 'text': f'Label {index % 211}'},
+                           {'title': 'Released',
+                            'text': str(1990 + index % 35)}]
+          }, {
+              'type': 'LYRICS',
+              'text': [f'Line {line} of song {index}'
+                       for line in range(lyrics_lines)],
+              'footer': f'Writer(s): {artist}',
+              'tabname': 'Lyrics',
+          }, {
+              'type': 'VIDEO',
+              'tabname': 'Video',
+              'youtubeurl': f'https://cdn.shazam.com/video/v3/-/GB/iphone/{key}/youtube/video'
+          }],
+          'url': f'https://www.shazam.com/track/{key}',
+          'artists': [{'id': str(index % 997), 'adamid': str(580000000 + index)}],
+          'isrc': f'USQX9{index:07d}',
+          'genres': {'primary': ('Dance', 'Pop', 'Hip-Hop/Rap', 'Rock')[index % 4]},
+          'urlparams': {
+              '{tracktitle}': urllib.parse.quote_plus(title),
+              '{trackartist}': urllib.parse.quote_plus(artist)
+          },
+          'albumadamid': album_id
+      },
+      'tagid': f'4B7FA2E2-ABFC-4868-BCC6-{index:012d}'
+  }
+
+
+class FakeShazamError(Exception):
+  """A failure injected by FakeShazam."""
+
+
+class FakeShazam:
+  """
+  Local stand-in for `shazamio.Shazam` with injectable latency and errors.
+
+  Args:
+  - responses: A function mapping the recognised file (or signature) to a
+    response, defaults to a synthetic response per distinct file
+  - latency: The mean response time in seconds
+  - jitter: The random spread around `latency`, in seconds
+  - error_rate: The probability that a request fails
+  - capacity: Requests in flight beyond this are throttled: they fail and
+    make every other request slower, like an overloaded backend
+  - hang_rate: The probability that a request never answers
+  - seed: Seed for the random generator
+  """
+
+  def __init__(self, responses=None, latency=0.05, jitter=0.01, error_rate=0.0,
+               capacity=None, hang_rate=0.0, seed=None):
+    self.responses = responses or self._synthetic_response
+    self.latency = latency
+    self.jitter = jitter
+    self.error_rate = error_rate
+    self.capacity = capacity
+    self.hang_rate = hang_rate
+    self.random = random.Random(seed)
+    self.in_flight = 0
+    self.peak_in_flight = 0
+    self.requests = 0
+    self.failures = 0
+    self._tracks = {}
+
+  def _synthetic_response(self, data):
+    key = data if isinstance(data, (str, bytes)) else id(data)
+    index = self._tracks.setdefault(key, len(self._tracks))
+    return make_shazam_response(index, lyrics_lines=0)
+
+  async def _answer(self, data):
+    self.requests += 1
+    self.in_flight += 1
+    self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+    try:
+      overload = 0
+      if self.capacity is not None:
+        overload = max(0, self.in_flight - self.capacity)
+      delay = self.latency * (1 + overload) \
+          + self.random.uniform(-self.jitter, self.jitter)
+      await asyncio.sleep(max(0.0, delay))
+
+      if self.random.random() < self.hang_rate:
+        await asyncio.Event().wait()
+      if overload or self.random.random() < self.error_rate:
+        self.failures += 1
+        raise FakeShazamError('429 Too Many Requests' if overload
+                              else '503 Service Unavailable')
+      return self.responses(data)
+    finally:
+      self.in_flight -= 1
+
+  async def recognize_song(self, data):
+    return await self._answer(data)
+
+  async def send_recognize_request(self, sig):
+    return await self._answer(sig)
+
+
+class _CoverArtHandler(BaseHTTPRequestHandler):
+
+  def do_GET(self):
+    server = self.server.cover_art
+    with server.lock:
+      server.requests += 1
+      server.paths[self.path] = server.paths.get(self.path, 0) + 1
+    time.sleep(server.latency)
+    self.send_response(200)
+    self.send_header('Content-Type', 'image/jpeg')
+    self.send_header('Content-Length', str(len(server.image)))
+    self.end_headers()
+    self.wfile.write(server.image)
+
+  def log_message(self, *args):
+    pass
+
+
+class CoverArtServer:
+  """
+  Local HTTP server standing in for the cover art CDN: it answers every GET
+  with the same JPEG-looking image after `latency` seconds and counts the
+  requests per path.
+
+  Use `url` as the `image_base` of `make_shazam_response`.
+
+  Args:
+  - latency: Seconds each response takes
+  - image_size: The size of the image served, in bytes
+  """
+
+  def __init__(self, latency=0.02, image_size=40000):
+    self.latency = latency
+    self.image = b'\xff\xd8\xff\xe0' + os.urandom(image_size - 6) + b'\xff\xd9'
+    self.lock = threading.Lock()
+    self.requests = 0
+    self.paths = {}
+    self._server = ThreadingHTTPServer(('127.0.0.1', 0), _CoverArtHandler)
+    self._server.daemon_threads = True
+    self._server.cover_art = self
+    self.url = f'http://127.0.0.1:{self._server.server_port}/art'
+    self._thread = threading.Thread(target=self._server.serve_forever,
+                                    daemon=True)
+    self._thread.start()
+
+  def close(self):
+    self._server.shutdown()
+    self._server.server_close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
@@ -0,0 +1,179 @@
+import mmap
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+ID3V2_HEADER_SIZE = 10
+ID3V1_TAG_SIZE = 128
+
+# Frame ids per ID3v2 major version for each metadata field
+_FRAME_IDS = {
+    2: {b'TT2': 'Title', b'TP1': 'Artist', b'TAL': 'Album', b'TPB': 'Publisher',
+        b'TCO': 'Genre', b'TYE': 'Release_date'},
+    3: {b'TIT2': 'Title', b'TPE1': 'Artist', b'TALB': 'Album',
+        b'TPUB': 'Publisher', b'TCON': 'Genre', b'TYER': 'Release_date',
+        b'TDRC': 'Release_date'},
+    4: {b'TIT2': 'Title', b'TPE1': 'Artist', b'TALB': 'Album',
+        b'TPUB': 'Publisher', b'TCON': 'Genre', b'TDRC': 'Release_date'},
+}
+_TEXT_ENCODINGS = ('latin-1', 'utf-16', 'utf-16-be', 'utf-8')
+_GENRE_REFERENCE = re.compile(r'^\((\d+)\)|^(\d+)$')
+
+
+def _syncsafe(data):
+  return (data[0] & 0x7f) << 21 | (data[1] & 0x7f) << 14 \
+      | (data[2] & 0x7f) << 7 | (data[3] & 0x7f)
+
+
+def _decode_text(payload):
+  if not payload:
+    return None
+  encoding = payload[0]
+  if encoding > 3:
+    return None
+  text = payload[1:].decode(_TEXT_ENCODINGS[encoding], 'replace')
+  # Multiple values are null separated, keep the first like eyed3 does
+  text = text.split('\0', 1)[0]
+  return text or None
+
+
+def _genre_name(text):
+  match = _GENRE_REFERENCE.match(text)
+  if not match:
+    return text
+  from eyed3.id3 import genres
+
+  try:
+    return dict.get(genres, int(match.group(1) or match.group(2))) or text
+  except ValueError:
+    return text
+
+
+def _release_year(text):
+  return int(text[:4]) if text and text[:4].isdigit() else None
+
+
+def _empty_metadata():
+  return dict.fromkeys(
+      ('Title', 'Artist', 'Album', 'Publisher', 'Genre', 'Release_date'))
+
+
+def _parse_v2_frames(tag, major):
+  metadata = {}
+  wanted = _FRAME_IDS[major]
+  id_size, header_size = (3, 6) if major == 2 else (4, 10)
+  position = 0
+  while position + header_size <= len(tag) and len(metadata) < len(wanted):
+    frame_id = tag[position:position + id_size]
+    if not frame_id.strip(b'\0'):
+      break  # Reached the padding
+    if major == 2:
+      size = int.from_bytes(tag[position + 3:position + 6], 'big')
+      flags = 0
+    elif major == 3:
+      size = int.from_bytes(tag[position + 4:position + 8], 'big')
+      flags = int.from_bytes(tag[position + 8:position + 10], 'big')
+    else:
+      size = _syncsafe(tag[position + 4:position + 8])
+      flags = int.from_bytes(tag[position + 8:position + 10], 'big')
+    body_start = position + header_size
+    position = body_start + size
+
+    field = wanted.get(bytes(frame_id))
+    if field is None or field in metadata:
+      continue
+    body = bytes(tag[body_start:position])
+    if major == 3 and flags & 0x00c0:
+      continue  # Compressed or encrypted, leave it to eyed3
+    if major == 4:
+      if flags & 0x000c:
+        continue  # Compressed or encrypted, leave it to eyed3
+      if flags & 0x0001:
+        body = body[4:]  # Data length indicator
+      if flags & 0x0002:
+        body = body.replace(b'\xff\x00', b'\xff')
+    value = _decode_text(body)
+    if value is not None:
+      metadata[field] = value
+  return metadata
+
+
+def _parse_v1(data):
+  if len(data) != ID3V1_TAG_SIZE or data[:3] != b'TAG':
+    return {}
+
+  def text(start, end):
+    return data[start:end].split(b'\0', 1)[0].decode('latin-1').strip() or None
+
+  metadata = {'Title': text(3, 33), 'Artist': text(33, 63),
+              'Album': text(63, 93), 'Release_date': text(93, 97)}
+  if data[127] != 255:
+    metadata['Genre'] = str(data[127])
+  return {field: value for field, value in metadata.items() if value}
+
+
+def read_music_metadata(track):
+  """
+  Read the metadata of a music file from its ID3 tag only.
+
+  The file is memory mapped and only the pages holding the ID3v2 tag (or
+  the trailing ID3v1 tag when there is no ID3v2 tag) are touched; the MPEG
+  audio frames are never read.
+
+  Args:
+  - track: The path to the music file
+
+  Returns:
+  - A Dictionary with the Title, Artist, Album, Publisher, Genre and
+    Release_date (year) of the track; missing values are None
+  """
+  metadata = _empty_metadata()
+  with open(track, 'rb') as music_file:
+    if os.fstat(music_file.fileno()).st_size < ID3V2_HEADER_SIZE:
+      return metadata
+    with mmap.mmap(music_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+      found = {}
+      header = data[:ID3V2_HEADER_SIZE]
+      if header[:3] == b'ID3' and header[3] in _FRAME_IDS:
+        major, flags = header[3], header[5]
+        end = ID3V2_HEADER_SIZE + _syncsafe(header[6:10])
+        tag = data[ID3V2_HEADER_SIZE:end]
+        if flags & 0x80 and major < 4:
+          tag = tag.replace(b'\xff\x00', b'\xff')
+        if flags & 0x40:
+          # Skip the extended header
+          extended = _syncsafe(tag[:4]) if major == 4 \
+              else int.from_bytes(tag[:4], 'big') + 4
+          tag = tag[extended:]
+        found = _parse_v2_frames(tag, major)
+      elif len(data) >= ID3V1_TAG_SIZE:
+        found = _parse_v1(data[-ID3V1_TAG_SIZE:])
+
+  metadata.update(found)
+  if metadata['Genre']:
+    metadata['Genre'] = _genre_name(metadata['Genre'])
+  metadata['Release_date'] = _release_year(metadata['Release_date'])
+  return metadata
+
+
+def read_music_metadata_bulk(tracks, workers=16):
+  """
+  Read the metadata of many music files in parallel.
+
+  Args:
+  - tracks: An iterable of paths
+  - workers: The number of files read at once; helps most on network
+    storage where each read waits on I/O
+
+  Returns:
+  - A generator of (path, metadata) tuples in input order; metadata is None
+    for files that could not be read
+  """
+  def read(track):
+    try:
+      return track, read_music_metadata(track)
+    except (OSError, ValueError):
+      return track, None
+
+  with ThreadPoolExecutor(max_workers=workers) as executor:
+    yield from executor.map(read, tracks)
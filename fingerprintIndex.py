@@ -0,0 +1,341 @@
+import asyncio
+import glob
+import json
+import os
+import sqlite3
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+SAMPLE_RATE = 8000
+FFT_SIZE = 1024
+HOP_SIZE = 512
+FREQ_NEIGHBOURHOOD = 10
+TIME_NEIGHBOURHOOD = 5
+PEAKS_PER_SECOND = 12
+FAN_OUT = 4
+MAX_DELTA = 63
+INDEX_SECONDS = 90
+QUERY_SECONDS = 15
+MIN_MATCHES = 12
+FLUSH_ENTRIES = 1 << 20
+
+
+def load_samples(musicFile, seconds=None):
+  """
+  Decode a music file to mono 8 kHz samples.
+
+  Args:
+  - musicFile: The path to the music file
+  - seconds: Only keep this many seconds from the middle of the track, or
+    None to keep everything
+
+  Returns:
+  - A float32 NumPy array of samples
+  """
+  from pydub import AudioSegment
+
+  from windowedRecognition import audio_duration, load_window, window_starts
+
+  duration = audio_duration(musicFile) if seconds is not None else None
+  if duration and duration > seconds:
+    # ffmpeg seeks to the window, the rest of the file is never decoded
+    start, = window_starts(duration, seconds, (0.5,))
+    audio = load_window(musicFile, start, seconds, SAMPLE_RATE)
+  else:
+    audio = AudioSegment.from_file(musicFile)
+  audio = audio.set_channels(1).set_frame_rate(SAMPLE_RATE).set_sample_width(2)
+  return np.array(audio.get_array_of_samples(), dtype=np.float32)
+
+
+def _spread_max(values, radius, axis):
+  spread = values.copy()
+  length = values.shape[axis]
+  for shift in range(1, radius + 1):
+    if shift >= length:
+      break
+    head = [slice(None)] * values.ndim
+    tail = [slice(None)] * values.ndim
+    head[axis], tail[axis] = slice(shift, None), slice(None, -shift)
+    np.maximum(spread[tuple(head)], values[tuple(tail)],
+               out=spread[tuple(head)])
+    np.maximum(spread[tuple(tail)], values[tuple(head)],
+               out=spread[tuple(tail)])
+  return spread
+
+
+def find_peaks(samples):
+  """
+  Find the spectral peaks (constellation points) of a signal.
+
+  Args:
+  - samples: Mono samples at SAMPLE_RATE
+
+  Returns:
+  - Two int arrays, the frame index and frequency bin of each peak, sorted
+    by frame
+  """
+  if len(samples) < FFT_SIZE:
+    return np.empty(0, np.int64), np.empty(0, np.int64)
+
+  frames = sliding_window_view(samples, FFT_SIZE)[::HOP_SIZE]
+  spectrum = np.abs(np.fft.rfft(frames * np.hanning(FFT_SIZE), axis=1))
+  spectrum = np.log1p(spectrum[:, :FFT_SIZE // 2].astype(np.float32))
+
+  neighbourhood = _spread_max(_spread_max(spectrum, TIME_NEIGHBOURHOOD, 0),
+                              FREQ_NEIGHBOURHOOD, 1)
+  is_peak = (spectrum == neighbourhood) & (spectrum > spectrum.mean())
+  times, freqs = np.nonzero(is_peak)
+
+  # Keep the strongest peaks so the hash density doesn't depend on loudness
+  budget = max(1, int(len(samples) / SAMPLE_RATE * PEAKS_PER_SECOND))
+  if len(times) > budget:
+    strongest = np.argpartition(spectrum[times, freqs], -budget)[-budget:]
+    strongest.sort()
+    times, freqs = times[strongest], freqs[strongest]
+  return times, freqs
+
+
+def fingerprint(samples):
+  """
+  Hash pairs of nearby spectral peaks.
+
+  Each hash packs the anchor frequency, the target frequency and their time
+  distance (9 + 9 + 6 bits), which survives re-encoding and bitrate changes.
+
+  Args:
+  - samples: Mono samples at SAMPLE_RATE
+
+  Returns:
+  - A (hashes, offsets) tuple of uint32 and uint16 arrays, the offset being
+    the anchor frame of each hash
+  """
+  times, freqs = find_peaks(samples)
+  hashes, offsets = [], []
+  for step in range(1, FAN_OUT + 1):
+    delta = times[step:] - times[:-step]
+    valid = (delta > 0) & (delta <= MAX_DELTA)
+    hashes.append((freqs[:-step][valid] << 15) | (freqs[step:][valid] << 6)
+                  | delta[valid])
+    offsets.append(times[:-step][valid])
+  if not hashes:
+    return np.empty(0, np.uint32), np.empty(0, np.uint16)
+  return (np.concatenate(hashes).astype(np.uint32),
+          np.concatenate(offsets).astype(np.uint16))
+
+
+class FingerprintIndex:
+  """
+  On-disk index of audio fingerprints of tracks already recognised.
+
+  Hashes are stored in immutable segments of three memory-mapped NumPy
+  arrays (hash, track id, offset) sorted by hash, 10 bytes per entry, and
+  looked up with binary search. New tracks are buffered in memory (and are
+  searchable straight away) until `flush` writes them as a new segment;
+  `compact` merges the segments into one. The Shazam response of each track
+  is kept in a small SQLite table.
+
+  Args:
+  - path: The index folder, created if needed
+  - min_matches: The number of time-aligned hashes needed to report a match
+  """
+
+  def __init__(self, path='fingerprints', min_matches=MIN_MATCHES):
+    self.path = path
+    self.min_matches = min_matches
+    os.makedirs(path, exist_ok=True)
+    self._connection = sqlite3.connect(os.path.join(path, 'tracks.sqlite'))
+    self._connection.execute(
+        'CREATE TABLE IF NOT EXISTS tracks ('
+        ' track_id INTEGER PRIMARY KEY,'
+        ' track_key TEXT,'
+        ' response TEXT NOT NULL)')
+    self._connection.execute(
+        'CREATE INDEX IF NOT EXISTS tracks_key ON tracks (track_key)')
+    self._connection.commit()
+    self._pending = []
+    self._pending_entries = 0
+    self._pending_segment = None
+    self._segments = [self._load_segment(name)
+                      for name in sorted(glob.glob(
+                          os.path.join(path, 'segment-*.hashes.npy')))]
+
+  @staticmethod
+  def _load_segment(hashes_file):
+    base = hashes_file[:-len('.hashes.npy')]
+    return (np.load(hashes_file, mmap_mode='r'),
+            np.load(f'{base}.tracks.npy', mmap_mode='r'),
+            np.load(f'{base}.offsets.npy', mmap_mode='r'))
+
+  def __len__(self):
+    return self._connection.execute('SELECT COUNT(*) FROM tracks').fetchone()[0]
+
+  def add(self, fingerprints, response):
+    """
+    Add a recognised track to the index.
+
+    Args:
+    - fingerprints: The (hashes, offsets) returned by `fingerprint`
+    - response: The Shazam response that identified the track
+
+    Returns:
+    - The track id
+    """
+    track_key = (response.get('track') or {}).get('key')
+    track_id = self._connection.execute(
+        'INSERT INTO tracks (track_key, response) VALUES (?, ?)',
+        (track_key, json.dumps(response, separators=(',', ':')))).lastrowid
+    self._connection.commit()
+    hashes, offsets = fingerprints
+    self._pending.append((hashes, np.full(len(hashes), track_id, np.uint32),
+                          offsets))
+    self._pending_entries += len(hashes)
+    self._pending_segment = None
+    if self._pending_entries >= FLUSH_ENTRIES:
+      self.flush()
+    return track_id
+
+  def flush(self):
+    """Write the tracks added since the last flush as a new segment."""
+    if not self._pending:
+      return
+    hashes, tracks, offsets = (np.concatenate(column)
+                               for column in zip(*self._pending, strict=True))
+    self._pending = []
+    self._pending_entries = 0
+    self._pending_segment = None
+    self._write_segment(hashes, tracks, offsets)
+
+  def _searchable_pending(self):
+    if self._pending and self._pending_segment is None:
+      hashes, tracks, offsets = (np.concatenate(column)
+                                 for column in zip(*self._pending, strict=True))
+      order = np.argsort(hashes, kind='stable')
+      self._pending_segment = (hashes[order], tracks[order], offsets[order])
+    return [self._pending_segment] if self._pending else []
+
+  def _write_segment(self, hashes, tracks, offsets):
+    order = np.argsort(hashes, kind='stable')
+    number = len(glob.glob(os.path.join(self.path, 'segment-*.hashes.npy')))
+    base = os.path.join(self.path, f'segment-{number:06d}')
+    while os.path.exists(f'{base}.hashes.npy'):
+      number += 1
+      base = os.path.join(self.path, f'segment-{number:06d}')
+    # The hashes file is written last, it marks the segment as complete
+    np.save(f'{base}.tracks.npy', tracks[order])
+    np.save(f'{base}.offsets.npy', offsets[order])
+    np.save(f'{base}.hashes.tmp.npy', hashes[order])
+    os.replace(f'{base}.hashes.tmp.npy', f'{base}.hashes.npy')
+    self._segments.append(self._load_segment(f'{base}.hashes.npy'))
+
+  def compact(self):
+    """Merge all segments into one so lookups do a single binary search."""
+    self.flush()
+    if len(self._segments) < 2:
+      return
+    old_files = sorted(glob.glob(os.path.join(self.path, 'segment-*.npy')))
+    hashes, tracks, offsets = (np.concatenate(column)
+                               for column in zip(*self._segments, strict=True))
+    self._segments = []
+    self._write_segment(hashes, tracks, offsets)
+    for name in old_files:
+      os.remove(name)
+
+  def lookup(self, fingerprints):
+    """
+    Find the indexed track that matches a fingerprint.
+
+    Args:
+    - fingerprints: The (hashes, offsets) returned by `fingerprint`
+
+    Returns:
+    - The stored Shazam response of the best match, or None
+    """
+    query_hashes, query_offsets = fingerprints
+    segments = self._segments + self._searchable_pending()
+    if not len(query_hashes) or not segments:
+      return None
+
+    tracks, deltas = [], []
+    for hashes, segment_tracks, segment_offsets in segments:
+      left = np.searchsorted(hashes, query_hashes, 'left')
+      right = np.searchsorted(hashes, query_hashes, 'right')
+      counts = right - left
+      if not counts.any():
+        continue
+      # Positions of every matching entry, and the query hash each came from
+      starts = np.repeat(left - np.cumsum(counts) + counts, counts)
+      positions = starts + np.arange(counts.sum())
+      tracks.append(np.asarray(segment_tracks[positions], np.int64))
+      deltas.append(np.asarray(segment_offsets[positions], np.int64)
+                    - np.repeat(query_offsets.astype(np.int64), counts))
+    if not tracks:
+      return None
+
+    # Vote for (track, time shift); a real match lines up many hashes
+    votes = np.concatenate(tracks) << 17 | (np.concatenate(deltas) + 65536)
+    candidates, counts = np.unique(votes, return_counts=True)
+    best = counts.argmax()
+    if counts[best] < self.min_matches:
+      return None
+
+    track_id = int(candidates[best] >> 17)
+    row = self._connection.execute(
+        'SELECT response FROM tracks WHERE track_id = ?',
+        (track_id, )).fetchone()
+    return json.loads(row[0]) if row else None
+
+  def recognizer(self, shazam, index_seconds=INDEX_SECONDS,
+                 query_seconds=QUERY_SECONDS):
+    """
+    Returns:
+    - A FingerprintRecognizer that consults this index before `shazam`
+    """
+    return FingerprintRecognizer(shazam, self, index_seconds, query_seconds)
+
+  def close(self):
+    self.flush()
+    self._connection.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+
+class FingerprintRecognizer:
+  """
+  Drop-in for `Shazam.recognize_song` that answers from a FingerprintIndex
+  and only calls Shazam on a miss, indexing whatever Shazam recognises.
+  """
+
+  def __init__(self, shazam, index, index_seconds=INDEX_SECONDS,
+               query_seconds=QUERY_SECONDS):
+    self.shazam = shazam
+    self.index = index
+    self.index_seconds = index_seconds
+    self.query_seconds = query_seconds
+    self.local_matches = 0
+    self.remote_calls = 0
+
+  async def recognize_song(self, musicFile):
+    loop = asyncio.get_running_loop()
+    samples = await loop.run_in_executor(None, load_samples, musicFile,
+                                         self.index_seconds)
+    middle = len(samples) // 2
+    half_query = self.query_seconds * SAMPLE_RATE // 2
+    query = await loop.run_in_executor(
+        None, fingerprint, samples[max(0, middle - half_query):middle + half_query])
+
+    out = self.index.lookup(query)
+    if out is not None:
+      self.local_matches += 1
+      return out
+
+    self.remote_calls += 1
+    out = await self.shazam.recognize_song(musicFile)
+    if out.get('matches'):
+      reference = await loop.run_in_executor(None, fingerprint, samples)
+      self.index.add(reference, out)
+    return out
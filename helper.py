@@ -1,4 +1,102 @@
-import urllib.parse
+import copy
+import functools
+from urllib.parse import unquote_plus
+
+
+def _compile_step(step):
+  """
+  Build an accessor for one step of a key path.
+
+  A step is a dictionary key (str), a list index (int) or a selector dict
+  such as {'type': 'LYRICS'} that picks the first list item whose fields
+  match.
+  """
+  if isinstance(step, int):
+    def get_index(value):
+      if isinstance(value, list) and -len(value) <= step < len(value):
+        return value[step]
+      return None
+    return get_index
+
+  if isinstance(step, dict):
+    fields = tuple(step.items())
+
+    def select(value):
+      if isinstance(value, list):
+        for item in value:
+          if isinstance(item, dict) and all(
+              item.get(field) == wanted for field, wanted in fields):
+            return item
+      return None
+    return select
+
+  def get_key(value):
+    if isinstance(value, dict):
+      return value.get(step)
+    return None
+  return get_key
+
+
+def compile_path(keys):
+  """
+  Compile a key path into a function that reads it from nested data.
+
+  Args:
+  - keys: A key or a sequence of keys, list indices and selector dicts
+
+  Returns:
+  - A function taking the nested data and returning the value at the path,
+    or None if the path doesn't exist
+  """
+  if not isinstance(keys, (list, tuple)):
+    keys = [keys]
+  keys = tuple(keys)
+
+  if all(isinstance(key, str) for key in keys):
+    # Plain dictionary paths are by far the most common, subscript them
+    # directly (a missing key or a value that isn't a dict ends the path)
+    if len(keys) == 2:
+      first, second = keys
+
+      def get_two(data):
+        try:
+          return data[first][second]
+        except (KeyError, TypeError):
+          return None
+      return get_two
+    if len(keys) == 3:
+      first, second, third = keys
+
+      def get_three(data):
+        try:
+          return data[first][second][third]
+        except (KeyError, TypeError):
+          return None
+      return get_three
+
+    def get_path(data):
+      for key in keys:
+        if not isinstance(data, dict):
+          return None
+        data = data.get(key)
+      return data
+    return get_path
+
+  steps = tuple(_compile_step(key) for key in keys)
+
+  def get_steps(data):
+    for step in steps:
+      if data is None:
+        return None
+      data = step(data)
+    return data
+  return get_steps
+
+
+@functools.lru_cache(maxsize=256)
+def _cached_path(keys):
+  return compile_path(keys)
+
 
 def get_nested_value(d, keys):
   """
@@ -6,21 +104,17 @@ def get_nested_value(d, keys):
 
   Args:
   - d: The nested dictionary
-  - keys: A sequence of keys to traverse through the nested dictionary
+  - keys: A sequence of keys to traverse through the nested dictionary.
+    Integers index into lists and dicts select list items by their fields.
 
   Returns:
   - The value associated with the keys, or None if the keys don't exist
   """
-  if not isinstance(keys, (list, tuple)):
-    keys = [keys]
-
-  value = d
-  for key in keys:
-    if isinstance(value, dict):
-      value = value.get(key)
-    elif not isinstance(value, list):
-      return None
-  return value
+  try:
+    get = _cached_path(tuple(keys) if isinstance(keys, list) else keys)
+  except TypeError:
+    get = compile_path(keys)  # Selector dicts can't be cached by value
+  return get(d)
 
 def extract_nested_keys(data, parent_keys=[], keys=[]):
   """
@@ -53,9 +147,82 @@ required_song_info = {
     'primary_genre': ['track', 'genres', 'primary'],
     'trackTitle': ['track', 'urlparams', '{tracktitle}'],
     'trackArtist': ['track', 'urlparams', '{trackartist}'],
+    'trackKey': ['track', 'key'],
+    'isrc': ['track', 'isrc'],
+    'coverArt': ['track', 'images', 'coverarthq'],
+    'albumId': ['track', 'albumadamid'],
     'sections': ['track', 'sections']
 }
 
+
+def _is_urlparam(path):
+  return isinstance(path, (list, tuple)) and 'urlparams' in path
+
+
+class SongInfoExtractor:
+  """
+  A `required_song_info` style mapping compiled into accessors.
+
+  Every path is compiled once with `compile_path`, so extracting from many
+  Shazam responses only pays for the lookups themselves.
+
+  Args:
+      song_metadata (dict): Keys represent the desired information and
+                            values the corresponding paths in the Shazam
+                            data. The 'sections' key points at the list of
+                            sections whose metadata is flattened into the
+                            result. Values under 'urlparams' are URL
+                            decoded, the others are kept as they are.
+      section_types (tuple): The `type` of the sections whose metadata is
+                             collected (e.g. 'SONG').
+  """
+
+  def __init__(self, song_metadata=required_song_info, section_types=('SONG',)):
+    self.song_metadata = copy.deepcopy(dict(song_metadata))
+    self.section_types = frozenset(section_types)
+    # Only the urlparams values are URL encoded, URLs are kept verbatim
+    self._fields = tuple((key, compile_path(path), _is_urlparam(path))
+                         for key, path in self.song_metadata.items()
+                         if key != 'sections')
+    self._sections = None
+    if 'sections' in self.song_metadata:
+      self._sections = compile_path(self.song_metadata['sections'])
+
+  def __call__(self, shazamData):
+    song_info = {}
+    for key, get, urlparam in self._fields:
+      info = get(shazamData)
+      if info.__class__ is str:
+        song_info[key] = unquote_plus(info) if urlparam else info
+    if self._sections is not None:
+      sections = self._sections(shazamData)
+      if sections.__class__ is list:
+        for section in sections:
+          if section.__class__ is dict \
+              and section.get('type') in self.section_types:
+            for item in section.get('metadata', ()):
+              song_info[item['title']] = item['text']
+    return song_info
+
+
+_EXTRACTOR_CACHE_SIZE = 32
+_default_extractor = SongInfoExtractor(required_song_info)
+_extractors = {}
+
+
+def _extractor_for(song_metadata):
+  if song_metadata is required_song_info:
+    return _default_extractor
+  # Looked up by identity, the comparison catches a mapping changed since
+  extractor = _extractors.get(id(song_metadata))
+  if extractor is None or extractor.song_metadata != song_metadata:
+    if len(_extractors) >= _EXTRACTOR_CACHE_SIZE:
+      del _extractors[next(iter(_extractors))]
+    extractor = _extractors[id(song_metadata)] = \
+        SongInfoExtractor(song_metadata)
+  return extractor
+
+
 def get_required_song_info(shazamData, song_metadata=required_song_info):
   """
   Extracts required song information from Shazam data based on provided metadata mappings.
@@ -71,28 +238,12 @@ def get_required_song_info(shazamData, song_metadata=required_song_info):
   Returns:
       dict: A dictionary containing the extracted song information based on
       the provided mappings.
+
+  Note:
+      Each mapping is compiled once and the extractor reused by later calls
+      with the same mapping.
   """
-  song_info = {}
-  for key, value in song_metadata.items():
-    info = get_nested_value(shazamData, value)
-
-    if info is not None:
-      if isinstance(info, str):
-        info = urllib.parse.unquote_plus(info)
-        song_info[key] = info
-
-      elif key == 'sections':
-        # Accessing information from the first section (SONG)
-        first_section = info[0]
-
-        # Accessing metadata from the first section
-        metadata = first_section['metadata']
-        for item in metadata:
-          title = item['title']
-          text = item['text']
-          song_info[title] = text
-
-  return song_info
+  return _extractor_for(song_metadata)(shazamData)
 
 if __name__=='__main__':
   x = {
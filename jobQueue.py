@@ -0,0 +1,459 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+
+class LeaseLost(Exception):
+  """The worker no longer holds the lease of a job."""
+
+
+class JobQueue:
+  """
+  Durable queue of music files to catalog, shared by worker processes.
+
+  A worker leases jobs for `lease_seconds` and renews the lease with
+  heartbeats while it works on them. A job whose lease expires (its worker
+  died or hangs) is handed to the next worker that asks. Leasing runs in a
+  `BEGIN IMMEDIATE` transaction, so two workers never lease the same job at
+  the same time. Each job also keeps the progress journaled for it (see
+  JobJournal), so whoever works on it next resumes where the last worker
+  stopped.
+
+  SQLite relies on file locks. Keep the queue file on a local disk and run
+  the workers on that machine, or on a network file system whose locks
+  work (NFSv4 with `wal=False`); WAL mode needs shared memory and does not
+  work across machines at all.
+
+  Args:
+  - path: The SQLite database file
+  - lease_seconds: How long a lease lasts without a heartbeat
+  - wal: Use WAL journaling (faster, local disks only)
+  - max_attempts: How many times a job is leased before it is marked
+    failed, whether its worker reported an error or its lease expired (a
+    file that crashes its worker would otherwise be handed out forever)
+  """
+
+  def __init__(self, path='catalog_jobs.sqlite', lease_seconds=120.0,
+               wal=True, max_attempts=3):
+    self.path = path
+    self.lease_seconds = lease_seconds
+    self.max_attempts = max_attempts
+    # Autocommit, transactions are explicit. The tag threads journal
+    # through the same connection, the lock keeps their statements apart.
+    self._lock = threading.RLock()
+    self._connection = sqlite3.connect(path, timeout=60,
+                                       isolation_level=None,
+                                       check_same_thread=False)
+    self._connection.execute(
+        f'PRAGMA journal_mode={"WAL" if wal else "DELETE"}')
+    self._connection.execute(
+        'CREATE TABLE IF NOT EXISTS jobs ('
+        ' path TEXT PRIMARY KEY,'
+        " state TEXT NOT NULL DEFAULT 'queued',"
+        ' worker TEXT,'
+        ' lease_expires REAL,'
+        ' attempts INTEGER NOT NULL DEFAULT 0,'
+        ' error TEXT,'
+        ' progress TEXT,'
+        ' updated REAL NOT NULL)')
+    self._connection.execute(
+        'CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, lease_expires)')
+
+  def add(self, paths):
+    """
+    Queue files; files already in the queue are left as they are.
+
+    Returns:
+    - The number of jobs added
+    """
+    now = time.time()
+    with self._lock:
+      self._connection.execute('BEGIN IMMEDIATE')
+      try:
+        added = self._connection.executemany(
+            'INSERT OR IGNORE INTO jobs (path, updated) VALUES (?, ?)',
+            ((os.path.abspath(path), now) for path in paths)).rowcount
+        self._connection.execute('COMMIT')
+      except BaseException:
+        self._connection.execute('ROLLBACK')
+        raise
+    return added
+
+  def lease(self, worker, count=1):
+    """
+    Lease up to `count` queued jobs, or jobs whose lease has expired. An
+    expired job that was already leased `max_attempts` times is marked
+    failed instead.
+
+    Args:
+    - worker: The id of the worker taking the jobs
+
+    Returns:
+    - The leased paths
+    """
+    now = time.time()
+    with self._lock:
+      self._connection.execute('BEGIN IMMEDIATE')
+      try:
+        self._connection.execute(
+            "UPDATE jobs SET state = 'failed', error = 'lease expired',"
+            ' lease_expires = NULL, updated = ?'
+            " WHERE state = 'leased' AND lease_expires < ? AND attempts >= ?",
+            (now, now, self.max_attempts))
+        paths = [path for path, in self._connection.execute(
+            "SELECT path FROM jobs WHERE state = 'queued'"
+            " OR (state = 'leased' AND lease_expires < ?)"
+            ' ORDER BY attempts, updated LIMIT ?', (now, count))]
+        self._connection.executemany(
+            "UPDATE jobs SET state = 'leased', worker = ?,"
+            ' lease_expires = ?, attempts = attempts + 1, updated = ?'
+            ' WHERE path = ?',
+            ((worker, now + self.lease_seconds, now, path)
+             for path in paths))
+        self._connection.execute('COMMIT')
+      except BaseException:
+        self._connection.execute('ROLLBACK')
+        raise
+    return paths
+
+  def _renew(self, worker, path, now):
+    return self._connection.execute(
+        'UPDATE jobs SET lease_expires = ?, updated = ?'
+        " WHERE path = ? AND worker = ? AND state = 'leased'",
+        (now + self.lease_seconds, now, path, worker)).rowcount == 1
+
+  def heartbeat(self, worker, paths):
+    """
+    Extend the leases a worker still holds.
+
+    Returns:
+    - The paths whose lease was lost: it expired and another worker took
+      the job over, or the job was requeued
+    """
+    now = time.time()
+    with self._lock:
+      self._connection.execute('BEGIN IMMEDIATE')
+      try:
+        lost = [path for path in paths if not self._renew(worker, path, now)]
+        self._connection.execute('COMMIT')
+      except BaseException:
+        self._connection.execute('ROLLBACK')
+        raise
+    return lost
+
+  def progress(self, path):
+    """
+    Returns:
+    - The progress journaled for a job, or None
+    """
+    with self._lock:
+      row = self._connection.execute(
+          'SELECT progress FROM jobs WHERE path = ?',
+          (os.path.abspath(path), )).fetchone()
+    return json.loads(row[0]) if row and row[0] else None
+
+  def record_progress(self, worker, path, progress):
+    """
+    Store the progress of a leased job and renew its lease.
+
+    Returns:
+    - False, and nothing is stored, if the worker had lost the lease
+    """
+    now = time.time()
+    with self._lock:
+      return self._connection.execute(
+          'UPDATE jobs SET progress = ?, lease_expires = ?, updated = ?'
+          " WHERE path = ? AND worker = ? AND state = 'leased'",
+          (json.dumps(progress), now + self.lease_seconds, now,
+           os.path.abspath(path), worker)).rowcount == 1
+
+  def _finish(self, worker, path, state, error=None):
+    with self._lock:
+      return self._connection.execute(
+          'UPDATE jobs SET state = ?, error = ?, lease_expires = NULL,'
+          " updated = ? WHERE path = ? AND worker = ? AND state = 'leased'",
+          (state, error, time.time(), path, worker)).rowcount == 1
+
+  def complete(self, worker, path):
+    """
+    Mark a leased job done.
+
+    Returns:
+    - False if the worker had lost the lease
+    """
+    with self._lock:
+      done = self._finish(worker, path, 'done')
+      if done:
+        self._connection.execute(
+            'UPDATE jobs SET progress = NULL WHERE path = ?', (path, ))
+    return done
+
+  def fail(self, worker, path, error, max_attempts=None):
+    """
+    Give a leased job back after an error: it is queued again until it has
+    been attempted `max_attempts` times (the queue's by default), then it is
+    marked failed. Its progress is kept, so the retry resumes after the
+    stages that succeeded.
+
+    Returns:
+    - False if the worker had lost the lease
+    """
+    with self._lock:
+      attempts, = self._connection.execute(
+          'SELECT attempts FROM jobs WHERE path = ?', (path, )).fetchone()
+      state = 'failed' if attempts >= (max_attempts or self.max_attempts) \
+          else 'queued'
+      return self._finish(worker, path, state, str(error))
+
+  def requeue(self, state='failed'):
+    """
+    Queue the jobs in a state again, e.g. failed jobs after a fix, or
+    'leased' ones after every worker was stopped.
+
+    Returns:
+    - The number of jobs queued again
+    """
+    with self._lock:
+      return self._connection.execute(
+          "UPDATE jobs SET state = 'queued', worker = NULL,"
+          ' lease_expires = NULL, attempts = 0, updated = ? WHERE state = ?',
+          (time.time(), state)).rowcount
+
+  def counts(self):
+    """
+    Returns:
+    - A Dictionary with the number of jobs in each state
+    """
+    with self._lock:
+      return dict(self._connection.execute(
+          'SELECT state, COUNT(*) FROM jobs GROUP BY state'))
+
+  def close(self):
+    self._connection.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+
+class JobJournal:
+  """
+  Stand-in for a RunJournal that keeps each file's progress in its job.
+
+  `main.main` journals through it as through a RunJournal. When a job is
+  retried after an error, or taken over after its worker died, the next
+  worker resumes at the stage the last one reached, e.g. a file renamed
+  before the catalog write failed is not looked for at its old path.
+
+  Every record also renews the lease, and raises LeaseLost when the worker
+  no longer holds it. The 'tagged' record is written right before the tag,
+  so a worker that lost its job stops before tagging or renaming the file.
+
+  Args:
+  - queue: The JobQueue
+  - worker: The id of the worker holding the leases
+  """
+
+  def __init__(self, queue, worker):
+    self.queue = queue
+    self.worker = worker
+    self.path = queue.path
+
+  def state(self, musicFile):
+    return self.queue.progress(musicFile)
+
+  def stage(self, musicFile):
+    state = self.state(musicFile)
+    return state['stage'] if state else None
+
+  def log(self, musicFile, stage, **fields):
+    from runJournal import STAGES
+
+    if stage not in STAGES:
+      raise ValueError(f"Unknown stage: {stage}")
+    musicFile = os.path.abspath(musicFile)
+    state = self.state(musicFile) or {}
+    state.update(fields, file=musicFile, stage=stage, time=time.time())
+    if not self.queue.record_progress(self.worker, musicFile, state):
+      raise LeaseLost(musicFile)
+
+
+def worker_id():
+  return f'{socket.gethostname()}:{os.getpid()}'
+
+
+async def run_worker(queue, concurrency=4, shazam=None, cache=None,
+                     manifest=None, catalog=None, max_attempts=None,
+                     follow=False, poll_interval=5.0, newFolder=None):
+  """
+  Drain a JobQueue through the cataloging pipeline (`main.main`).
+
+  Up to `concurrency` jobs are leased and processed at once, and their
+  leases are renewed every third of the lease time while they run. A job
+  whose lease was lost anyway (the worker stalled for longer than the
+  lease) is cancelled, and the lease is checked again right before the file
+  is tagged, see JobJournal. Only a tag still being written when its lease
+  runs out can't be stopped.
+
+  Args:
+  - queue: The JobQueue
+  - concurrency: The number of files processed at once
+  - shazam: The Shazam client, a new one if None
+  - cache: An optional RecognitionCache
+  - manifest: An optional ScanManifest
+  - catalog: An optional MusicCatalog
+  - max_attempts: How many times a file is tried before it is marked
+    failed, the queue's `max_attempts` if None
+  - follow: Keep polling for new jobs when the queue is empty; otherwise
+    the worker stops once no job is queued or leased
+  - poll_interval: Seconds between polls of an empty queue
+  - newFolder: The folder the renamed files are moved to, or None to rename
+    each file in its own folder
+
+  Returns:
+  - A Dictionary with the number of files catalogued, failed and not
+    recognised, and of results discarded because the lease was lost
+  """
+  from concurrent.futures import ThreadPoolExecutor
+
+  from main import main
+
+  if shazam is None:
+    from shazamio import Shazam
+    shazam = Shazam()
+  worker = worker_id()
+  journal = JobJournal(queue, worker)
+  tagExecutor = ThreadPoolExecutor(max_workers=concurrency,
+                                   thread_name_prefix='tagger')
+  stats = {'catalogued': 0, 'failed': 0, 'missed': 0, 'lost_leases': 0}
+  held = {}
+  lost = set()
+
+  async def heartbeat():
+    while True:
+      await asyncio.sleep(queue.lease_seconds / 3)
+      for path in queue.heartbeat(worker, list(held)):
+        # Another worker has the job now
+        lost.add(path)
+        held[path].cancel()
+
+  async def process(path):
+    try:
+      if journal.stage(path) == 'done':
+        # Only marking the job done was left
+        song_info = journal.state(path).get('song_info')
+      else:
+        song_info = await main(path, shazam, cache, tagExecutor,
+                               manifest=manifest, catalog=catalog,
+                               journal=journal, newFolder=newFolder)
+      owned = queue.complete(worker, path)
+      stats['catalogued' if song_info is not None else 'missed'] += 1
+    except LeaseLost:
+      owned = False
+    except asyncio.CancelledError:
+      if path not in lost:
+        raise
+      owned = False
+    except Exception as error:
+      print(f"{path} failed: {error!r}")
+      owned = queue.fail(worker, path, repr(error), max_attempts)
+      stats['failed'] += 1
+    finally:
+      held.pop(path, None)
+      lost.discard(path)
+    if not owned:
+      stats['lost_leases'] += 1
+      print(f"{path}: lease lost, left to the worker that has it now")
+
+  beats = asyncio.create_task(heartbeat())
+  running = set()
+  try:
+    while True:
+      free = concurrency - len(running)
+      paths = queue.lease(worker, free) if free else []
+      for path in paths:
+        held[path] = asyncio.create_task(process(path))
+        running.add(held[path])
+      if not running:
+        # Jobs leased elsewhere may still come back when their lease expires
+        if not follow and not queue.counts().get('leased'):
+          break
+        await asyncio.sleep(min(poll_interval, queue.lease_seconds))
+        continue
+      _, running = await asyncio.wait(running,
+                                      return_when=asyncio.FIRST_COMPLETED)
+  finally:
+    beats.cancel()
+    for task in running:
+      task.cancel()
+    tagExecutor.shutdown(wait=True)
+  return stats
+
+
+def _work(path, concurrency, lease_seconds, wal, follow, newFolder):
+  from musicCatalog import MusicCatalog
+  from recognitionCache import RecognitionCache
+  from scanManifest import ScanManifest
+
+  with JobQueue(path, lease_seconds, wal) as queue, RecognitionCache() \
+      as cache, ScanManifest() as manifest, MusicCatalog() as catalog:
+    stats = asyncio.run(run_worker(queue, concurrency, cache=cache,
+                                   manifest=manifest, catalog=catalog,
+                                   follow=follow, newFolder=newFolder))
+  print(f"[{worker_id()}] {stats}")
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+      description='Catalog a library with several worker processes.')
+  parser.add_argument('--db', default='catalog_jobs.sqlite', help='queue file')
+  parser.add_argument('--no-wal', action='store_true',
+                      help='for a queue file on a network file system')
+  commands = parser.add_subparsers(dest='command', required=True)
+
+  add = commands.add_parser('add', help='queue the music files of a folder')
+  add.add_argument('folder')
+
+  work = commands.add_parser('work', help='run worker processes')
+  work.add_argument('--processes', type=int, default=os.cpu_count())
+  work.add_argument('--concurrency', type=int, default=4,
+                    help='files in flight per process')
+  work.add_argument('--lease', type=float, default=120.0,
+                    help='lease time in seconds')
+  work.add_argument('--follow', action='store_true',
+                    help='wait for new jobs instead of exiting')
+  work.add_argument('--dest', help='move the renamed files to this folder '
+                    'instead of renaming them in place')
+
+  commands.add_parser('status', help='number of jobs per state')
+  requeue = commands.add_parser('requeue', help='queue jobs again')
+  requeue.add_argument('state', nargs='?', default='failed',
+                       choices=('failed', 'leased', 'done'))
+
+  args = parser.parse_args()
+  wal = not args.no_wal
+  if args.command == 'work':
+    processes = [multiprocessing.Process(
+        target=_work, args=(args.db, args.concurrency, args.lease, wal,
+                            args.follow, args.dest))
+                 for _ in range(args.processes)]
+    for process in processes:
+      process.start()
+    for process in processes:
+      process.join()
+  else:
+    with JobQueue(args.db, wal=wal) as queue:
+      if args.command == 'add':
+        from main import iter_music_files
+        print(f"{queue.add(iter_music_files(args.folder))} files queued")
+      elif args.command == 'requeue':
+        print(f"{queue.requeue(args.state)} jobs queued again")
+      print(queue.counts())
@@ -1,31 +1,485 @@
 import asyncio
-from shazamio import Shazam
+import functools
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from duplicates import group_duplicates, print_duplicate_report
 from helper import get_required_song_info
-from songMetadata import editMusicTag, get_music_metadata
+from pipelineMetrics import metrics
+from recognitionCache import audio_payload_hash, recognize_cached
+from recognitionScheduler import AdaptiveLimiter, RecognitionScheduler
+from scanManifest import FolderWatcher
+from signaturePool import SignatureRecognizer, signature_executor
+from windowedRecognition import WindowedRecognizer
+
+MUSIC_EXTENSIONS = ('.mp3',)
+# Watcher events for a file the pipeline wrote are ignored for this long
+OWN_WRITE_SECONDS = 5.0
 
 
-async def main(musicFile):
+def build_recognizer(shazam, fingerprints=None, window_seconds=None):
+  """
+  Stack the optional recognition stages in front of a Shazam client.
+
+  Args:
+  - shazam: The Shazam client
+  - fingerprints: An optional FingerprintIndex searched before calling Shazam
+  - window_seconds: Send Shazam windows of this many seconds instead of
+    whole files, or None to send whole files
+
+  Returns:
+  - An object with a Shazam compatible `recognize_song` coroutine
+  """
+  if window_seconds:
+    shazam = WindowedRecognizer(shazam, window_seconds)
+  if fingerprints is not None:
+    shazam = fingerprints.recognizer(shazam)
+  return shazam
+
+
+async def main(musicFile, shazam=None, cache=None, tagExecutor=None,
+               fingerprints=None, window_seconds=None, manifest=None,
+               catalog=None, duplicates=(), journal=None, coverArt=None,
+               audio_hash=None, written=None, newFolder=None):
   """
   Recognises the song and returns the metadata
 
   Args:
   - musicTrack: The path to the music file
+  - shazam: An optional Shazam client to reuse across calls
+  - cache: An optional RecognitionCache consulted before calling Shazam
+  - tagExecutor: The executor that runs the blocking tag and rename stage,
+    or None for the event loop's default executor
+  - fingerprints: An optional FingerprintIndex searched before calling Shazam
+  - window_seconds: Send Shazam windows of this many seconds instead of the
+    whole file
+  - manifest: An optional ScanManifest the catalogued file is recorded in
+  - catalog: An optional MusicCatalog the tagged track is written to
+  - duplicates: Other files with the same audio; they are tagged in place
+    with the same song information instead of being recognised again
+  - journal: An optional RunJournal; every stage is journaled before the
+    next one starts and the stages a previous run finished are skipped
+  - coverArt: An optional CoverArtFetcher; the song's cover art is embedded
+    in the tag
+  - audio_hash: The file's `audio_payload_hash` if already computed, so the
+    cache lookup doesn't read the file again
+  - written: An optional set the paths of the files this call wrote to (the
+    renamed file and the duplicates) are added to
+  - newFolder: The folder the renamed file is moved to (created if needed),
+    or None to rename it in its own folder
 
   Returns:
-  - A Dictionary with the metadata of the song created by Shazam 
+  - A Dictionary with the metadata of the song created by Shazam, or None
+    when Shazam did not recognise it; the file is then left untouched
   """
+  # shazamio and eyed3 take most of a second to import, they are only
+  # loaded once a file is actually catalogued
+  from songMetadata import editAndRenameTrack, writeSongInfo
 
-  shazam = Shazam()
-  out = await shazam.recognize_song(musicFile)
-  song_info = get_required_song_info(out)
-  editMusicTag(song_info, musicFile)
+  if shazam is None:
+    from shazamio import Shazam
+    shazam = Shazam()
+  shazam = build_recognizer(shazam, fingerprints, window_seconds)
+  state = journal.state(musicFile) if journal is not None else None
+  if state is not None:
+    # Recognised by a previous run
+    song_info = state['song_info']
+  else:
+    with metrics.span('recognize'):
+      if cache is not None:
+        out = await recognize_cached(shazam, musicFile, cache, audio_hash)
+      else:
+        out = await shazam.recognize_song(musicFile)
+    with metrics.span('extract'):
+      song_info = get_required_song_info(out)
+    recognised = bool(out.get('matches') and song_info.get('trackTitle')
+                      and song_info.get('trackArtist'))
+    metrics.increment('recognitions',
+                      result='match' if recognised else 'miss')
+    if not recognised:
+      # Tagging it would rename it to "None - None.mp3", or over another miss
+      print(f"{musicFile} not recognised, left untouched")
+      return None
+    if journal is not None:
+      journal.log(musicFile, 'recognized', song_info=song_info)
+  coverArtData = None
+  if coverArt is not None:
+    with metrics.span('cover_art'):
+      coverArtData = await coverArt.fetch(song_info)
+  loop = asyncio.get_running_loop()
+  newFolder = newFolder or os.path.dirname(os.path.abspath(musicFile))
+  # Before the tag is written, so a folder that can't be made fails early
+  os.makedirs(newFolder, exist_ok=True)
+  with metrics.span('tag'):
+    if journal is not None:
+      from runJournal import journaled_edit_and_rename
+      newPath = await loop.run_in_executor(
+          tagExecutor, functools.partial(
+              journaled_edit_and_rename, journal, song_info, musicFile,
+              newFolder, coverArt=coverArtData))
+    else:
+      newFilename = await loop.run_in_executor(
+          tagExecutor, functools.partial(
+              editAndRenameTrack, song_info, musicFile, newFolder,
+              coverArt=coverArtData))
+      newPath = os.path.join(newFolder, newFilename)
+  if written is not None:
+    written.add(newPath)
+  with metrics.span('record'):
+    if manifest is not None:
+      manifest.record(musicFile, newPath)
+    if catalog is not None:
+      catalog.add_track(song_info, newPath)
+  for duplicate in duplicates:
+    if written is not None:
+      written.add(duplicate)
+    # Tagged in place: the duplicate report printed before the run lists
+    # them at these paths, and renamed they would only become numbered
+    # copies of the original's name
+    try:
+      with metrics.span('tag'):
+        await loop.run_in_executor(tagExecutor, writeSongInfo, song_info,
+                                   duplicate, None, coverArtData)
+      if manifest is not None:
+        manifest.record(duplicate)
+      if catalog is not None:
+        catalog.add_track(song_info, duplicate)
+    except Exception as error:
+      print(f"{duplicate} (duplicate of {musicFile}) failed: {error!r}")
+  if journal is not None:
+    journal.log(musicFile, 'done')
   print(f"{musicFile} Catalouged!!\n\n")
   # print(get_music_metadata(musicFile))
+  return song_info
+
+
+def iter_music_files(musicFolder, extensions=MUSIC_EXTENSIONS):
+  """
+  Lazily walk a directory tree and yield the music files found in it.
+
+  Only one directory listing is held in memory at a time, so the walk stays
+  flat however large the library is. Each listing is read up front so files
+  renamed while cataloging are not yielded a second time.
+
+  Args:
+  - musicFolder: The root folder of the music library
+  - extensions: File extensions (lower case) that count as music files
+
+  Returns:
+  - A generator of file paths
+  """
+  pending = [musicFolder]
+  while pending:
+    folder = pending.pop()
+    try:
+      with os.scandir(folder) as it:
+        entries = sorted(it, key=lambda entry: entry.name)
+    except OSError as error:
+      print(f"Skipping {folder}: {error}")
+      continue
+
+    for entry in entries:
+      if entry.is_dir(follow_symlinks=False):
+        pending.append(entry.path)
+      elif entry.name.lower().endswith(extensions):
+        yield entry.path
+
+
+async def _report_progress(stats, interval):
+  while True:
+    await asyncio.sleep(interval)
+    elapsed = time.perf_counter() - stats['started']
+    done = stats['catalogued'] + stats['failed'] + stats['missed']
+    print(f"[library] {done} files in {elapsed:.1f}s "
+          f"({done / elapsed:.2f} files/s, {stats['failed']} failed, "
+          f"{stats['missed']} not recognised)")
+
+
+async def catalog_library(musicFolder, concurrency=8, report_interval=10.0,
+                          cache=None, tag_workers=4, fingerprints=None,
+                          window_seconds=None, manifest=None, watch=False,
+                          catalog=None, signature_workers=None, adaptive=False,
+                          shazam=None, stats_file=None, stats_interval=10.0,
+                          dedupe=False, perceptual=False, journal=None,
+                          cover_art=None, newFolder=None):
+  """
+  Catalog every music file below a folder with bounded parallelism.
+
+  A single Shazam client is shared by `concurrency` workers that pull files
+  from a bounded queue, so at most `concurrency` recognitions are in flight
+  and only a handful of paths are buffered at any time. Tagging and renaming
+  run in a separate thread pool of `tag_workers` threads, so disk-bound
+  tagging overlaps with network-bound recognition.
+
+  Args:
+  - musicFolder: The root folder of the music library
+  - concurrency: The number of recognitions kept in flight at once
+  - report_interval: Seconds between throughput reports, or None to disable
+  - cache: An optional RecognitionCache shared by all workers
+  - tag_workers: The number of files tagged and renamed at once
+  - fingerprints: An optional FingerprintIndex searched before calling
+    Shazam; tracks Shazam recognises are added to it
+  - window_seconds: Send Shazam windows of this many seconds instead of
+    whole files
+  - manifest: An optional ScanManifest; files catalogued by an earlier run
+    and unchanged since are skipped
+  - watch: After the scan, keep cataloging files as they land in the folder
+    (Linux inotify) until cancelled
+  - catalog: An optional MusicCatalog every tagged track is written to
+  - signature_workers: Decode audio and compute signatures in a pool of this
+    many processes (0 for one per core) instead of on the event loop. Files
+    are signed ahead of the network stage, at most as many as the queue
+    holds.
+  - adaptive: Schedule requests through a RecognitionScheduler: the number
+    in flight adapts (AIMD) between 1 and `concurrency`, with timeouts,
+    jittered retries and a circuit breaker
+  - shazam: The Shazam client to use, a new one if None (e.g. a FakeShazam)
+  - stats_file: Enable the pipeline metrics (stage latencies, counters and
+    queue gauges) and write them to this file every `stats_interval`
+    seconds and at the end: Prometheus text if it ends in '.prom', JSON
+    otherwise
+  - dedupe: Group the files by audio content before cataloging: only the
+    largest file of each group is recognised and renamed, the others are
+    tagged in place with its song information, and the groups are reported
+  - perceptual: With `dedupe`, also group copies encoded differently, by
+    their fingerprints (decodes one file per group)
+  - journal: An optional RunJournal. The files a previous run left
+    unfinished are resumed first, at the stage they stopped at, and every
+    stage of this run is journaled
+  - cover_art: An optional CoverArtFetcher shared by all workers; the cover
+    art of each album is downloaded once and embedded in every track
+  - newFolder: The folder every renamed file is moved to, or None to rename
+    each file in its own folder, which keeps the library's layout
+
+  Returns:
+  - A Dictionary with the catalogued/failed/missed counts, elapsed seconds
+    and the files per second achieved
+  """
+  from songMetadata import tag_write_stats
+
+  if shazam is None:
+    from shazamio import Shazam
+    shazam = Shazam()
+  scheduler = None
+  if adaptive:
+    limiter = AdaptiveLimiter(initial=min(4, concurrency), maximum=concurrency)
+    shazam = scheduler = RecognitionScheduler(shazam, limiter)
+  signatures = signatureExecutor = None
+  queue_size = concurrency * 2
+  if signature_workers is not None:
+    signature_workers = signature_workers or os.cpu_count()
+    signatureExecutor = signature_executor(signature_workers)
+    # The process pool signs the windows itself
+    shazam = signatures = SignatureRecognizer(shazam, signatureExecutor,
+                                              window_seconds)
+    window_seconds = None
+    queue_size += signature_workers * 2
+  shazam = build_recognizer(shazam, fingerprints, window_seconds)
+  tagExecutor = ThreadPoolExecutor(max_workers=tag_workers,
+                                   thread_name_prefix='tagger')
+  queue = asyncio.Queue(maxsize=queue_size)
+  stats = {'catalogued': 0, 'failed': 0, 'missed': 0, 'skipped': 0,
+           'duplicates': 0, 'resumed': 0, 'started': time.perf_counter()}
+  tagWrites = tag_write_stats()
+  copies = {}
+  audioHashes = {}
+  # Absolute paths queued or being catalogued, and when the watcher may
+  # report the files this run wrote again
+  inFlight = set()
+  resuming = set()
+  ownWrites = {}
+  if stats_file is not None:
+    metrics.enabled = True
+
+  def claim(musicFile):
+    path = os.path.abspath(musicFile)
+    if path in inFlight:
+      return False
+    inFlight.add(path)
+    return True
+
+  def is_own_write(musicFile):
+    path = os.path.abspath(musicFile)
+    return path in inFlight or ownWrites.get(path, 0) > time.monotonic()
+
+  def wrote(paths):
+    now = time.monotonic()
+    for path in [path for path, until in ownWrites.items() if until <= now]:
+      del ownWrites[path]
+    for path in paths:
+      ownWrites[os.path.abspath(path)] = now + OWN_WRITE_SECONDS
+
+  def is_done(musicFile):
+    if manifest is not None and manifest.is_current(musicFile):
+      stats['skipped'] += 1
+      metrics.increment('files', result='skipped')
+      return True
+    return False
+
+  async def worker():
+    while True:
+      musicFile = await queue.get()
+      metrics.set_gauge('queue_depth', queue.qsize())
+      try:
+        if musicFile is None:
+          return
+        path = os.path.abspath(musicFile)
+        # The file may have been renamed or catalogued since it was queued,
+        # unless a previous run stopped while renaming it
+        if path not in resuming and (not os.path.exists(musicFile)
+                                     or is_done(musicFile)):
+          continue
+        written = {musicFile}
+        try:
+          song_info = await main(musicFile, shazam, cache, tagExecutor,
+                                 manifest=manifest, catalog=catalog,
+                                 duplicates=copies.pop(musicFile, ()),
+                                 journal=journal, coverArt=cover_art,
+                                 audio_hash=audioHashes.get(musicFile),
+                                 written=written, newFolder=newFolder)
+        finally:
+          wrote(written)
+        if song_info is None:
+          stats['missed'] += 1
+          metrics.increment('files', result='missed')
+        else:
+          stats['catalogued'] += 1
+          metrics.increment('files', result='catalogued')
+      except Exception as error:
+        stats['failed'] += 1
+        metrics.increment('files', result='failed')
+        print(f"{musicFile} failed: {error!r}")
+      finally:
+        if signatures is not None and musicFile is not None:
+          signatures.discard(musicFile)
+        if musicFile is not None:
+          audioHashes.pop(musicFile, None)
+          inFlight.discard(os.path.abspath(musicFile))
+          resuming.discard(os.path.abspath(musicFile))
+        queue.task_done()
+
+  workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+  reporter = exporter = None
+  if report_interval:
+    reporter = asyncio.create_task(_report_progress(stats, report_interval))
+  if stats_file is not None:
+    exporter = asyncio.create_task(metrics.export(stats_file, stats_interval))
+
+  async def is_cached(musicFile):
+    loop = asyncio.get_running_loop()
+    try:
+      with metrics.span('audio_hash'):
+        audio_hash = await loop.run_in_executor(None, audio_payload_hash,
+                                                musicFile)
+    except OSError:
+      return False  # The worker reports it
+    audioHashes[musicFile] = audio_hash
+    return cache.contains(audio_hash)
+
+  async def enqueue(musicFile):
+    if not claim(musicFile):
+      return  # Queued already, or being catalogued
+    # A file the cache answers for is never sent, so it isn't signed either
+    if signatures is not None and not (cache is not None
+                                       and await is_cached(musicFile)):
+      # Start the CPU stage now; the queue bounds how far it runs ahead
+      signatures.prepare(musicFile)
+      metrics.set_gauge('signatures_pending', signatures.pending)
+    await queue.put(musicFile)
+    metrics.set_gauge('queue_depth', queue.qsize())
+
+  watcher = None
+  try:
+    if journal is not None:
+      # Straight to the queue: their signatures may never be needed
+      for musicFile in journal.unfinished():
+        stats['resumed'] += 1
+        claim(musicFile)
+        resuming.add(musicFile)
+        await queue.put(musicFile)
+      if stats['resumed']:
+        print(f"[library] resuming {stats['resumed']} unfinished files "
+              f"from {journal.path}")
+    musicFiles = (musicFile for musicFile in iter_music_files(musicFolder)
+                  if not is_done(musicFile) and (
+                      journal is None or journal.stage(musicFile) is None))
+    if dedupe:
+      loop = asyncio.get_running_loop()
+      with metrics.span('dedupe'):
+        groups = await loop.run_in_executor(None, group_duplicates,
+                                            list(musicFiles), perceptual)
+      print_duplicate_report(groups)
+      copies = {group[0]: group[1:] for group in groups if len(group) > 1}
+      stats['duplicates'] = sum(len(group) - 1 for group in groups)
+      musicFiles = [group[0] for group in groups]
+    for musicFile in musicFiles:
+      await enqueue(musicFile)
+    if watch:
+      watcher = FolderWatcher(musicFolder)
+      print(f"[library] watching {musicFolder} for new files")
+      async for musicFile in watcher:
+        # Tagging and renaming fire events too
+        if musicFile.lower().endswith(MUSIC_EXTENSIONS) \
+            and not is_own_write(musicFile):
+          await enqueue(musicFile)
+    for _ in workers:
+      await queue.put(None)
+    await asyncio.gather(*workers)
+  finally:
+    for task in workers:
+      task.cancel()
+    if reporter is not None:
+      reporter.cancel()
+    if exporter is not None:
+      exporter.cancel()
+    if watcher is not None:
+      watcher.close()
+    tagExecutor.shutdown(wait=True)
+    if signatureExecutor is not None:
+      signatureExecutor.shutdown(wait=True, cancel_futures=True)
+
+  elapsed = time.perf_counter() - stats.pop('started')
+  done = stats['catalogued'] + stats['failed'] + stats['missed']
+  stats['elapsed'] = elapsed
+  stats['files_per_second'] = done / elapsed if elapsed else 0.0
+  print(f"[library] {done} files in {elapsed:.1f}s "
+        f"({stats['files_per_second']:.2f} files/s, "
+        f"{stats['failed']} failed, {stats['missed']} not recognised, "
+        f"{stats['skipped']} unchanged)")
+  stats['tag_writes'] = {write: count - tagWrites[write]
+                         for write, count in tag_write_stats().items()}
+  print(f"[library] tags written in place: {stats['tag_writes']['in_place']}, "
+        f"files rewritten: {stats['tag_writes']['rewritten']}")
+  if dedupe:
+    print(f"[library] {stats['duplicates']} duplicates tagged without "
+          f"recognition")
+  if cache is not None:
+    stats['cache'] = cache.stats()
+    print(f"[library] cache {stats['cache']}")
+  if cover_art is not None:
+    stats['cover_art'] = cover_art.stats()
+    print(f"[library] cover art {stats['cover_art']}")
+  if scheduler is not None:
+    stats['scheduler'] = scheduler.stats()
+    print(f"[library] scheduler {stats['scheduler']}")
+  if fingerprints is not None:
+    stats['fingerprints'] = {'local_matches': shazam.local_matches,
+                             'remote_calls': shazam.remote_calls}
+    fingerprints.flush()
+    print(f"[library] fingerprints {stats['fingerprints']}")
+  if stats_file is not None:
+    metrics.write(stats_file)
+    stats['metrics'] = metrics.stats()
+    print(f"[library] stage metrics written to {stats_file}")
+  return stats
 
 
 
 if __name__ == '__main__':
-  musicFolder = u'test/music_folder'
-  musicTrack = f'{musicFolder}/Jack Harlow - Lovin On Me [Official Music Video] (320 kbps).mp3'
-  loop = asyncio.get_event_loop()
-  loop.run_until_complete(main(musicTrack))
+  # `python main.py <music folder> [scan options]` or `python main.py <file>`
+  from cli import run
+  arguments = sys.argv[1:]
+  command = 'scan' if arguments and os.path.isdir(arguments[0]) else 'tag'
+  sys.exit(run([command] + arguments))
@@ -0,0 +1,193 @@
+import argparse
+import asyncio
+import itertools
+import json
+
+from helper import get_required_song_info
+from pipelineMetrics import metrics
+from windowedRecognition import WINDOW_SECONDS, audio_duration, load_window
+
+MIX_STRIDE = 90
+MIX_RESOLUTION = 15
+
+
+def format_time(seconds):
+  minutes, seconds = divmod(int(seconds), 60)
+  hours, minutes = divmod(minutes, 60)
+  return f'{hours:02d}:{minutes:02d}:{seconds:02d}'
+
+
+class MixRecognizer:
+  """
+  Turns a long recording (a DJ mix, a radio show) into a tracklist.
+
+  Windows are first recognised `stride` seconds apart, all at once. Two
+  neighbouring windows that matched the same play of a track (same track
+  key, same start) leave nothing to look for between them. Between the
+  others the recording is bisected until the change of track is located to
+  `resolution` seconds. The `offset` of a match, how far into the track the
+  window was, tells where that track started, so the bisection only has to
+  search the part of the interval before it.
+
+  Two neighbouring windows that both failed to match are not bisected
+  either, so a stretch without music costs one request per `stride`.
+
+  Args:
+  - shazam: The Shazam client (or any object with a Shazam compatible
+    `recognize_song` coroutine that accepts an AudioSegment)
+  - window_seconds: The length of each window sent to Shazam
+  - stride: Seconds between the windows of the first pass
+  - resolution: How precisely the start of each track is located
+  - concurrency: The number of windows decoded and recognised at once
+  """
+
+  def __init__(self, shazam, window_seconds=WINDOW_SECONDS, stride=MIX_STRIDE,
+               resolution=MIX_RESOLUTION, concurrency=8):
+    self.shazam = shazam
+    self.window_seconds = window_seconds
+    self.stride = stride
+    self.resolution = resolution
+    self.concurrency = concurrency
+    self.windows_sent = 0
+
+  def duration(self, musicFile):
+    return audio_duration(musicFile)
+
+  def load_window(self, musicFile, start):
+    return load_window(musicFile, start, self.window_seconds)
+
+  async def _probe(self, musicFile, start, limit):
+    async with limit:
+      loop = asyncio.get_running_loop()
+      window = await loop.run_in_executor(None, self.load_window, musicFile,
+                                          start)
+      self.windows_sent += 1
+      with metrics.span('mix_window'):
+        out = await self.shazam.recognize_song(window)
+
+    probe = {'start': start, 'key': None, 'trackStart': None,
+             'song_info': None}
+    matches = out.get('matches')
+    if matches:
+      song_info = get_required_song_info(out)
+      probe['key'] = song_info.get('trackKey')
+      probe['song_info'] = song_info
+      probe['trackStart'] = max(0.0, start - matches[0].get('offset', 0.0))
+    return probe
+
+  def _same_play(self, first, second):
+    if first['key'] != second['key']:
+      return False
+    # Both unmatched, or the same track started at the same time
+    return first['key'] is None or \
+        abs(first['trackStart'] - second['trackStart']) <= self.resolution
+
+  async def _refine(self, musicFile, first, second, probes, limit):
+    if self._same_play(first, second):
+      return
+    end = second['start']
+    if second['key'] is not None and first['start'] < second['trackStart']:
+      # The second track is known to play from its start on
+      end = min(end, second['trackStart'])
+    if end - first['start'] <= self.resolution:
+      return
+
+    middle = await self._probe(musicFile, (first['start'] + end) / 2, limit)
+    probes.append(middle)
+    await asyncio.gather(
+        self._refine(musicFile, first, middle, probes, limit),
+        self._refine(musicFile, middle, second, probes, limit))
+
+  async def tracklist(self, musicFile):
+    """
+    Recognise the tracks played in a recording.
+
+    Args:
+    - musicFile: The path to the recording
+
+    Returns:
+    - A list with a Dictionary per track played, in order: `start` and `end`
+      (seconds into the recording), `windows` (the number of windows that
+      matched it) and `song_info` (as returned by `get_required_song_info`)
+    """
+    loop = asyncio.get_running_loop()
+    duration = await loop.run_in_executor(None, self.duration, musicFile)
+    last = max(0.0, duration - self.window_seconds)
+    starts = [float(start) for start in range(0, int(last), self.stride)]
+    if not starts or last - starts[-1] > self.resolution:
+      starts.append(last)
+
+    limit = asyncio.Semaphore(self.concurrency)
+    probes = list(await asyncio.gather(
+        *(self._probe(musicFile, start, limit) for start in starts)))
+    coarse = list(probes)
+    await asyncio.gather(
+        *(self._refine(musicFile, first, second, probes, limit)
+          for first, second in itertools.pairwise(coarse)))
+    return self._merge(sorted(probes, key=lambda probe: probe['start']),
+                       duration)
+
+  def _merge(self, probes, duration):
+    plays = []
+    for probe in probes:
+      if plays and self._same_play(plays[-1]['probes'][-1], probe):
+        plays[-1]['probes'].append(probe)
+      else:
+        plays.append({'probes': [probe]})
+
+    tracks = []
+    previous = 0.0
+    for play in plays:
+      first = play['probes'][0]
+      if first['key'] is None:
+        start = first['start']
+      else:
+        # Not before the last window that heard the previous play
+        start = max(previous,
+                    min(probe['trackStart'] for probe in play['probes']))
+      play['start'] = start
+      previous = play['probes'][-1]['start']
+    for play, following in zip(plays, plays[1:] + [None], strict=True):
+      first = play['probes'][0]
+      if first['key'] is None:
+        continue
+      tracks.append({
+          'start': play['start'],
+          'end': following['start'] if following else duration,
+          'windows': len(play['probes']),
+          'song_info': first['song_info'],
+      })
+    return tracks
+
+
+def print_tracklist(tracks):
+  for track in tracks:
+    song_info = track['song_info']
+    print(f"{format_time(track['start'])}  {song_info.get('trackArtist')} - "
+          f"{song_info.get('trackTitle')}")
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+      description='Recognise the tracks of a DJ mix or radio recording.')
+  parser.add_argument('recording')
+  parser.add_argument('--window', type=int, default=WINDOW_SECONDS,
+                      help='seconds of audio per window')
+  parser.add_argument('--stride', type=int, default=MIX_STRIDE,
+                      help='seconds between the windows of the first pass')
+  parser.add_argument('--resolution', type=int, default=MIX_RESOLUTION,
+                      help='how precisely track starts are located, seconds')
+  parser.add_argument('--concurrency', type=int, default=8)
+  parser.add_argument('--json', help='also write the tracklist to this file')
+  args = parser.parse_args()
+
+  from shazamio import Shazam
+
+  recognizer = MixRecognizer(Shazam(), args.window, args.stride,
+                             args.resolution, args.concurrency)
+  tracks = asyncio.run(recognizer.tracklist(args.recording))
+  print_tracklist(tracks)
+  print(f"{len(tracks)} tracks, {recognizer.windows_sent} windows sent")
+  if args.json:
+    with open(args.json, 'w', encoding='utf-8') as json_file:
+      json.dump(tracks, json_file, ensure_ascii=False, indent=2)
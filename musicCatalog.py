@@ -0,0 +1,193 @@
+import os
+import sqlite3
+import sys
+import time
+
+CATALOG_FIELDS = ('title', 'artist', 'album', 'publisher', 'genre',
+                  'release_year', 'track_key', 'isrc', 'path')
+INDEXED_FIELDS = ('artist', 'album', 'genre', 'release_year', 'track_key',
+                  'isrc')
+
+
+def _release_year(released):
+  if released is None:
+    return None
+  released = str(released).strip()
+  return int(released[:4]) if released[:4].isdigit() else None
+
+
+class MusicCatalog:
+  """
+  Indexed SQLite catalog of the tagged library.
+
+  Tracks are written as the pipeline tags them, so questions about the
+  library are answered from the index instead of re-reading every MP3.
+
+  Args:
+  - path: The SQLite database file
+  """
+
+  def __init__(self, path='catalog.sqlite'):
+    self.path = path
+    self._connection = sqlite3.connect(path)
+    self._connection.row_factory = sqlite3.Row
+    self._connection.execute('PRAGMA journal_mode=WAL')
+    self._connection.execute(
+        'CREATE TABLE IF NOT EXISTS tracks ('
+        ' path TEXT PRIMARY KEY,'
+        ' title TEXT,'
+        ' artist TEXT COLLATE NOCASE,'
+        ' album TEXT COLLATE NOCASE,'
+        ' publisher TEXT,'
+        ' genre TEXT COLLATE NOCASE,'
+        ' release_year INTEGER,'
+        ' track_key TEXT,'
+        ' isrc TEXT,'
+        ' catalogued REAL NOT NULL)')
+    for field in INDEXED_FIELDS:
+      self._connection.execute(
+          f'CREATE INDEX IF NOT EXISTS tracks_{field} ON tracks ({field})')
+    self._connection.commit()
+
+  def add_track(self, song_info, path):
+    """
+    Add or update a track from the song information the pipeline tagged it
+    with.
+
+    Args:
+    - song_info: The dictionary returned by `get_required_song_info`
+    - path: The path of the tagged (and renamed) file
+    """
+    self._upsert({
+        'path': os.path.abspath(path),
+        'title': song_info.get('trackTitle'),
+        'artist': song_info.get('trackArtist'),
+        'album': song_info.get('Album'),
+        'publisher': song_info.get('Label'),
+        'genre': song_info.get('primary_genre'),
+        'release_year': _release_year(song_info.get('Released')),
+        'track_key': song_info.get('trackKey'),
+        'isrc': song_info.get('isrc'),
+    })
+
+  def add_metadata(self, metadata, path):
+    """
+    Add or update a track from the dictionary returned by
+    `get_music_metadata` or `fastId3.read_music_metadata`, e.g. to import
+    files tagged before the catalog existed.
+    """
+    self._upsert({
+        'path': os.path.abspath(path),
+        'title': metadata.get('Title'),
+        'artist': metadata.get('Artist'),
+        'album': metadata.get('Album'),
+        'publisher': metadata.get('Publisher'),
+        'genre': metadata.get('Genre') or None,
+        'release_year': _release_year(metadata.get('Release_date')),
+        'track_key': None,
+        'isrc': None,
+    })
+
+  def _upsert(self, row):
+    row['catalogued'] = time.time()
+    columns = ', '.join(row)
+    self._connection.execute(
+        f'INSERT OR REPLACE INTO tracks ({columns})'
+        f' VALUES ({", ".join("?" * len(row))})', tuple(row.values()))
+    self._connection.commit()
+
+  def remove(self, path):
+    self._connection.execute('DELETE FROM tracks WHERE path = ?',
+                             (os.path.abspath(path), ))
+    self._connection.commit()
+
+  def query(self, title=None, artist=None, album=None, genre=None, year=None,
+            missing=None, limit=None):
+    """
+    Find tracks in the catalog.
+
+    Args:
+    - title, artist, album, genre: Exact (case-insensitive for artist, album
+      and genre) matches, or patterns when they contain '%' or '_'
+    - year: The release year
+    - missing: A field name; only tracks where it is empty are returned
+    - limit: The maximum number of tracks returned
+
+    Returns:
+    - A list of dictionaries with the CATALOG_FIELDS of each track
+    """
+    where, values = [], []
+    for field, value in (('title', title), ('artist', artist),
+                         ('album', album), ('genre', genre)):
+      if value is not None:
+        operator = 'LIKE' if '%' in value or '_' in value else '='
+        where.append(f'{field} {operator} ?')
+        values.append(value)
+    if year is not None:
+      where.append('release_year = ?')
+      values.append(int(year))
+    if missing is not None:
+      if missing not in CATALOG_FIELDS:
+        raise ValueError(f"Unknown field: {missing}")
+      where.append(f"({missing} IS NULL OR {missing} = '')")
+
+    sql = f'SELECT {", ".join(CATALOG_FIELDS)} FROM tracks'
+    if where:
+      sql += ' WHERE ' + ' AND '.join(where)
+    sql += ' ORDER BY artist, album, title'
+    if limit is not None:
+      sql += ' LIMIT ?'
+      values.append(int(limit))
+    return [dict(row) for row in self._connection.execute(sql, values)]
+
+  def count_by(self, field):
+    """
+    Returns:
+    - A list of (value, number of tracks) tuples for a field, most common
+      first
+    """
+    if field not in INDEXED_FIELDS:
+      raise ValueError(f"Cannot group by: {field}")
+    return [tuple(row) for row in self._connection.execute(
+        f'SELECT {field}, COUNT(*) AS tracks FROM tracks'
+        f' GROUP BY {field} ORDER BY tracks DESC')]
+
+  def __len__(self):
+    return self._connection.execute('SELECT COUNT(*) FROM tracks').fetchone()[0]
+
+  def close(self):
+    self._connection.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+
+def import_folder(catalog, musicFolder):
+  """
+  Add every MP3 file below a folder to the catalog from its current tags.
+
+  Returns:
+  - The number of files imported
+  """
+  from fastId3 import read_music_metadata_bulk
+  from main import iter_music_files
+
+  imported = 0
+  for musicFile, metadata in read_music_metadata_bulk(
+      iter_music_files(musicFolder)):
+    if metadata is None:
+      print(f"{musicFile} skipped: unreadable tag", file=sys.stderr)
+      continue
+    catalog.add_metadata(metadata, musicFile)
+    imported += 1
+  return imported
+
+
+
+if __name__ == '__main__':
+  # Same commands as cli.py, e.g. `query --artist ...` or `import <folder>`
+  from cli import run
+  sys.exit(run(sys.argv[1:]))
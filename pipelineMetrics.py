@@ -0,0 +1,231 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.00001, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+                   0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0, 60.0)
+
+
+class Histogram:
+  """
+  Latency histogram with fixed buckets, as Prometheus histograms have.
+
+  Args:
+  - buckets: The sorted upper bounds of the buckets, in seconds
+  """
+
+  def __init__(self, buckets=LATENCY_BUCKETS):
+    self.buckets = buckets
+    # The last bucket holds everything above the largest bound
+    self.counts = [0] * (len(buckets) + 1)
+    self.count = 0
+    self.sum = 0.0
+    self.max = 0.0
+
+  def observe(self, value):
+    self.counts[bisect_left(self.buckets, value)] += 1
+    self.count += 1
+    self.sum += value
+    if value > self.max:
+      self.max = value
+
+  def quantile(self, fraction):
+    """
+    Returns:
+    - The upper bound of the bucket the quantile falls in (the largest
+      observed value for the last bucket)
+    """
+    rank = fraction * self.count
+    seen = 0
+    # The overflow bucket is left out, it falls through to the maximum
+    for bound, count in zip(self.buckets, self.counts, strict=False):
+      seen += count
+      if seen >= rank:
+        return min(bound, self.max)
+    return self.max
+
+  def stats(self):
+    return {
+        'count': self.count,
+        'sum': self.sum,
+        'mean': self.sum / self.count if self.count else 0.0,
+        'p50': self.quantile(0.5),
+        'p95': self.quantile(0.95),
+        'p99': self.quantile(0.99),
+        'max': self.max,
+    }
+
+
+class _Span:
+  __slots__ = ('metrics', 'stage', 'started')
+
+  def __init__(self, metrics, stage):
+    self.metrics = metrics
+    self.stage = stage
+
+  def __enter__(self):
+    self.started = time.perf_counter()
+    return self
+
+  def __exit__(self, exc_type, *exc_info):
+    self.metrics.observe(self.stage, time.perf_counter() - self.started)
+    if exc_type is not None:
+      self.metrics.increment('errors', stage=self.stage)
+    return False
+
+
+class _NullSpan:
+  __slots__ = ()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def _labels(labels):
+  return ','.join(f'{name}="{value}"' for name, value in labels)
+
+
+class PipelineMetrics:
+  """
+  Stage timings, counters and gauges of the cataloging pipeline.
+
+  Disabled, `span` returns a shared do-nothing context manager and the
+  other methods return straight away, so the instrumentation costs about a
+  method call per stage. The methods may be called from the tagging
+  threads as well as from the event loop.
+
+  Args:
+  - enabled: Whether anything is recorded
+  - namespace: The prefix of the exported metric names
+  """
+
+  def __init__(self, enabled=False, namespace='catalog'):
+    self.enabled = enabled
+    self.namespace = namespace
+    self._lock = threading.Lock()
+    self.reset()
+
+  def reset(self):
+    with self._lock:
+      self.stages = {}
+      self.counters = {}
+      self.gauges = {}
+
+  def span(self, stage):
+    """
+    Time a stage: `with metrics.span('tag_save'): ...`.
+
+    The duration is added to the stage's histogram and an exception leaving
+    the block counts as an error of the stage.
+    """
+    if not self.enabled:
+      return _NULL_SPAN
+    return _Span(self, stage)
+
+  def observe(self, stage, seconds):
+    if not self.enabled:
+      return
+    with self._lock:
+      histogram = self.stages.get(stage)
+      if histogram is None:
+        histogram = self.stages[stage] = Histogram()
+      histogram.observe(seconds)
+
+  def increment(self, name, amount=1, **labels):
+    if not self.enabled:
+      return
+    key = (name, tuple(sorted(labels.items())))
+    with self._lock:
+      self.counters[key] = self.counters.get(key, 0) + amount
+
+  def set_gauge(self, name, value):
+    if self.enabled:
+      self.gauges[name] = value
+
+  def stats(self):
+    """
+    Returns:
+    - A Dictionary with the latency summary of every stage, the counters
+      (keyed 'name{label="value"}') and the gauges
+    """
+    with self._lock:
+      return {
+          'stages': {stage: histogram.stats()
+                     for stage, histogram in sorted(self.stages.items())},
+          'counters': {
+              name + (f'{{{_labels(labels)}}}' if labels else ''): value
+              for (name, labels), value in sorted(self.counters.items())
+          },
+          'gauges': dict(sorted(self.gauges.items())),
+      }
+
+  def prometheus(self):
+    """
+    Returns:
+    - The metrics in the Prometheus text exposition format
+    """
+    prefix = self.namespace
+    lines = []
+    with self._lock:
+      if self.stages:
+        lines.append(f'# TYPE {prefix}_stage_seconds histogram')
+      for stage, histogram in sorted(self.stages.items()):
+        cumulative = 0
+        for bound, count in zip(histogram.buckets + ('+Inf', ),
+                                histogram.counts, strict=True):
+          cumulative += count
+          lines.append(f'{prefix}_stage_seconds_bucket'
+                       f'{{stage="{stage}",le="{bound}"}} {cumulative}')
+        lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} '
+                     f'{histogram.sum}')
+        lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} '
+                     f'{histogram.count}')
+
+      typed = set()
+      for (name, labels), value in sorted(self.counters.items()):
+        if name not in typed:
+          lines.append(f'# TYPE {prefix}_{name}_total counter')
+          typed.add(name)
+        labels = f'{{{_labels(labels)}}}' if labels else ''
+        lines.append(f'{prefix}_{name}_total{labels} {value}')
+
+      for name, value in sorted(self.gauges.items()):
+        lines.append(f'# TYPE {prefix}_{name} gauge')
+        lines.append(f'{prefix}_{name} {value}')
+    return '\n'.join(lines) + '\n'
+
+  def write(self, path):
+    """
+    Atomically write the metrics to a file: Prometheus text when the file
+    ends in '.prom' (for the node_exporter textfile collector), JSON
+    otherwise.
+    """
+    if path.endswith('.prom'):
+      text = self.prometheus()
+    else:
+      text = json.dumps(dict(self.stats(), written=time.time()), indent=2)
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w') as stats_file:
+      stats_file.write(text)
+    os.replace(temporary, path)
+
+  async def export(self, path, interval=10.0):
+    """Write the metrics to `path` every `interval` seconds until cancelled."""
+    while True:
+      await asyncio.sleep(interval)
+      self.write(path)
+
+
+# Shared by every stage of the pipeline; disabled until a run asks for it
+metrics = PipelineMetrics()
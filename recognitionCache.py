@@ -0,0 +1,243 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from pipelineMetrics import metrics
+
+ID3V2_HEADER_SIZE = 10
+ID3V1_TAG_SIZE = 128
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def audio_payload_span(file_path):
+  """
+  Find the byte range of a music file that holds the audio frames.
+
+  Args:
+  - file_path: The path to the music file
+
+  Returns:
+  - A (start, end) tuple of byte offsets that excludes any leading ID3v2 tag
+    (including its padding and footer) and any trailing ID3v1 tag
+  """
+  end = os.path.getsize(file_path)
+  start = 0
+  with open(file_path, 'rb') as music_file:
+    header = music_file.read(ID3V2_HEADER_SIZE)
+    if len(header) == ID3V2_HEADER_SIZE and header[:3] == b'ID3':
+      size = ((header[6] & 0x7f) << 21 | (header[7] & 0x7f) << 14
+              | (header[8] & 0x7f) << 7 | (header[9] & 0x7f))
+      start = ID3V2_HEADER_SIZE + size
+      if header[5] & 0x10:
+        start += ID3V2_HEADER_SIZE
+
+    if end - start >= ID3V1_TAG_SIZE:
+      music_file.seek(end - ID3V1_TAG_SIZE)
+      if music_file.read(3) == b'TAG':
+        end -= ID3V1_TAG_SIZE
+
+  return min(start, end), end
+
+
+def audio_payload_hash(file_path):
+  """
+  Hash the audio frames of a music file, ignoring its ID3 tags.
+
+  Re-tagging or renaming a file therefore leaves the hash unchanged, and
+  byte-identical copies of the audio share the same hash.
+
+  Args:
+  - file_path: The path to the music file
+
+  Returns:
+  - The hex digest of the audio payload
+  """
+  start, end = audio_payload_span(file_path)
+  digest = hashlib.blake2b(digest_size=20)
+  with open(file_path, 'rb') as music_file:
+    music_file.seek(start)
+    remaining = end - start
+    while remaining > 0:
+      chunk = music_file.read(min(HASH_CHUNK_SIZE, remaining))
+      if not chunk:
+        break
+      digest.update(chunk)
+      remaining -= len(chunk)
+  return digest.hexdigest()
+
+
+class RecognitionCache:
+  """
+  On-disk cache of raw Shazam responses keyed by the audio payload hash.
+
+  Args:
+  - path: The SQLite database file
+  - max_entries: Keep at most this many responses (least recently used are
+    evicted first), or None for no limit
+  - max_age: Drop responses older than this many seconds, or None to keep
+    them forever
+  """
+
+  def __init__(self, path='recognition_cache.sqlite', max_entries=None,
+               max_age=None):
+    self.path = path
+    self.max_entries = max_entries
+    self.max_age = max_age
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self._connection = sqlite3.connect(path)
+    self._connection.execute('PRAGMA journal_mode=WAL')
+    self._connection.execute('PRAGMA synchronous=NORMAL')
+    self._connection.execute(
+        'CREATE TABLE IF NOT EXISTS recognitions ('
+        ' audio_hash TEXT PRIMARY KEY,'
+        ' response TEXT NOT NULL,'
+        ' created REAL NOT NULL,'
+        ' last_used REAL NOT NULL)')
+    self._connection.execute(
+        'CREATE INDEX IF NOT EXISTS recognitions_last_used'
+        ' ON recognitions (last_used)')
+    self._connection.commit()
+
+  def get(self, audio_hash):
+    """
+    Look up a cached response.
+
+    Args:
+    - audio_hash: The hash returned by `audio_payload_hash`
+
+    Returns:
+    - The cached Shazam response, or None on a miss or an expired entry
+    """
+    row = self._connection.execute(
+        'SELECT response, created FROM recognitions WHERE audio_hash = ?',
+        (audio_hash, )).fetchone()
+    now = time.time()
+    if row is not None and self.max_age is not None \
+        and now - row[1] > self.max_age:
+      self._connection.execute(
+          'DELETE FROM recognitions WHERE audio_hash = ?', (audio_hash, ))
+      self._connection.commit()
+      self.evictions += 1
+      row = None
+
+    if row is None:
+      self.misses += 1
+      return None
+
+    self.hits += 1
+    self._connection.execute(
+        'UPDATE recognitions SET last_used = ? WHERE audio_hash = ?',
+        (now, audio_hash))
+    self._connection.commit()
+    return json.loads(row[0])
+
+  def contains(self, audio_hash):
+    """
+    Returns:
+    - Whether a response that has not expired is cached for this hash, without
+      counting a hit or a miss
+    """
+    row = self._connection.execute(
+        'SELECT created FROM recognitions WHERE audio_hash = ?',
+        (audio_hash, )).fetchone()
+    return row is not None and (self.max_age is None
+                                or time.time() - row[0] <= self.max_age)
+
+  def put(self, audio_hash, response):
+    """
+    Store a Shazam response and apply the eviction policy.
+
+    Args:
+    - audio_hash: The hash returned by `audio_payload_hash`
+    - response: The raw response returned by `Shazam.recognize_song`
+    """
+    now = time.time()
+    self._connection.execute(
+        'INSERT OR REPLACE INTO recognitions'
+        ' (audio_hash, response, created, last_used) VALUES (?, ?, ?, ?)',
+        (audio_hash, json.dumps(response, separators=(',', ':')), now, now))
+    self._connection.commit()
+    self.evict()
+
+  def evict(self):
+    """
+    Remove expired entries and trim the cache down to `max_entries`.
+
+    Returns:
+    - The number of entries removed
+    """
+    removed = 0
+    if self.max_age is not None:
+      removed += self._connection.execute(
+          'DELETE FROM recognitions WHERE created < ?',
+          (time.time() - self.max_age, )).rowcount
+    if self.max_entries is not None:
+      removed += self._connection.execute(
+          'DELETE FROM recognitions WHERE audio_hash IN ('
+          ' SELECT audio_hash FROM recognitions'
+          ' ORDER BY last_used DESC LIMIT -1 OFFSET ?)',
+          (self.max_entries, )).rowcount
+    if removed:
+      self._connection.commit()
+      self.evictions += removed
+    return removed
+
+  def stats(self):
+    """
+    Returns:
+    - A Dictionary with the entry count, hits, misses, evictions and hit rate
+    """
+    entries = self._connection.execute(
+        'SELECT COUNT(*) FROM recognitions').fetchone()[0]
+    lookups = self.hits + self.misses
+    return {
+        'entries': entries,
+        'hits': self.hits,
+        'misses': self.misses,
+        'evictions': self.evictions,
+        'hit_rate': self.hits / lookups if lookups else 0.0,
+    }
+
+  def close(self):
+    self._connection.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+
+async def recognize_cached(shazam, musicFile, cache, audio_hash=None):
+  """
+  Recognise a song, answering from the cache when the audio is already known.
+
+  Only responses that contain a match are cached, so unrecognised files are
+  retried on the next run.
+
+  Args:
+  - shazam: The Shazam client used on a cache miss
+  - musicFile: The path to the music file
+  - cache: A RecognitionCache
+  - audio_hash: The file's `audio_payload_hash` if already computed
+
+  Returns:
+  - The raw Shazam response
+  """
+  if audio_hash is None:
+    loop = asyncio.get_running_loop()
+    with metrics.span('audio_hash'):
+      audio_hash = await loop.run_in_executor(None, audio_payload_hash,
+                                              musicFile)
+  out = cache.get(audio_hash)
+  metrics.increment('cache', result='miss' if out is None else 'hit')
+  if out is None:
+    out = await shazam.recognize_song(musicFile)
+    if out.get('matches'):
+      cache.put(audio_hash, out)
+  return out
@@ -0,0 +1,220 @@
+import asyncio
+import random
+import time
+
+from pipelineMetrics import metrics
+
+NON_RETRYABLE_ERRORS = (FileNotFoundError, IsADirectoryError, PermissionError)
+
+
+class AdaptiveLimiter:
+  """
+  Concurrency limit adapted to the backend with AIMD (additive increase,
+  multiplicative decrease), as TCP does for its congestion window.
+
+  Each fast, successful request grows the limit by 1/limit (about +1 per
+  round of requests); a failure or a response slower than `latency_target`
+  multiplies it by `backoff`, at most once per `latency_target` seconds.
+
+  Args:
+  - initial: The starting limit
+  - minimum: The lowest the limit can go
+  - maximum: The highest the limit can go
+  - latency_target: Responses slower than this count as congestion
+  - backoff: The multiplicative decrease factor
+  """
+
+  def __init__(self, initial=4, minimum=1, maximum=32, latency_target=5.0,
+               backoff=0.5):
+    self.limit = float(initial)
+    self.minimum = minimum
+    self.maximum = maximum
+    self.latency_target = latency_target
+    self.backoff = backoff
+    self.in_flight = 0
+    self._last_decrease = 0.0
+    self._condition = asyncio.Condition()
+
+  async def acquire(self):
+    async with self._condition:
+      await self._condition.wait_for(
+          lambda: self.in_flight < int(self.limit))
+      self.in_flight += 1
+
+  async def release(self, ok, latency):
+    async with self._condition:
+      self.in_flight -= 1
+      now = time.monotonic()
+      if ok and latency <= self.latency_target:
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+      elif now - self._last_decrease >= self.latency_target:
+        self.limit = max(self.minimum, self.limit * self.backoff)
+        self._last_decrease = now
+      self._condition.notify_all()
+
+
+class CircuitOpenError(Exception):
+  """Raised when the circuit breaker refuses to wait for the backend."""
+
+
+class CircuitBreaker:
+  """
+  Pauses all submissions while the backend is failing.
+
+  After `failure_threshold` consecutive failures the circuit opens and
+  callers wait for `reset_timeout` seconds; then a single probe request is
+  let through (half-open). Its success closes the circuit, its failure opens
+  it again for twice as long, up to `max_reset_timeout`.
+
+  Args:
+  - failure_threshold: Consecutive failures that open the circuit
+  - reset_timeout: Seconds the circuit stays open the first time
+  - max_reset_timeout: The longest the circuit stays open
+  """
+
+  CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+  def __init__(self, failure_threshold=5, reset_timeout=10.0,
+               max_reset_timeout=300.0):
+    self.failure_threshold = failure_threshold
+    self.reset_timeout = reset_timeout
+    self.max_reset_timeout = max_reset_timeout
+    self.state = self.CLOSED
+    self.failures = 0
+    self.opened = 0
+    self._open_for = reset_timeout
+    self._retry_at = 0.0
+    self._probing = False
+
+  async def wait_ready(self):
+    """Wait until a request may be sent."""
+    while True:
+      if self.state == self.CLOSED:
+        return
+      now = time.monotonic()
+      if self.state == self.OPEN and now >= self._retry_at:
+        self.state = self.HALF_OPEN
+      if self.state == self.HALF_OPEN and not self._probing:
+        self._probing = True
+        return
+      await asyncio.sleep(max(0.05, self._retry_at - now))
+
+  def record(self, ok):
+    if ok:
+      self.state = self.CLOSED
+      self.failures = 0
+      self._open_for = self.reset_timeout
+    else:
+      self.failures += 1
+      if self.state == self.HALF_OPEN:
+        self._open_for = min(self.max_reset_timeout, self._open_for * 2)
+        self._open()
+      elif self.failures >= self.failure_threshold \
+          and self.state == self.CLOSED:
+        self._open()
+    self._probing = False
+
+  def abandon_probe(self):
+    """Let another caller probe, the one `wait_ready` let through gave up."""
+    self._probing = False
+
+  def _open(self):
+    self.state = self.OPEN
+    self.opened += 1
+    self._retry_at = time.monotonic() + self._open_for
+
+
+class RecognitionScheduler:
+  """
+  Drop-in for a Shazam client that schedules every request through an
+  AdaptiveLimiter and a CircuitBreaker, with a per-request timeout and
+  retries with jittered exponential backoff.
+
+  Args:
+  - shazam: The Shazam client (or FakeShazam)
+  - limiter: The AdaptiveLimiter, a default one if None
+  - breaker: The CircuitBreaker, a default one if None
+  - timeout: Seconds before a request is abandoned
+  - retries: How many times a failed request is retried
+  - backoff: The base delay before the first retry, in seconds
+  - max_backoff: The longest delay between retries
+  """
+
+  def __init__(self, shazam, limiter=None, breaker=None, timeout=20.0,
+               retries=4, backoff=0.5, max_backoff=30.0):
+    self.shazam = shazam
+    self.limiter = limiter or AdaptiveLimiter()
+    self.breaker = breaker or CircuitBreaker()
+    self.timeout = timeout
+    self.retries = retries
+    self.backoff = backoff
+    self.max_backoff = max_backoff
+    self.random = random.Random()
+    self.requests = 0
+    self.retried = 0
+    self.timeouts = 0
+    self.errors = 0
+
+  def _delay(self, attempt):
+    # "Full jitter": a random delay up to the exponential cap
+    cap = min(self.max_backoff, self.backoff * 2 ** attempt)
+    return self.random.uniform(0, cap)
+
+  async def _schedule(self, request, data):
+    for attempt in range(self.retries + 1):
+      await self.breaker.wait_ready()
+      try:
+        await self.limiter.acquire()
+      except BaseException:
+        # Cancelled before the request was sent, it proved nothing
+        self.breaker.abandon_probe()
+        raise
+      started = time.monotonic()
+      ok = False
+      try:
+        self.requests += 1
+        out = await asyncio.wait_for(request(data), self.timeout)
+        ok = True
+        return out
+      except NON_RETRYABLE_ERRORS:
+        ok = True  # Not the backend's fault
+        raise
+      except asyncio.TimeoutError as error:
+        self.timeouts += 1
+        last_error = error
+      except Exception as error:
+        self.errors += 1
+        last_error = error
+      finally:
+        # Recorded first, a cancellation while releasing can't skip it
+        self.breaker.record(ok)
+        await self.limiter.release(ok, time.monotonic() - started)
+        metrics.set_gauge('recognition_limit', int(self.limiter.limit))
+
+      if attempt < self.retries:
+        self.retried += 1
+        metrics.increment('recognition_retries')
+        await asyncio.sleep(self._delay(attempt))
+    raise last_error
+
+  async def recognize_song(self, data):
+    return await self._schedule(self.shazam.recognize_song, data)
+
+  async def send_recognize_request(self, sig):
+    return await self._schedule(self.shazam.send_recognize_request, sig)
+
+  def stats(self):
+    """
+    Returns:
+    - A Dictionary with the request, retry, timeout and error counts, the
+      current concurrency limit and the circuit state
+    """
+    return {
+        'requests': self.requests,
+        'retried': self.retried,
+        'timeouts': self.timeouts,
+        'errors': self.errors,
+        'limit': round(self.limiter.limit, 2),
+        'circuit': self.breaker.state,
+        'circuit_opened': self.breaker.opened,
+    }
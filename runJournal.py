@@ -0,0 +1,196 @@
+import json
+import os
+import threading
+import time
+
+from pipelineMetrics import metrics
+from songMetadata import move_file, numbered_path, track_filename, writeSongInfo
+
+# The stages a file goes through, in order
+STAGES = ('recognized', 'tagged', 'renamed', 'done')
+# Records of finished files and superseded stages the journal file may hold
+# before it is rewritten
+COMPACT_RECORDS = 10000
+
+
+class RunJournal:
+  """
+  Append-only write-ahead journal of a cataloging run.
+
+  Every file's progress is appended as one JSON line per stage, each one
+  flushed to disk before the work it announces or after the work it
+  records:
+
+  - recognized: the song information, so a restart never calls Shazam again
+  - tagged: written before the tag, with the path the file will be renamed
+    to and its inode; a file resumed at this stage is tagged again (the
+    same tag, so that is harmless) and renamed
+  - renamed: the file was moved, with its old and new paths (the new one
+    numbered when another file already had the name)
+  - done: the manifest and the catalog were updated
+
+  Reopening the journal replays it, so a restarted run resumes every file
+  at the stage it stopped at. A file is forgotten once it is done, and the
+  journal file is rewritten with only the files in progress whenever it
+  holds `compact_records` records more than that, so memory and disk stay
+  as small as the work in progress, in watch mode too.
+
+  Args:
+  - path: The journal file
+  - fsync: Force every record to disk (slower, but survives a power cut and
+    not only a crash of the process)
+  - compact_records: Rewrite the journal file once it holds this many
+    records of finished files and superseded stages
+  """
+
+  def __init__(self, path='catalog_journal.jsonl', fsync=True,
+               compact_records=COMPACT_RECORDS):
+    self.path = path
+    self.fsync = fsync
+    self.compact_records = compact_records
+    self._lock = threading.Lock()
+    self._states = {}
+    self._file = None
+    if os.path.exists(path):
+      with open(path, encoding='utf-8') as journal_file:
+        for line in journal_file:
+          try:
+            record = json.loads(line)
+          except ValueError:
+            continue  # A record torn by the crash, its stage did not happen
+          self._apply(record)
+    self.compact()
+
+  def _apply(self, record):
+    if record['stage'] == 'done':
+      self._states.pop(record['file'], None)
+    else:
+      self._states.setdefault(record['file'], {}).update(record)
+
+  def compact(self):
+    """Rewrite the journal with only the files that are not done."""
+    with self._lock:
+      self._compact()
+
+  def _compact(self):
+    temporary = f'{self.path}.tmp'
+    with open(temporary, 'w', encoding='utf-8') as journal_file:
+      for state in self._states.values():
+        journal_file.write(json.dumps(state) + '\n')
+      journal_file.flush()
+      os.fsync(journal_file.fileno())
+    os.replace(temporary, self.path)
+    if self._file is not None:
+      self._file.close()
+    # Kept open for the appends until `close`
+    self._file = open(self.path, 'a', encoding='utf-8')  # noqa: SIM115
+    self._records = len(self._states)
+
+  def state(self, musicFile):
+    """
+    Returns:
+    - A Dictionary with the last stage of a file and everything recorded
+      about it so far, or None when the journal has no unfinished work for
+      it
+    """
+    return self._states.get(os.path.abspath(musicFile))
+
+  def stage(self, musicFile):
+    state = self.state(musicFile)
+    return state['stage'] if state else None
+
+  def log(self, musicFile, stage, **fields):
+    """
+    Append a stage to the journal and wait for it to reach the disk.
+
+    Args:
+    - musicFile: The path the file was found at
+    - stage: One of STAGES
+    - fields: JSON-serialisable values recorded with the stage
+    """
+    if stage not in STAGES:
+      raise ValueError(f"Unknown stage: {stage}")
+    musicFile = os.path.abspath(musicFile)
+    record = dict(fields, file=musicFile, stage=stage, time=time.time())
+    line = json.dumps(record) + '\n'
+    with self._lock:
+      self._file.write(line)
+      self._file.flush()
+      if self.fsync:
+        os.fsync(self._file.fileno())
+      self._apply(record)
+      self._records += 1
+      if self._records - len(self._states) >= self.compact_records:
+        self._compact()
+
+  def unfinished(self):
+    """
+    Returns:
+    - The paths (as found) of the files a previous run left unfinished
+    """
+    return list(self._states)
+
+  def close(self):
+    self._file.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+
+def _find_moved(musicFile, newPath, inode):
+  # The move may have picked a numbered name, the inode tells which one
+  number = 1
+  while os.path.exists(numbered_path(newPath, number)):
+    candidate = numbered_path(newPath, number)
+    if inode is None or os.stat(candidate).st_ino == inode:
+      return candidate
+    number += 1
+  raise FileNotFoundError(f"{musicFile} is gone and was not renamed")
+
+
+def journaled_edit_and_rename(journal, parameters, musicFile,
+                              newFolder=None, coverArt=None):
+  """
+  Tag and rename a music file like `editAndRenameTrack`, journaling each
+  step and skipping the steps a previous run already finished.
+
+  Args:
+  - journal: The RunJournal
+  - parameters: The song information returned by `get_required_song_info`,
+    with a title and an artist
+  - musicFile: The path the file was found at
+  - newFolder: The folder the renamed file is moved to (created if needed),
+    or None to rename it in its own folder
+  - coverArt: Optional front cover image data to embed
+
+  Returns:
+  - The new path of the file
+  """
+  state = journal.state(musicFile) or {}
+  stage = state.get('stage')
+  if stage == 'renamed':
+    return state['new_path']
+  if stage == 'tagged':
+    newPath = state['new_path']
+  else:
+    newFolder = newFolder or os.path.dirname(os.path.abspath(musicFile))
+    os.makedirs(newFolder, exist_ok=True)
+    newPath = os.path.abspath(os.path.join(newFolder, track_filename(
+        parameters['trackTitle'], parameters['trackArtist'])))
+
+  if os.path.exists(musicFile):
+    # Logged before the tag is written, so a crash later can find the file
+    journal.log(musicFile, 'tagged', new_path=newPath,
+                inode=os.stat(musicFile).st_ino)
+    writeSongInfo(parameters, musicFile, coverArt=coverArt)
+    with metrics.span('rename'):
+      newPath = move_file(musicFile, newPath)
+  else:
+    # Tagged and moved, only the 'renamed' record was lost
+    newPath = _find_moved(musicFile, newPath, state.get('inode'))
+  journal.log(musicFile, 'renamed', old_path=os.path.abspath(musicFile),
+              new_path=newPath)
+  return newPath
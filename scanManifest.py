@@ -0,0 +1,187 @@
+import asyncio
+import ctypes
+import ctypes.util
+import os
+import sqlite3
+import struct
+import time
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+class ScanManifest:
+  """
+  Persistent record of the files that have already been catalogued.
+
+  Each catalogued file is stored under the path it ended up at (after
+  `renameSongTrack`), together with its size, mtime and inode and the path
+  it was found at, so a re-scan only has to stat each file to know whether
+  it is new or modified.
+
+  Args:
+  - path: The SQLite database file
+  """
+
+  def __init__(self, path='scan_manifest.sqlite'):
+    self.path = path
+    self._connection = sqlite3.connect(path)
+    self._connection.execute('PRAGMA journal_mode=WAL')
+    self._connection.execute(
+        'CREATE TABLE IF NOT EXISTS files ('
+        ' path TEXT PRIMARY KEY,'
+        ' size INTEGER NOT NULL,'
+        ' mtime_ns INTEGER NOT NULL,'
+        ' inode INTEGER NOT NULL,'
+        ' source_path TEXT,'
+        ' catalogued REAL NOT NULL)')
+    self._connection.commit()
+    self._known = None
+
+  def _snapshot(self):
+    if self._known is None:
+      self._known = {
+          path: (size, mtime_ns, inode)
+          for path, size, mtime_ns, inode in self._connection.execute(
+              'SELECT path, size, mtime_ns, inode FROM files')
+      }
+    return self._known
+
+  def is_current(self, musicFile):
+    """
+    Returns:
+    - True if the file was catalogued and has not changed since, False if
+      it is new, modified or missing
+    """
+    try:
+      stat = os.stat(musicFile)
+    except OSError:
+      return False
+    return self._snapshot().get(os.path.abspath(musicFile)) \
+        == (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+  def record(self, musicFile, catalogedFile=None):
+    """
+    Mark a file as catalogued.
+
+    Args:
+    - musicFile: The path the file was found at
+    - catalogedFile: The path the file was renamed to, if it was renamed
+    """
+    catalogedFile = os.path.abspath(catalogedFile or musicFile)
+    stat = os.stat(catalogedFile)
+    key = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+    self._connection.execute(
+        'INSERT OR REPLACE INTO files'
+        ' (path, size, mtime_ns, inode, source_path, catalogued)'
+        ' VALUES (?, ?, ?, ?, ?, ?)',
+        (catalogedFile, *key, os.path.abspath(musicFile), time.time()))
+    self._connection.commit()
+    self._snapshot()[catalogedFile] = key
+
+  def cataloged_path(self, musicFile):
+    """
+    Returns:
+    - The path a file was renamed to when it was catalogued, or None
+    """
+    row = self._connection.execute(
+        'SELECT path FROM files WHERE source_path = ?'
+        ' ORDER BY catalogued DESC LIMIT 1',
+        (os.path.abspath(musicFile), )).fetchone()
+    return row[0] if row else None
+
+  def close(self):
+    self._connection.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+
+class FolderWatcher:
+  """
+  Asynchronous iterator over the files written into a folder tree, based on
+  Linux inotify.
+
+  A path is yielded once a file is closed after writing or moved into the
+  tree; sub-folders created later are watched as well.
+
+  Args:
+  - musicFolder: The root folder to watch
+  """
+
+  def __init__(self, musicFolder):
+    libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                       use_errno=True)
+    self._libc = libc
+    self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    if self._fd < 0:
+      errno = ctypes.get_errno()
+      raise OSError(errno, os.strerror(errno))
+    self._folders = {}
+    self._events = asyncio.Queue()
+    for folder, _, _ in os.walk(musicFolder):
+      self._watch(folder)
+    asyncio.get_running_loop().add_reader(self._fd, self._read_events)
+
+  def _watch(self, folder):
+    descriptor = self._libc.inotify_add_watch(self._fd, os.fsencode(folder),
+                                              WATCH_MASK)
+    if descriptor < 0:
+      errno = ctypes.get_errno()
+      print(f"Cannot watch {folder}: {os.strerror(errno)}")
+      return
+    self._folders[descriptor] = folder
+
+  def _read_events(self):
+    try:
+      data = os.read(self._fd, 64 * 1024)
+    except BlockingIOError:
+      return
+
+    position = 0
+    while position < len(data):
+      descriptor, mask, _, length = _EVENT_HEADER.unpack_from(data, position)
+      position += _EVENT_HEADER.size
+      name = os.fsdecode(data[position:position + length].rstrip(b'\0'))
+      position += length
+
+      if mask & IN_Q_OVERFLOW:
+        print("inotify queue overflowed, some files were missed")
+        continue
+      if mask & IN_IGNORED:
+        self._folders.pop(descriptor, None)
+        continue
+      folder = self._folders.get(descriptor)
+      if folder is None or not name:
+        continue
+      path = os.path.join(folder, name)
+      if mask & IN_ISDIR:
+        if mask & (IN_CREATE | IN_MOVED_TO):
+          # Files may have landed before the new folder was watched
+          for subfolder, _, files in os.walk(path):
+            self._watch(subfolder)
+            for file_name in files:
+              self._events.put_nowait(os.path.join(subfolder, file_name))
+      elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+        self._events.put_nowait(path)
+
+  def __aiter__(self):
+    return self
+
+  async def __anext__(self):
+    return await self._events.get()
+
+  def close(self):
+    if self._fd >= 0:
+      asyncio.get_running_loop().remove_reader(self._fd)
+      os.close(self._fd)
+      self._fd = -1
@@ -0,0 +1,127 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from pipelineMetrics import metrics
+from windowedRecognition import WINDOW_POSITIONS
+
+
+def make_signature(musicFile, window_seconds=None, position=0.5):
+  """
+  Decode a music file and compute its Shazam signature.
+
+  This is the CPU-bound half of `Shazam.recognize_song` and is meant to run
+  in a worker process.
+
+  Args:
+  - musicFile: The path to the music file
+  - window_seconds: Only decode a window of this many seconds, or None to
+    decode the whole file
+  - position: Where the window is centred, as a fraction of the track
+
+  Returns:
+  - The signature (a picklable shazamio DecodedMessage), or None when the
+    audio is too short to be signed
+  """
+  from pydub import AudioSegment
+  from shazamio.converter import Converter
+
+  from windowedRecognition import audio_duration, load_window, window_starts
+
+  audio = None
+  if window_seconds:
+    duration = audio_duration(musicFile)
+    if duration and duration > window_seconds:
+      start, = window_starts(duration, window_seconds, (position, ))
+      audio = load_window(musicFile, start, window_seconds)
+  if audio is None:
+    audio = AudioSegment.from_file(musicFile)
+
+  audio = Converter.normalize_audio_data(audio)
+  generator = Converter.create_signature_generator(audio)
+  signature = generator.get_next_signature()
+  if len(generator.input_pending_processing) < 128:
+    return None
+  while not signature:
+    if len(generator.input_pending_processing) - generator.samples_processed \
+        < 128:
+      return None
+    signature = generator.get_next_signature()
+  return signature
+
+
+def _timed_signature(*args):
+  started = time.perf_counter()
+  return make_signature(*args), time.perf_counter() - started
+
+
+def signature_executor(workers=None):
+  """
+  Returns:
+  - A ProcessPoolExecutor for signature generation, one process per core by
+    default
+  """
+  return ProcessPoolExecutor(max_workers=workers or os.cpu_count())
+
+
+class SignatureRecognizer:
+  """
+  Drop-in for `Shazam.recognize_song` that computes signatures in a process
+  pool and only sends the prepared signature from the event loop.
+
+  `prepare` lets a producer start the CPU stage ahead of the network stage;
+  `recognize_song` then picks up the prepared signature (or computes it if
+  nobody prepared it).
+
+  Args:
+  - shazam: The Shazam client used to send the signatures
+  - executor: The ProcessPoolExecutor the signatures are computed in
+  - window_seconds: Sign windows of this many seconds instead of whole
+    files; the next window in WINDOW_POSITIONS is tried on a miss
+  """
+
+  def __init__(self, shazam, executor, window_seconds=None):
+    self.shazam = shazam
+    self.executor = executor
+    self.window_seconds = window_seconds
+    self._prepared = {}
+
+  def _submit(self, musicFile, position=WINDOW_POSITIONS[0]):
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(self.executor, _timed_signature, musicFile,
+                                self.window_seconds, position)
+
+  def prepare(self, musicFile):
+    """Start computing the signature of a file in the process pool."""
+    if musicFile not in self._prepared:
+      self._prepared[musicFile] = self._submit(musicFile)
+
+  def discard(self, musicFile):
+    """Forget a prepared signature that will not be sent."""
+    future = self._prepared.pop(musicFile, None)
+    if future is not None and not future.cancel():
+      # Already running, retrieve the result so errors aren't logged
+      future.add_done_callback(lambda future: future.exception())
+
+  @property
+  def pending(self):
+    return len(self._prepared)
+
+  async def recognize_song(self, musicFile):
+    future = self._prepared.pop(musicFile, None) or self._submit(musicFile)
+    positions = WINDOW_POSITIONS if self.window_seconds else (None, )
+
+    out = {'matches': []}
+    for number, position in enumerate(positions):
+      if number:
+        future = self._submit(musicFile, position)
+      # Timed in the worker process, so the time spent queued isn't counted
+      signature, seconds = await future
+      metrics.observe('signature', seconds)
+      if signature is None:
+        break
+      out = await self.shazam.send_recognize_request(signature)
+      if out.get('matches'):
+        break
+    return out
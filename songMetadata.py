@@ -1,5 +1,21 @@
+import errno
 import os
+import threading
+
 import eyed3
+import eyed3.id3
+
+from pipelineMetrics import metrics
+
+MUSIC_FOLDER = u'test/music_folder'
+# Padding reserved when a tag outgrows the space in front of the audio and
+# the whole file has to be rewritten, so later edits are written in place.
+# eyed3 only takes it from its module global, set once here.
+TAG_PADDING = 16 * 1024
+eyed3.id3.tag.DEFAULT_PADDING = TAG_PADDING
+
+_tag_writes = {'in_place': 0, 'rewritten': 0}
+_tag_writes_lock = threading.Lock()
 
 
 def get_music_metadata(track):
@@ -21,32 +37,222 @@ def get_music_metadata(track):
   return audio_data
 
 
-def renameSongTrack(filePath, newFolder=u'test/music_folder'):
+def track_filename(title, artist):
+  return f"{title} - {artist}.mp3"
+
+
+def numbered_path(path, number):
+  """
+  Returns:
+  - `path` itself for 1, otherwise `path` with " (number)" added before the
+    extension
+  """
+  if number == 1:
+    return path
+  base, extension = os.path.splitext(path)
+  return f"{base} ({number}){extension}"
+
+
+def move_file(source, target):
+  """
+  Move a file without ever replacing another file.
+
+  The file is hard linked at its new name, which fails instead of
+  overwriting, and only then unlinked from the old one. When another file
+  already has the name, the first free `numbered_path` is used, so two rips
+  of the same song both survive. File systems without hard links fall
+  back to checking the name before renaming.
+
+  Args:
+  - source: The path of the file to move
+  - target: The path it should be moved to
+
+  Returns:
+  - The path the file was moved to
+  """
+  number = 1
+  while True:
+    candidate = numbered_path(target, number)
+    try:
+      os.link(source, candidate)
+    except FileExistsError:
+      if os.path.samefile(source, candidate):
+        # Already moved there, by an interrupted move or in a previous run
+        break
+      number += 1
+      continue
+    except OSError as error:
+      if error.errno not in (errno.EPERM, errno.ENOTSUP, errno.EOPNOTSUPP):
+        raise
+      # No hard links (FAT, some network shares)
+      if os.path.exists(candidate):
+        if os.path.samefile(source, candidate):
+          return candidate  # Already has the name
+        number += 1
+        continue
+      os.rename(source, candidate)
+      return candidate
+    break
+  if os.path.abspath(source) != os.path.abspath(candidate):
+    os.unlink(source)
+  return candidate
+
+
+def renameSongTrack(filePath, newFolder=MUSIC_FOLDER, tag=None):
   """
   Rename a music file based on its metadata.
 
   Parameters:
   - filePath (str): The path to the music file.
+  - newFolder (str): The folder the renamed file is moved to.
+  - tag (eyed3.id3.Tag): The already parsed tag of the file, if available.
 
   Returns:
-  - None
+  - str: The new filename.
 
   Description:
   This function takes a file path as input, extracts metadata (such as title and artist) from the audio file, and renames the file according to its metadata.
+  When `tag` is given the file is not parsed again. An existing file with
+  the same name is never replaced, see `move_file`.
 
   Note:
   - The function assumes that the audio file is in MP3 format.
   """
 
-  # Load metadata from the audio file
-  audiofile = eyed3.load(filePath)
-  new_filename = f"{audiofile.tag.title} - {audiofile.tag.artist}.mp3"
-  os.rename(filePath, f"{newFolder}/{new_filename}")
+  if tag is None:
+    # Load metadata from the audio file
+    with metrics.span('eyed3_load'):
+      tag = eyed3.load(filePath).tag
+  with metrics.span('rename'):
+    newPath = move_file(
+        filePath, f"{newFolder}/{track_filename(tag.title, tag.artist)}")
   
-  return new_filename
+  return os.path.basename(newPath)
+
+
+def _image_mime_type(data):
+  if data.startswith(b'\x89PNG\r\n\x1a\n'):
+    return 'image/png'
+  return 'image/jpeg'
+
+
+def _apply_song_info(tag, parameters, coverArt=None):
+  if parameters.get('trackTitle'):
+    tag.title = parameters['trackTitle']
+  if parameters.get('trackArtist'):
+    tag.artist = parameters['trackArtist']
+  if parameters.get('Album'):
+    tag.album = parameters['Album']
+  if parameters.get('Label'):
+    tag.publisher = parameters['Label']
+  if coverArt:
+    tag.images.set(eyed3.id3.frames.ImageFrame.FRONT_COVER, coverArt,
+                   _image_mime_type(coverArt))
+
+  # ***Having issues implenting this***
+  # if parameters['Released']:
+    #year = parameters['Released']
+    #released_year = eyed3.core.Date(int(year))
+    #audio_file.tag.release_date = released_year
+
+
+def writeSongInfo(parameters, file_path, tag=None, coverArt=None):
+  """
+  Tag a music file in place, without renaming it.
+
+  Args:
+      parameters (dict): The song information returned by
+                         `get_required_song_info`.
+      file_path (str): The file path of the music file to be edited.
+      tag (eyed3.id3.Tag): An optional Tag object to reuse for parsing.
+      coverArt (bytes): Optional front cover image (JPEG or PNG) to embed.
+
+  Returns:
+      eyed3.id3.Tag: The tag that was written.
+  """
+  if tag is None:
+    tag = eyed3.id3.Tag()
+  # A file without a tag leaves `tag` cleared, ready for a new ID3v2 tag
+  with metrics.span('tag_parse'):
+    tag.parse(file_path)
+  old_size = tag.file_info.tag_size if tag.file_info else 0
+
+  _apply_song_info(tag, parameters, coverArt)
+  # eyed3 patches the tag in place when it fits in the old tag and its
+  # padding, and otherwise rewrites the file with TAG_PADDING bytes
+  with metrics.span('tag_save'):
+    tag.save(file_path)
+  # A rewrite always changes the tag size, an in place write never does
+  write = 'in_place' if old_size and tag.file_info.tag_size == old_size \
+      else 'rewritten'
+  with _tag_writes_lock:
+    _tag_writes[write] += 1
+  metrics.increment('tag_writes', mode=write)
+  return tag
+
+
+def tag_write_stats():
+  """
+  Returns:
+  - A Dictionary with the number of tags written in place and of files
+    rewritten because their tag outgrew its padding, since the process
+    started
+  """
+  with _tag_writes_lock:
+    return dict(_tag_writes)
 
 
-def editMusicTag(parameters, file_path):
+def editAndRenameTrack(parameters, file_path, newFolder=MUSIC_FOLDER,
+                       tag=None, coverArt=None):
+  """
+  Tag a music file and rename it from the written values in one pass.
+
+  Only the ID3 tag is parsed (the MPEG audio frames are never scanned) and
+  the new filename is computed from the tag held in memory, so each file is
+  parsed exactly once.
+
+  Args:
+      parameters (dict): The song information returned by
+                         `get_required_song_info`.
+      file_path (str): The file path of the music file to be edited.
+      newFolder (str): The folder the renamed file is moved to.
+      tag (eyed3.id3.Tag): An optional Tag object to reuse for parsing.
+      coverArt (bytes): Optional front cover image (JPEG or PNG) to embed.
+
+  Returns:
+      str: The new filename.
+  """
+  tag = writeSongInfo(parameters, file_path, tag, coverArt)
+  return renameSongTrack(file_path, newFolder, tag=tag)
+
+
+def editMusicTags(songs, newFolder=MUSIC_FOLDER):
+  """
+  Tag and rename a batch of music files.
+
+  A single Tag object is reused for every file, and a failure on one file
+  does not stop the rest of the batch.
+
+  Args:
+      songs (iterable): `(song_info, file_path)` pairs.
+      newFolder (str): The folder the renamed files are moved to.
+
+  Returns:
+      list: The new filename of each file, or None where tagging failed.
+  """
+  tag = eyed3.id3.Tag()
+  newFilenames = []
+  for parameters, file_path in songs:
+    try:
+      newFilenames.append(
+          editAndRenameTrack(parameters, file_path, newFolder, tag=tag))
+    except Exception as error:
+      print(f"{file_path} could not be tagged: {error!r}")
+      newFilenames.append(None)
+  return newFilenames
+
+
+def editMusicTag(parameters, file_path, coverArt=None):
   """
   Edit the tags of a music file specified by the file path using the provided
   parameters.
@@ -57,6 +263,7 @@ def editMusicTag(parameters, file_path):
                          'PUBLISHER', 'RELEASE_DATE'.
                          Each key should map to the corresponding tag value.
       file_path (str): The file path of the music file to be edited.
+      coverArt (bytes): Optional front cover image (JPEG or PNG) to embed.
 
   Raises:
       ValueError: If the file path is invalid or if the specified tag
@@ -65,30 +272,7 @@ def editMusicTag(parameters, file_path):
   Returns:
       None
   """
-  audio_file = eyed3.load(file_path)
-  if not audio_file.tag:
-    audio_file.initTag()
-    
-  if parameters['trackTitle']:
-    audio_file.tag.title = parameters['trackTitle']
-  if parameters['trackArtist']:
-    audio_file.tag.artist = parameters['trackArtist']
-  if parameters['Album']:
-    audio_file.tag.album = parameters['Album']
-  if parameters['Label']:
-    audio_file.tag.publisher = parameters['Label']
-  
-    
-  # ***Having issues implenting this***
-# if parameters['Released']:
-    #year = parameters['Released']
-    #released_year = eyed3.core.Date(int(year))
-    #audio_file.tag.release_date = released_year
-
-  audio_file.tag.save()
-  newFilename = renameSongTrack(file_path)
-  
-  return newFilename
+  return editAndRenameTrack(parameters, file_path, coverArt=coverArt)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,34 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# One silent MPEG-1 layer III frame, 128 kbps, 44.1 kHz
+SILENT_FRAME = b'\xff\xfb\x90\x64' + b'\x00' * 413
+
+
+@pytest.fixture
+def make_mp3(tmp_path):
+  """Returns a function writing an untagged second of silence to tmp_path."""
+
+  def make(name, content=b''):
+    path = tmp_path / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # `content` makes the audio (and its hash) differ between files
+    path.write_bytes(SILENT_FRAME * 38 + content)
+    return str(path)
+  return make
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+  """Returns MUSIC_FOLDER, created below tmp_path."""
+  from songMetadata import MUSIC_FOLDER
+
+  # MUSIC_FOLDER is relative to the working directory
+  monkeypatch.chdir(tmp_path)
+  os.makedirs(MUSIC_FOLDER)
+  return os.path.abspath(MUSIC_FOLDER)
@@ -0,0 +1,127 @@
+import pytest
+
+from helper import (
+  SongInfoExtractor,
+  _extractor_for,
+  compile_path,
+  get_nested_value,
+  get_required_song_info,
+  required_song_info,
+)
+
+SHAZAM_DATA = {
+    'track': {
+        'key': '432365947',
+        'urlparams': {
+            '{tracktitle}': 'Side+Effects+%28feat.+Emily+Warren%29',
+            '{trackartist}': 'The+Chainsmokers',
+        },
+        'images': {
+            'coverarthq': 'https://example.com/a%2Fb/400x400cc.jpg?q=a+b',
+        },
+        'hub': {
+            'actions': [
+                {'name': 'apple', 'type': 'applemusicplay', 'id': '1'},
+                {'name': 'apple', 'type': 'uri', 'uri': 'https://preview'},
+            ],
+        },
+        'sections': [
+            {'type': 'LYRICS', 'text': ['la la']},
+            {'type': 'SONG', 'metadata': [
+                {'title': 'Album', 'text': 'Sick Boy'},
+                {'title': 'Released', 'text': '2018'},
+            ]},
+        ],
+    },
+}
+
+
+@pytest.mark.parametrize('path, value', [
+    ('track', SHAZAM_DATA['track']),
+    (['track', 'key'], '432365947'),
+    (('track', 'images', 'coverarthq'),
+     'https://example.com/a%2Fb/400x400cc.jpg?q=a+b'),
+    (['track', 'urlparams', '{trackartist}'], 'The+Chainsmokers'),
+    (['track', 'missing'], None),
+    (['track', 'key', 'deeper'], None),
+    (['track', 'images', 'coverarthq', 'deeper'], None),
+    (['track', 'hub', 'actions', 1, 'uri'], 'https://preview'),
+    (['track', 'hub', 'actions', -1, 'uri'], 'https://preview'),
+    (['track', 'hub', 'actions', 2, 'uri'], None),
+    (['track', 'key', 0], None),
+    (['track', 'hub', 'actions', {'type': 'uri'}, 'uri'], 'https://preview'),
+    (['track', 'hub', 'actions', {'name': 'apple', 'type': 'applemusicplay'},
+      'id'], '1'),
+    (['track', 'hub', 'actions', {'type': 'missing'}, 'uri'], None),
+    (['track', 'sections', {'type': 'SONG'}, 'metadata', 0, 'text'],
+     'Sick Boy'),
+])
+def test_paths(path, value):
+  assert compile_path(path)(SHAZAM_DATA) == value
+  assert get_nested_value(SHAZAM_DATA, path) == value
+
+
+def test_paths_on_missing_data():
+  assert get_nested_value({}, ['track', 'key']) is None
+  assert get_nested_value(None, ['track', 'key', 'deeper']) is None
+  assert get_nested_value({'track': None}, ['track', 0]) is None
+
+
+def test_only_urlparams_values_are_decoded():
+  song_info = get_required_song_info(SHAZAM_DATA)
+
+  assert song_info['trackTitle'] == 'Side Effects (feat. Emily Warren)'
+  assert song_info['trackArtist'] == 'The Chainsmokers'
+  # URLs are kept as Shazam sent them
+  assert song_info['coverArt'] == SHAZAM_DATA['track']['images']['coverarthq']
+  assert song_info['trackKey'] == '432365947'
+
+
+def test_sections_are_matched_by_type():
+  song_info = get_required_song_info(SHAZAM_DATA)
+
+  assert song_info['Album'] == 'Sick Boy'
+  assert song_info['Released'] == '2018'
+  assert 'text' not in song_info
+  lyrics = SongInfoExtractor({'sections': ['track', 'sections']},
+                             section_types=('LYRICS', ))
+  assert lyrics(SHAZAM_DATA) == {}
+
+
+def test_missing_and_non_string_values_are_left_out():
+  assert get_required_song_info({}) == {}
+  song_info = get_required_song_info({'track': {'key': 7, 'sections': 'x'}})
+  assert song_info == {}
+
+
+def test_an_extractor_keeps_its_own_copy_of_the_mapping():
+  mapping = {'trackKey': ['track', 'key']}
+  extractor = SongInfoExtractor(mapping)
+  mapping['trackKey'] = ['track', 'missing']
+
+  assert extractor(SHAZAM_DATA) == {'trackKey': '432365947'}
+
+
+def test_extractors_are_reused_per_mapping():
+  mapping = {'trackKey': ['track', 'key']}
+
+  assert _extractor_for(mapping) is _extractor_for(mapping)
+  assert _extractor_for(required_song_info) is _extractor_for(
+      required_song_info)
+
+
+def test_a_mapping_changed_in_place_is_compiled_again():
+  mapping = {'trackKey': ['track', 'key']}
+  assert get_required_song_info(SHAZAM_DATA, mapping) == {
+      'trackKey': '432365947'}
+  first = _extractor_for(mapping)
+
+  mapping['trackKey'] = ['track', 'hub', 'actions', {'type': 'uri'}, 'uri']
+  mapping['albumName'] = ['track', 'sections', 1, 'metadata', 0, 'text']
+
+  assert get_required_song_info(SHAZAM_DATA, mapping) == {
+      'trackKey': 'https://preview', 'albumName': 'Sick Boy'}
+  assert _extractor_for(mapping) is not first
+  # A path changed inside the mapping too
+  mapping['albumName'][4] = 1
+  assert get_required_song_info(SHAZAM_DATA, mapping)['albumName'] == '2018'
@@ -0,0 +1,163 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from fakeShazam import FakeShazam, FakeShazamError
+from jobQueue import JobJournal, JobQueue, LeaseLost, run_worker
+
+
+@pytest.fixture
+def queue(tmp_path):
+  with JobQueue(str(tmp_path / 'jobs.sqlite'), lease_seconds=0.2) as queue:
+    yield queue
+
+
+def expire(queue):
+  time.sleep(queue.lease_seconds * 1.5)
+
+
+def test_adding_a_file_twice_queues_it_once(queue):
+  assert queue.add(['a.mp3', 'b.mp3']) == 2
+  assert queue.add(['a.mp3']) == 0
+  assert queue.counts() == {'queued': 2}
+
+
+def test_a_job_is_leased_by_one_worker_at_a_time(queue):
+  queue.add(['a.mp3', 'b.mp3'])
+  first = queue.lease('first', 1)
+  second = queue.lease('second', 5)
+  assert len(first) == 1 and len(second) == 1
+  assert first != second
+  assert queue.lease('third', 5) == []
+  assert queue.counts() == {'leased': 2}
+
+
+def test_heartbeats_keep_a_lease(queue):
+  queue.add(['a.mp3'])
+  path, = queue.lease('first')
+  for _ in range(3):
+    time.sleep(queue.lease_seconds / 4)
+    assert queue.heartbeat('first', [path]) == []
+  assert queue.lease('second') == []
+
+
+def test_an_expired_lease_is_taken_over(queue):
+  queue.add(['a.mp3'])
+  path, = queue.lease('dead')
+  assert queue.record_progress('dead', path, {'stage': 'recognized'})
+  expire(queue)
+
+  assert queue.lease('second') == [path]
+  # The first worker finds out at its next heartbeat or record
+  assert queue.heartbeat('dead', [path]) == [path]
+  assert not queue.record_progress('dead', path, {'stage': 'tagged'})
+  assert not queue.complete('dead', path)
+  assert not queue.fail('dead', path, 'late error')
+  # The progress of the first worker is handed over
+  assert queue.progress(path) == {'stage': 'recognized'}
+  assert queue.complete('second', path)
+  assert queue.counts() == {'done': 1}
+  assert queue.progress(path) is None
+
+
+def test_the_journal_stops_a_worker_that_lost_its_lease(queue):
+  queue.add(['a.mp3'])
+  path, = queue.lease('dead')
+  journal = JobJournal(queue, 'dead')
+  journal.log(path, 'recognized', song_info={'trackTitle': 'Title'})
+  expire(queue)
+  queue.lease('second')
+
+  with pytest.raises(LeaseLost):
+    journal.log(path, 'tagged', new_path='/music/a.mp3')
+  assert JobJournal(queue, 'second').stage(path) == 'recognized'
+
+
+def test_failed_jobs_are_retried_up_to_max_attempts(queue):
+  queue.add(['a.mp3'])
+  for attempt in range(1, 4):
+    path, = queue.lease('worker')
+    queue.record_progress('worker', path, {'stage': 'renamed'})
+    assert queue.fail('worker', path, 'disk full', max_attempts=3)
+    assert queue.counts() == {'queued' if attempt < 3 else 'failed': 1}
+  assert queue.lease('worker') == []
+  # The retries resume from the stages that succeeded
+  assert queue.progress(path) == {'stage': 'renamed'}
+
+  assert queue.requeue('failed') == 1
+  assert queue.lease('worker') == [path]
+
+
+def test_a_job_whose_leases_keep_expiring_is_given_up(queue):
+  # Its worker dies every time, e.g. the decoder crashes on the file
+  queue.add(['a.mp3'])
+  for _ in range(queue.max_attempts):
+    assert len(queue.lease('doomed')) == 1
+    expire(queue)
+
+  assert queue.lease('next') == []
+  assert queue.counts() == {'failed': 1}
+  assert queue.requeue('failed') == 1
+
+
+def test_a_worker_catalogs_every_job(queue, make_mp3, library):
+  paths = [make_mp3(f'rips/{number}.mp3', bytes([number]))
+           for number in range(6)]
+  queue.add(paths)
+  shazam = FakeShazam(latency=0.01, jitter=0)
+
+  stats = asyncio.run(run_worker(queue, concurrency=3, shazam=shazam,
+                                 newFolder=library))
+
+  assert stats == {'catalogued': 6, 'failed': 0, 'missed': 0,
+                   'lost_leases': 0}
+  assert queue.counts() == {'done': 6}
+  assert shazam.requests == 6
+  assert len(os.listdir(library)) == 6
+
+
+def test_a_worker_takes_over_the_jobs_of_a_dead_one(queue, make_mp3,
+                                                    library):
+  paths = [make_mp3(f'rips/{number}.mp3', bytes([number]))
+           for number in range(4)]
+  queue.add(paths)
+  abandoned = queue.lease('dead', 2)
+  queue.record_progress('dead', abandoned[0], {
+      'stage': 'recognized', 'song_info': {'trackTitle': 'Resumed',
+                                           'trackArtist': 'Artist'}})
+  shazam = FakeShazam(latency=0, jitter=0)
+
+  stats = asyncio.run(run_worker(queue, shazam=shazam, poll_interval=0.05,
+                                 newFolder=library))
+
+  assert stats['catalogued'] == 4
+  assert queue.counts() == {'done': 4}
+  # The job recognised before the worker died is not sent again
+  assert shazam.requests == 3
+  assert os.path.exists(os.path.join(library, 'Resumed - Artist.mp3'))
+
+
+def test_a_failing_file_is_given_up_after_max_attempts(queue, make_mp3,
+                                                       library):
+  good = make_mp3('rips/good.mp3', b'good')
+  bad = make_mp3('rips/bad.mp3', b'bad')
+  queue.add([good, bad])
+  shazam = FakeShazam(latency=0, jitter=0)
+  synthetic = shazam.responses
+
+  def responses(data):
+    if data == bad:
+      raise FakeShazamError('503 Service Unavailable')
+    return synthetic(data)
+
+  shazam.responses = responses
+  stats = asyncio.run(run_worker(queue, shazam=shazam, max_attempts=2,
+                                 newFolder=library))
+
+  assert stats['catalogued'] == 1
+  assert stats['failed'] == 2
+  assert queue.counts() == {'done': 1, 'failed': 1}
+  assert os.path.exists(bad)  # Left where it was
+  assert len(os.listdir(library)) == 1
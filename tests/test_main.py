@@ -0,0 +1,69 @@
+import asyncio
+import contextlib
+import os
+
+from fakeShazam import FakeShazam
+from main import catalog_library
+from runJournal import RunJournal
+from scanManifest import ScanManifest
+
+
+async def watch_and_drop(library, make_mp3, shazam, count, **kwargs):
+  task = asyncio.create_task(catalog_library(
+      library, concurrency=4, report_interval=None, watch=True, shazam=shazam,
+      **kwargs))
+  await asyncio.sleep(0.2)
+  for number in range(count):
+    make_mp3(os.path.join(library, f'{number}.mp3'), bytes([number]))
+  # Until the pipeline has gone quiet, its own writes included
+  while True:
+    requests = shazam.requests
+    await asyncio.sleep(0.5)
+    if shazam.requests == requests and shazam.in_flight == 0:
+      break
+  task.cancel()
+  with contextlib.suppress(asyncio.CancelledError):
+    await task
+
+
+def test_watch_mode_ignores_its_own_writes(make_mp3, library, tmp_path,
+                                           capsys):
+  shazam = FakeShazam(latency=0.05, jitter=0.02)
+  with RunJournal(str(tmp_path / 'journal.jsonl'), fsync=False) as journal, \
+      ScanManifest(str(tmp_path / 'manifest.sqlite')) as manifest:
+    asyncio.run(watch_and_drop(library, make_mp3, shazam, 20,
+                               journal=journal, manifest=manifest))
+    assert journal.unfinished() == []
+
+  assert shazam.requests == 20
+  assert capsys.readouterr().out.count('Catalouged!!') == 20
+  assert len(os.listdir(library)) == 20
+
+
+def test_files_are_renamed_in_their_own_folders(make_mp3, tmp_path):
+  first = make_mp3('lib/a/1.mp3', b'1')
+  second = make_mp3('lib/b/2.mp3', b'2')
+  shazam = FakeShazam(latency=0, jitter=0)
+
+  stats = asyncio.run(catalog_library(str(tmp_path / 'lib'),
+                                      report_interval=None, shazam=shazam))
+
+  assert stats['catalogued'] == 2 and stats['failed'] == 0
+  for musicFile in (first, second):
+    folder = os.path.dirname(musicFile)
+    assert not os.path.exists(musicFile)
+    assert len(os.listdir(folder)) == 1
+
+
+def test_a_missing_destination_is_created_before_tagging(make_mp3, tmp_path):
+  make_mp3('lib/a/1.mp3', b'1')
+  make_mp3('lib/b/2.mp3', b'2')
+  destination = tmp_path / 'sorted' / 'music'
+  shazam = FakeShazam(latency=0, jitter=0)
+
+  stats = asyncio.run(catalog_library(str(tmp_path / 'lib'),
+                                      report_interval=None, shazam=shazam,
+                                      newFolder=str(destination)))
+
+  assert stats['catalogued'] == 2 and stats['failed'] == 0
+  assert len(os.listdir(destination)) == 2
@@ -0,0 +1,176 @@
+import asyncio
+
+import pytest
+
+from fakeShazam import FakeShazam, FakeShazamError
+from recognitionScheduler import AdaptiveLimiter, CircuitBreaker, RecognitionScheduler
+
+
+def test_breaker_opens_after_consecutive_failures():
+  breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+  breaker.record(False)
+  breaker.record(False)
+  breaker.record(True)  # A success resets the count
+  breaker.record(False)
+  breaker.record(False)
+  assert breaker.state == CircuitBreaker.CLOSED
+  breaker.record(False)
+  assert breaker.state == CircuitBreaker.OPEN
+  assert breaker.opened == 1
+
+
+def test_breaker_lets_one_probe_through_then_closes():
+  breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+  breaker.record(False)
+
+  async def probe():
+    await asyncio.wait_for(breaker.wait_ready(), 1)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # A second caller waits for the probe's outcome
+    second = asyncio.create_task(breaker.wait_ready())
+    await asyncio.sleep(0.1)
+    assert not second.done()
+    breaker.record(True)
+    await asyncio.wait_for(second, 1)
+
+  asyncio.run(probe())
+  assert breaker.state == CircuitBreaker.CLOSED
+  assert breaker.failures == 0
+
+
+def test_failed_probe_reopens_for_twice_as_long():
+  breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05,
+                           max_reset_timeout=0.15)
+
+  async def fail_probes(count):
+    for _ in range(count):
+      await asyncio.wait_for(breaker.wait_ready(), 1)
+      assert breaker.state == CircuitBreaker.HALF_OPEN
+      breaker.record(False)
+
+  breaker.record(False)
+  asyncio.run(fail_probes(1))
+  assert breaker.state == CircuitBreaker.OPEN
+  assert breaker._open_for == pytest.approx(0.1)
+  asyncio.run(fail_probes(2))
+  assert breaker._open_for == pytest.approx(0.15)
+  assert breaker.opened == 4
+
+
+def test_limiter_grows_additively_and_shrinks_multiplicatively():
+  limiter = AdaptiveLimiter(initial=4, minimum=1, maximum=5,
+                            latency_target=0.0, backoff=0.5)
+
+  async def requests(outcomes):
+    for ok in outcomes:
+      await limiter.acquire()
+      await limiter.release(ok, 0.0)
+    return limiter.limit
+
+  async def run():
+    assert await requests([True]) == pytest.approx(4.25)
+    assert await requests([True] * 20) == 5  # Capped at the maximum
+    assert await requests([False]) == 2.5
+    assert await requests([False] * 5) == 1  # Never below the minimum
+
+  asyncio.run(run())
+
+
+def test_limiter_decreases_once_per_latency_target():
+  limiter = AdaptiveLimiter(initial=8, latency_target=60)
+
+  async def failures(count):
+    for _ in range(count):
+      await limiter.acquire()
+      await limiter.release(False, 0.0)
+
+  asyncio.run(failures(3))
+  assert limiter.limit == 4  # The failures of one round count once
+
+
+def test_limiter_holds_requests_beyond_the_limit():
+  limiter = AdaptiveLimiter(initial=2)
+
+  async def run():
+    await limiter.acquire()
+    await limiter.acquire()
+    third = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0.05)
+    assert not third.done()
+    await limiter.release(True, 0.0)
+    await asyncio.wait_for(third, 1)
+    assert limiter.in_flight == 2
+
+  asyncio.run(run())
+
+
+def test_a_probe_cancelled_while_queued_frees_the_breaker():
+  shazam = FakeShazam(latency=0, jitter=0)
+  breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+  breaker.record(False)
+  limiter = AdaptiveLimiter(initial=1)
+  scheduler = RecognitionScheduler(shazam, limiter, breaker)
+
+  async def run():
+    await limiter.acquire()  # Every slot is taken
+    probe = asyncio.create_task(scheduler.recognize_song('a.mp3'))
+    await asyncio.sleep(0.1)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    probe.cancel()
+    await asyncio.gather(probe, return_exceptions=True)
+    await limiter.release(True, 0.0)
+    # The next caller sends the probe instead
+    return await asyncio.wait_for(scheduler.recognize_song('b.mp3'), 1)
+
+  assert asyncio.run(run())['matches']
+  assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_scheduler_retries_then_raises_and_opens_the_circuit():
+  shazam = FakeShazam(latency=0, jitter=0, error_rate=1.0, seed=1)
+  breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+  scheduler = RecognitionScheduler(shazam, breaker=breaker, retries=2,
+                                   backoff=0)
+
+  with pytest.raises(FakeShazamError):
+    asyncio.run(scheduler.recognize_song('a.mp3'))
+  assert shazam.requests == 3
+  assert scheduler.stats()['retried'] == 2
+  assert scheduler.stats()['circuit'] == CircuitBreaker.OPEN
+
+
+def test_scheduler_recovers_from_transient_failures():
+  shazam = FakeShazam(latency=0, jitter=0, error_rate=0.5, seed=3)
+  scheduler = RecognitionScheduler(shazam, retries=10, backoff=0)
+
+  async def run():
+    return [await scheduler.recognize_song(f'{index}.mp3')
+            for index in range(20)]
+
+  assert all(out['matches'] for out in asyncio.run(run()))
+  assert scheduler.errors == shazam.failures > 0
+  assert scheduler.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_scheduler_times_out_hung_requests():
+  shazam = FakeShazam(latency=0, jitter=0, hang_rate=1.0)
+  scheduler = RecognitionScheduler(shazam, timeout=0.05, retries=1,
+                                   backoff=0)
+
+  with pytest.raises(asyncio.TimeoutError):
+    asyncio.run(scheduler.recognize_song('a.mp3'))
+  assert scheduler.timeouts == 2
+
+
+def test_scheduler_does_not_retry_missing_files():
+  async def recognize_song(_):
+    raise FileNotFoundError('gone.mp3')
+
+  shazam = FakeShazam()
+  shazam.recognize_song = recognize_song
+  scheduler = RecognitionScheduler(shazam, retries=3, backoff=0)
+
+  with pytest.raises(FileNotFoundError):
+    asyncio.run(scheduler.recognize_song('gone.mp3'))
+  assert scheduler.requests == 1
+  assert scheduler.breaker.state == CircuitBreaker.CLOSED
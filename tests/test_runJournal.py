@@ -0,0 +1,182 @@
+import asyncio
+import os
+
+import eyed3
+import pytest
+
+from fakeShazam import FakeShazam, make_shazam_response
+from helper import get_required_song_info
+from main import main
+from musicCatalog import MusicCatalog
+from runJournal import RunJournal, journaled_edit_and_rename
+from songMetadata import move_file
+
+SONG_INFO = get_required_song_info(make_shazam_response(7, lyrics_lines=0))
+SONG_FILE = f"{SONG_INFO['trackTitle']} - {SONG_INFO['trackArtist']}.mp3"
+
+
+@pytest.fixture
+def journal(tmp_path):
+  with RunJournal(str(tmp_path / 'journal.jsonl'), fsync=False) as journal:
+    yield journal
+
+
+def line_count(path):
+  with open(path, encoding='utf-8') as journal_file:
+    return sum(1 for _ in journal_file)
+
+
+def title(path):
+  return eyed3.load(path).tag.title
+
+
+def test_reopening_replays_the_stages(journal):
+  journal.log('a.mp3', 'recognized', song_info=SONG_INFO)
+  journal.log('a.mp3', 'tagged', new_path='/music/a.mp3', inode=1)
+  journal.log('b.mp3', 'recognized', song_info=SONG_INFO)
+  journal.close()
+
+  with RunJournal(journal.path, fsync=False) as reopened:
+    assert reopened.stage('a.mp3') == 'tagged'
+    assert reopened.state('a.mp3')['song_info'] == SONG_INFO
+    assert reopened.state('a.mp3')['new_path'] == '/music/a.mp3'
+    assert reopened.stage('b.mp3') == 'recognized'
+    assert sorted(reopened.unfinished()) == [os.path.abspath('a.mp3'),
+                                             os.path.abspath('b.mp3')]
+
+
+def test_a_torn_record_is_ignored(journal):
+  journal.log('a.mp3', 'recognized', song_info=SONG_INFO)
+  journal.close()
+  with open(journal.path, 'a', encoding='utf-8') as journal_file:
+    journal_file.write('{"file": "a.mp3", "stage": "tagg')
+
+  with RunJournal(journal.path, fsync=False) as reopened:
+    assert reopened.stage('a.mp3') == 'recognized'
+
+
+def test_unknown_stages_are_refused(journal):
+  with pytest.raises(ValueError):
+    journal.log('a.mp3', 'catalogued')
+
+
+def test_finished_files_are_forgotten_and_compacted(journal):
+  for name in ('a.mp3', 'b.mp3'):
+    for stage in ('recognized', 'tagged', 'renamed', 'done'):
+      journal.log(name, stage)
+  journal.log('c.mp3', 'recognized')
+  assert journal.stage('a.mp3') is None
+  assert journal.unfinished() == [os.path.abspath('c.mp3')]
+  journal.close()
+
+  with RunJournal(journal.path, fsync=False) as reopened:
+    assert reopened.unfinished() == [os.path.abspath('c.mp3')]
+  assert line_count(journal.path) == 1
+
+
+def test_the_journal_compacts_itself_as_it_grows(tmp_path):
+  path = str(tmp_path / 'journal.jsonl')
+  with RunJournal(path, fsync=False, compact_records=10) as journal:
+    for number in range(100):
+      journal.log(f'{number}.mp3', 'recognized')
+      journal.log(f'{number}.mp3', 'done')
+    journal.log('last.mp3', 'recognized')
+    assert line_count(path) <= 10
+  with RunJournal(path, fsync=False) as reopened:
+    assert reopened.unfinished() == [os.path.abspath('last.mp3')]
+
+
+def test_a_new_file_is_tagged_renamed_and_journaled(make_mp3, journal):
+  musicFile = make_mp3('rips/a.mp3')
+  newPath = journaled_edit_and_rename(journal, SONG_INFO, musicFile)
+
+  # Renamed in its own folder
+  assert newPath == os.path.join(os.path.dirname(musicFile), SONG_FILE)
+  assert not os.path.exists(musicFile)
+  assert title(newPath) == SONG_INFO['trackTitle']
+  assert journal.stage(musicFile) == 'renamed'
+  assert journal.state(musicFile)['old_path'] == musicFile
+
+
+def test_resume_from_recognized_skips_shazam(make_mp3, journal, library):
+  musicFile = make_mp3('rips/a.mp3')
+  journal.log(musicFile, 'recognized', song_info=SONG_INFO)
+  shazam = FakeShazam(latency=0, jitter=0)
+
+  song_info = asyncio.run(main(musicFile, shazam, journal=journal,
+                               newFolder=library))
+
+  assert song_info == SONG_INFO
+  assert shazam.requests == 0
+  assert title(os.path.join(library, SONG_FILE)) == SONG_INFO['trackTitle']
+  assert journal.stage(musicFile) is None  # Done and forgotten
+
+
+def test_resume_from_tagged_before_the_move(make_mp3, journal, library):
+  # The crash came before or while the tag was written
+  musicFile = make_mp3('rips/a.mp3')
+  target = os.path.join(library, 'Chosen - Before.mp3')
+  journal.log(musicFile, 'recognized', song_info=SONG_INFO)
+  journal.log(musicFile, 'tagged', new_path=target,
+              inode=os.stat(musicFile).st_ino)
+
+  newPath = journaled_edit_and_rename(journal, SONG_INFO, musicFile)
+
+  # The name chosen before the crash is kept
+  assert newPath == target
+  assert title(target) == SONG_INFO['trackTitle']
+  assert journal.stage(musicFile) == 'renamed'
+
+
+def test_resume_from_tagged_after_the_move(make_mp3, journal, library):
+  # The file was moved to a numbered name, the 'renamed' record was lost
+  musicFile = make_mp3('rips/a.mp3')
+  other = make_mp3(os.path.join(library, SONG_FILE), b'other audio')
+  target = os.path.join(library, SONG_FILE)
+  journal.log(musicFile, 'recognized', song_info=SONG_INFO)
+  journal.log(musicFile, 'tagged', new_path=target,
+              inode=os.stat(musicFile).st_ino)
+  moved = move_file(musicFile, target)
+  assert moved != other
+
+  newPath = journaled_edit_and_rename(journal, SONG_INFO, musicFile)
+
+  assert newPath == moved
+  assert journal.state(musicFile)['new_path'] == moved
+  assert os.path.exists(other)
+
+
+def test_resume_from_renamed_touches_nothing(make_mp3, journal, library):
+  target = make_mp3(os.path.join(library, SONG_FILE))
+  before = os.stat(target).st_mtime_ns
+  journal.log('gone.mp3', 'recognized', song_info=SONG_INFO)
+  journal.log('gone.mp3', 'renamed', old_path='gone.mp3', new_path=target)
+
+  assert journaled_edit_and_rename(journal, SONG_INFO, 'gone.mp3') == target
+  assert os.stat(target).st_mtime_ns == before
+
+
+def test_resume_from_renamed_finishes_the_catalog(make_mp3, journal, library,
+                                                  tmp_path):
+  target = make_mp3(os.path.join(library, SONG_FILE))
+  musicFile = str(tmp_path / 'rips' / 'a.mp3')
+  journal.log(musicFile, 'recognized', song_info=SONG_INFO)
+  journal.log(musicFile, 'renamed', old_path=musicFile, new_path=target)
+  shazam = FakeShazam(latency=0, jitter=0)
+
+  with MusicCatalog(str(tmp_path / 'catalog.sqlite')) as catalog:
+    asyncio.run(main(musicFile, shazam, journal=journal, catalog=catalog))
+    tracks = catalog.query(title=SONG_INFO['trackTitle'])
+
+  assert shazam.requests == 0
+  assert [track['path'] for track in tracks] == [target]
+  assert journal.stage(musicFile) is None
+
+
+def test_a_missing_file_that_was_never_moved_is_an_error(journal, library):
+  journal.log('gone.mp3', 'recognized', song_info=SONG_INFO)
+  journal.log('gone.mp3', 'tagged',
+              new_path=os.path.join(library, SONG_FILE), inode=1)
+
+  with pytest.raises(FileNotFoundError):
+    journaled_edit_and_rename(journal, SONG_INFO, 'gone.mp3')
@@ -0,0 +1,101 @@
+import errno
+import os
+
+import pytest
+
+from songMetadata import move_file, numbered_path
+
+
+def write(path, content):
+  path.parent.mkdir(parents=True, exist_ok=True)
+  path.write_bytes(content)
+  return str(path)
+
+
+def read(path):
+  with open(path, 'rb') as music_file:
+    return music_file.read()
+
+
+@pytest.fixture(params=[errno.EPERM, errno.ENOTSUP])
+def no_hard_links(request, monkeypatch):
+  # What FAT and some network shares answer
+  def link(*_):
+    raise OSError(request.param, os.strerror(request.param))
+
+  monkeypatch.setattr(os, 'link', link)
+
+
+def test_numbered_paths():
+  assert numbered_path('a/Song.mp3', 1) == 'a/Song.mp3'
+  assert numbered_path('a/Song.mp3', 3) == 'a/Song (3).mp3'
+
+
+def test_a_file_is_moved_to_a_free_name(tmp_path):
+  source = write(tmp_path / 'rips' / 'a.mp3', b'a')
+  target = str(tmp_path / 'Song.mp3')
+
+  assert move_file(source, target) == target
+  assert not os.path.exists(source)
+  assert read(target) == b'a'
+
+
+def test_an_existing_file_is_never_replaced(tmp_path):
+  target = write(tmp_path / 'Song.mp3', b'first')
+  write(tmp_path / 'Song (2).mp3', b'second')
+  source = write(tmp_path / 'rips' / 'a.mp3', b'third')
+
+  moved = move_file(source, target)
+
+  assert moved == str(tmp_path / 'Song (3).mp3')
+  assert read(target) == b'first'
+  assert read(tmp_path / 'Song (2).mp3') == b'second'
+  assert read(moved) == b'third'
+  assert not os.path.exists(source)
+
+
+def test_an_interrupted_move_is_finished(tmp_path):
+  # Linked at the new name, the crash came before the old name was removed
+  source = write(tmp_path / 'rips' / 'a.mp3', b'a')
+  target = str(tmp_path / 'Song.mp3')
+  os.link(source, target)
+
+  assert move_file(source, target) == target
+  assert not os.path.exists(source)
+  assert read(target) == b'a'
+
+
+def test_a_file_already_at_its_name_stays(tmp_path):
+  path = write(tmp_path / 'Song.mp3', b'a')
+
+  assert move_file(path, path) == path
+  assert read(path) == b'a'
+
+
+@pytest.mark.usefixtures('no_hard_links')
+def test_without_hard_links_the_name_is_checked_first(tmp_path):
+  target = write(tmp_path / 'Song.mp3', b'first')
+  source = write(tmp_path / 'rips' / 'a.mp3', b'second')
+
+  moved = move_file(source, target)
+
+  assert moved == str(tmp_path / 'Song (2).mp3')
+  assert read(target) == b'first'
+  assert read(moved) == b'second'
+  assert not os.path.exists(source)
+
+
+def test_other_link_errors_are_raised(tmp_path):
+  source = write(tmp_path / 'rips' / 'a.mp3', b'a')
+
+  with pytest.raises(FileNotFoundError):
+    move_file(source, str(tmp_path / 'missing' / 'Song.mp3'))
+  assert read(source) == b'a'
+
+
+@pytest.mark.usefixtures('no_hard_links')
+def test_without_hard_links_a_file_already_at_its_name_stays(tmp_path):
+  path = write(tmp_path / 'Song.mp3', b'a')
+
+  assert move_file(path, path) == path
+  assert os.listdir(tmp_path) == ['Song.mp3']
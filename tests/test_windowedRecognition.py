@@ -0,0 +1,60 @@
+import shutil
+import subprocess
+
+import numpy as np
+import pytest
+
+from windowedRecognition import load_window, mp3_duration, window_starts
+
+needs_ffmpeg = pytest.mark.skipif(shutil.which('ffmpeg') is None,
+                                  reason='ffmpeg is not installed')
+
+
+@pytest.fixture
+def two_tones(tmp_path):
+  """A 60 second MP3, 440 Hz for the first 30 seconds and 880 Hz after."""
+  path = str(tmp_path / 'tones.mp3')
+  subprocess.run(
+      ['ffmpeg', '-nostdin', '-v', 'error', '-f', 'lavfi', '-i',
+       'aevalsrc=sin(2*PI*if(lt(t\\,30)\\,440\\,880)*t):d=60', '-b:a', '128k',
+       path], check=True)
+  return path
+
+
+def dominant_frequency(audio):
+  samples = np.array(audio.get_array_of_samples(), dtype=np.float32)
+  spectrum = np.abs(np.fft.rfft(samples))
+  return spectrum.argmax() * audio.frame_rate / len(samples)
+
+
+def test_the_duration_comes_from_the_frame_header(make_mp3):
+  # 38 frames of 1152 samples at 44.1 kHz
+  assert mp3_duration(make_mp3('a.mp3')) == pytest.approx(38 * 1152 / 44100,
+                                                          rel=0.01)
+
+
+def test_windows_stay_inside_the_track():
+  assert window_starts(100, 12, (0.5, 0.25)) == [44, 19]
+  assert window_starts(20, 12, (0.99, )) == [8]
+  assert window_starts(10, 12, (0.5, 0.25)) == [0]
+
+
+@needs_ffmpeg
+def test_a_window_is_decoded_from_its_start(two_tones):
+  window = load_window(two_tones, 40, 5)
+
+  assert len(window) == pytest.approx(5000, abs=50)
+  assert window.frame_rate == 16000 and window.channels == 1
+  assert dominant_frequency(window) == pytest.approx(880, abs=5)
+  assert dominant_frequency(load_window(two_tones, 10, 5, 8000)) \
+      == pytest.approx(440, abs=5)
+
+
+@needs_ffmpeg
+def test_a_file_ffmpeg_cannot_decode_raises(tmp_path):
+  from pydub.exceptions import CouldntDecodeError
+
+  path = tmp_path / 'broken.mp3'
+  path.write_bytes(b'not audio')
+  with pytest.raises(CouldntDecodeError):
+    load_window(str(path), 0, 5)
@@ -0,0 +1,180 @@
+import asyncio
+import struct
+import subprocess
+
+from recognitionCache import audio_payload_span
+
+WINDOW_SECONDS = 12
+WINDOW_POSITIONS = (0.5, 0.25)
+# Shazam signs 16 kHz mono audio
+WINDOW_FRAME_RATE = 16000
+
+_MP3_BITRATES = {
+    3: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_MP3_SAMPLE_RATES = {
+    3: (44100, 48000, 32000),
+    2: (22050, 24000, 16000),
+    0: (11025, 12000, 8000),
+}
+_FRAME_SEARCH_BYTES = 64 * 1024
+
+
+def mp3_duration(musicFile):
+  """
+  Estimate the duration of an MP3 file from its first MPEG frame.
+
+  Uses the frame count of a Xing/Info or VBRI header when there is one and
+  the bitrate of the first frame otherwise, so only a few kilobytes are
+  read.
+
+  Args:
+  - musicFile: The path to the MP3 file
+
+  Returns:
+  - The duration in seconds, or None if no MPEG layer III frame was found
+  """
+  start, end = audio_payload_span(musicFile)
+  with open(musicFile, 'rb') as music_file:
+    music_file.seek(start)
+    data = music_file.read(_FRAME_SEARCH_BYTES)
+
+  position = data.find(b'\xff')
+  while 0 <= position <= len(data) - 4:
+    header, = struct.unpack('>I', data[position:position + 4])
+    version = (header >> 19) & 3
+    layer = (header >> 17) & 3
+    bitrate_index = (header >> 12) & 15
+    rate_index = (header >> 10) & 3
+    if (header >> 21) == 0x7ff and version != 1 and layer == 1 \
+        and 0 < bitrate_index < 15 and rate_index < 3:
+      break
+    position = data.find(b'\xff', position + 1)
+  else:
+    return None
+
+  sample_rate = _MP3_SAMPLE_RATES[version][rate_index]
+  bitrate = _MP3_BITRATES[3 if version == 3 else 2][bitrate_index] * 1000
+  samples_per_frame = 1152 if version == 3 else 576
+  mono = (header >> 6) & 3 == 3
+  side_info = (17 if mono else 32) if version == 3 else (9 if mono else 17)
+
+  xing = position + 4 + side_info
+  if data[xing:xing + 4] in (b'Xing', b'Info') and len(data) >= xing + 12:
+    flags, frames = struct.unpack('>II', data[xing + 4:xing + 12])
+    if flags & 1 and frames:
+      return frames * samples_per_frame / sample_rate
+  vbri = position + 36
+  if data[vbri:vbri + 4] == b'VBRI' and len(data) >= vbri + 18:
+    frames, = struct.unpack('>I', data[vbri + 14:vbri + 18])
+    if frames:
+      return frames * samples_per_frame / sample_rate
+
+  return (end - start - position) * 8 / bitrate
+
+
+def audio_duration(musicFile):
+  """
+  Returns:
+  - The duration of a music file in seconds, read from the MPEG headers for
+    MP3 files and from ffprobe otherwise
+  """
+  if musicFile.lower().endswith('.mp3'):
+    duration = mp3_duration(musicFile)
+    if duration is not None:
+      return duration
+
+  from pydub.utils import mediainfo
+
+  return float(mediainfo(musicFile).get('duration') or 0)
+
+
+def load_window(musicFile, start, duration, frame_rate=WINDOW_FRAME_RATE):
+  """
+  Decode only `duration` seconds of a music file starting at `start`.
+
+  ffmpeg is given `-ss` and `-t` as input options, so it seeks in the file
+  (with the Xing table or the bitrate for MP3s) and stops reading after the
+  window: the audio before and after it is never decoded.
+
+  Args:
+  - musicFile: The path to the music file
+  - start: The start of the window, in seconds
+  - duration: The length of the window, in seconds
+  - frame_rate: The sample rate to decode to, the window is mono
+
+  Returns:
+  - A pydub AudioSegment
+  """
+  from pydub import AudioSegment
+  from pydub.exceptions import CouldntDecodeError
+
+  command = [AudioSegment.converter, '-nostdin', '-v', 'error',
+             '-ss', f'{start:.3f}', '-t', f'{duration:.3f}', '-i', musicFile,
+             '-f', 's16le', '-ac', '1', '-ar', str(frame_rate), '-']
+  result = subprocess.run(command, stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE, check=False)
+  if result.returncode:
+    raise CouldntDecodeError(
+        f"Decoding {musicFile} failed: "
+        f"{result.stderr.decode(errors='replace').strip()}")
+  return AudioSegment(data=result.stdout, sample_width=2,
+                      frame_rate=frame_rate, channels=1)
+
+
+def window_starts(duration, window_seconds=WINDOW_SECONDS,
+                  positions=WINDOW_POSITIONS):
+  """
+  Returns:
+  - The start second of each window, centred on `positions` (fractions of
+    the track) and kept inside the track
+  """
+  starts = []
+  for position in positions:
+    start = min(max(0.0, duration * position - window_seconds / 2),
+                max(0.0, duration - window_seconds))
+    if start not in starts:
+      starts.append(start)
+  return starts
+
+
+class WindowedRecognizer:
+  """
+  Drop-in for `Shazam.recognize_song` that sends Shazam a short window of
+  the track instead of the whole file.
+
+  The first window is taken from the middle of the track; the following
+  windows in `positions` are only tried when the previous one did not
+  match.
+
+  Args:
+  - shazam: The Shazam client
+  - window_seconds: The length of each window
+  - positions: Where the windows are centred, as fractions of the track
+  """
+
+  def __init__(self, shazam, window_seconds=WINDOW_SECONDS,
+               positions=WINDOW_POSITIONS):
+    self.shazam = shazam
+    self.window_seconds = window_seconds
+    self.positions = positions
+    self.windows_sent = 0
+
+  async def recognize_song(self, musicFile):
+    loop = asyncio.get_running_loop()
+    duration = await loop.run_in_executor(None, audio_duration, musicFile)
+    if not duration or duration <= self.window_seconds:
+      self.windows_sent += 1
+      return await self.shazam.recognize_song(musicFile)
+
+    out = {'matches': []}
+    for start in window_starts(duration, self.window_seconds,
+                               self.positions):
+      window = await loop.run_in_executor(None, load_window, musicFile, start,
+                                          self.window_seconds)
+      self.windows_sent += 1
+      out = await self.shazam.recognize_song(window)
+      if out.get('matches'):
+        break
+    return out